@@ -0,0 +1,442 @@
+"""
+money.py的性能基准测试和模拟账本生成工具\n
+结果保存为JSON文件， 可以在不同的提交之间比较导入吞吐量和查询延迟
+"""
+
+from typing import Dict, Any, List, Callable, Iterator, Optional, Tuple
+from typing_extensions import Annotated
+from pathlib import Path
+from datetime import datetime
+from enum import Enum
+from contextlib import contextmanager, redirect_stdout
+import bisect
+import csv
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+import typer
+
+import money
+import money_core
+
+# 标签词表， 越靠前的标签被使用得越频繁
+TAG_VOCABULARY = [
+    "餐饮", "交通", "日常支出", "超市", "水果", "咖啡", "外卖", "房租", "水电",
+    "话费", "网购", "服装", "医疗", "药品", "娱乐", "电影", "旅行", "酒店",
+    "机票", "书籍", "学习", "运动", "宠物", "礼物", "红包", "数码", "家具",
+    "维修", "保险", "理财", "工资", "奖金", "报销", "兼职", "利息", "退款",
+]  # fmt: skip
+INCOME_TAGS = {"工资", "奖金", "报销", "兼职", "利息", "退款"}
+# 一天里各个小时记账的相对频率， 集中在三餐和下班时间
+HOUR_WEIGHTS = [
+    1, 1, 1, 1, 1, 2, 4, 10, 14, 8, 6, 9, 16, 12, 6, 5, 6, 9, 15, 13, 10, 7, 4, 2,
+]  # fmt: skip
+DEFAULT_RESULT_PATH = "./bench_results.json"
+MONEY_SCRIPT = Path(__file__).with_name("money.py")
+# 测试启动时间的命令， 都只打印帮助， 不需要配置文件和数据库
+STARTUP_COMMANDS = {
+    "help": ["--help"],
+    "config-mongodb": ["config-mongodb", "--help"],
+    "query": ["query", "--help"],
+}
+
+
+class BenchBackend(str, Enum):
+    """
+    基准测试使用的存储后端， sqlite在进程内运行， 不需要数据库服务\n
+    mongomock不支持pymongo 4.11以后的批量写入， 测量出的也不是真实服务器的性能， 所以不提供
+    """
+
+    mongodb = "mongodb"
+    sqlite = "sqlite"
+
+
+def cumulative(weights: List[float]) -> List[float]:
+    return list(itertools.accumulate(weights))
+
+
+def generate_ledger(
+    rows: int, seed: int = 42, years: int = 5
+) -> Iterator[Tuple[float, List[str], datetime]]:
+    """
+    用固定的随机种子生成可复现的模拟账单\n
+    标签服从Zipf分布， 账单越接近当前越密集， 时间集中在三餐和下班， 金额服从对数正态分布
+    """
+    rng = random.Random(seed)
+    tagWeights = cumulative([1 / (i + 1) for i in range(len(TAG_VOCABULARY))])
+    hourWeights = cumulative(HOUR_WEIGHTS)
+    end = datetime(2024, 12, 31, 23, 59, 59).timestamp()
+    span = years * 365 * 86400
+
+    for _ in range(rows):
+        # 平方根让时间偏向区间的末尾， 模拟记账越来越勤的账本
+        day = int(end - span * (1 - math.sqrt(rng.random()))) // 86400 * 86400
+        hour = bisect.bisect(hourWeights, rng.random() * hourWeights[-1])
+        moment = datetime.fromtimestamp(day + hour * 3600 + rng.randrange(3600))
+
+        tags = set()
+        for _ in range(1 + int(rng.random() < 0.3) + int(rng.random() < 0.05)):
+            index = bisect.bisect(tagWeights, rng.random() * tagWeights[-1])
+            tags.add(TAG_VOCABULARY[index])
+
+        amount = round(rng.lognormvariate(3.5, 1.1), 2)
+        if tags.isdisjoint(INCOME_TAGS):
+            amount = -amount
+        else:
+            amount = round(amount * 20, 2)
+
+        yield (amount, sorted(tags), moment)
+
+
+def write_ledger(path: Path, rows: int, seed: int = 42) -> Path:
+    """
+    把模拟账单写入mass命令可以导入的csv文件， 逐行写入， 一千万行也不占用多少内存
+    """
+    with path.open("w", encoding="UTF-8", newline="") as fp:
+        writer = csv.writer(fp, lineterminator="\n")
+        for amount, tags, moment in generate_ledger(rows, seed):
+            writer.writerow(
+                [amount, " ".join(tags), moment.strftime("%Y-%m-%d %H:%M:%S")]
+            )
+
+    return path
+
+
+def time_call(fun: Callable[[], Any], number: int, repeat: int = 3) -> Dict[str, Any]:
+    """
+    重复执行repeat轮， 每轮调用number次， 取最快的一轮作为结果
+    """
+    best = math.inf
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        for _ in range(number):
+            fun()
+        best = min(best, time.perf_counter() - begin)
+
+    return {"seconds": best, "number": number, "ops_per_sec": number / best}
+
+
+def run_cli(line: str) -> float:
+    """
+    像命令行一样调用money.py的一个命令， 输出被丢弃， 返回耗时
+    """
+    with open(os.devnull, "w", encoding="UTF-8") as devnull, redirect_stdout(devnull):
+        begin = time.perf_counter()
+        try:
+            money.app(shlex.split(line), standalone_mode=False)
+        except SystemExit:
+            pass
+        return time.perf_counter() - begin
+
+
+def micro_benchmarks(number: int, repeat: int) -> Dict[str, Dict[str, Any]]:
+    """
+    解析和格式化这些不涉及存储后端的函数
+    """
+    moneyLog = money_core.MoneyLog(
+        money=-23.5, tags={"餐饮", "外卖"}, time_line=1718000000000
+    )
+    cases: Dict[str, Callable[[], Any]] = {
+        "parse_condition.operator": lambda: money.parse_condition("> 100"),
+        "parse_condition.range": lambda: money.parse_condition("0 - 100"),
+        "parse_condition.number": lambda: money.parse_condition("12.5"),
+        "TimeRangeStamp.month": lambda: money.TimeRangeStamp(
+            money.TimeQueryMode.month, "=3"
+        )(),
+        "TimeRangeStamp.year": lambda: money.TimeRangeStamp(
+            money.TimeQueryMode.year, "-2"
+        )(),
+        "TimeRangeStamp.range": lambda: money.TimeRangeStamp(
+            money.TimeQueryMode.range, "2024-04-01 2024-04-30"
+        )(),
+        "parseMoneyLog": lambda: money_core.parseMoneyLog(
+            ["-23.5", "餐饮 外卖", "2024-06-10 12:30:00"]
+        ),
+        "MoneyLog.fmt": moneyLog.fmt,
+    }
+    return {name: time_call(fun, number, repeat) for name, fun in cases.items()}
+
+
+@contextmanager
+def use_backend(backend: BenchBackend, workdir: Path, db_name: str) -> Iterator[None]:
+    """
+    在临时目录里写入配置文件， 让money.py使用指定的存储后端， mongodb使用当前配置的服务器\n
+    退出时删除mongodb的临时数据库， 并且总是回到原来的工作目录
+    """
+    # 只有mongodb后端需要用户的配置文件， 其他后端从默认配置开始
+    base = (
+        money_core.load_config()
+        if backend == BenchBackend.mongodb
+        else money_core.DEFAULT_MONGO_CONFIG
+    )
+    config = {**base, "db_name": db_name, "backend": "mongodb"}
+    if backend == BenchBackend.sqlite:
+        config.update(backend="sqlite", sqlite_path=str(workdir / "bench.db"))
+
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        Path(money_core.MONGO_CONFIG_PATH).write_text(
+            json.dumps(config), encoding="UTF-8"
+        )
+        money_core.load_config.cache_clear()
+        if backend != BenchBackend.mongodb:
+            yield
+            return
+
+        import mongo_backend
+
+        mongo_backend.get_mongo_client.cache_clear()
+        mongo_backend.get_collection.cache_clear()
+        try:
+            yield
+        finally:
+            collection = mongo_backend.get_collection()
+            collection.database.client.drop_database(collection.database.name)
+    finally:
+        os.chdir(cwd)
+
+
+def storage_benchmarks(
+    backend: BenchBackend, rows: int, seed: int, chunkSize: int
+) -> Dict[str, Dict[str, Any]]:
+    """
+    导入rows条模拟账单， 再用每一种sequel查询全部账单
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        with use_backend(backend, workdir, f"money_bench_{os.getpid()}"):
+            ledger = write_ledger(workdir / "ledger.csv", rows, seed)
+            seconds = run_cli(f"mass {ledger} --chunk-size {chunkSize}")
+            results["mass"] = {
+                "seconds": seconds,
+                "number": rows,
+                "ops_per_sec": rows / seconds,
+            }
+
+            queryAll = "query --time-mode year --time-string =20"
+            for sequel in money_core.Sequel:
+                if sequel in (
+                    money_core.Sequel.update,
+                    money_core.Sequel.remove,
+                    money_core.Sequel.update_all,
+                    money_core.Sequel.remove_all,
+                ):
+                    continue  # 需要交互输入， 批量修改和删除会改动测试账本
+                output = f"--output {workdir / f'out.{sequel.value}'}"
+                extra = output if sequel.value in ("json", "csv", "ndjson") else ""
+                seconds = run_cli(f"{queryAll} --sequel {sequel.value} {extra}")
+                results[f"query.{sequel.value}"] = {
+                    "seconds": seconds,
+                    "number": rows,
+                    "ops_per_sec": rows / seconds,
+                }
+
+    return results
+
+
+def import_times(args: List[str]) -> Tuple[float, Dict[str, float]]:
+    """
+    用 python -X importtime 在新进程里运行money.py， 返回 (总耗时, 每个顶层模块的累计导入毫秒数)
+    """
+    begin = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", str(MONEY_SCRIPT), *args],
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - begin
+
+    modules: Dict[str, float] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # 缩进表示被其他模块间接导入， 只统计顶层模块
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            modules[name.strip()] = int(cumulative) / 1000
+
+    return (elapsed, modules)
+
+
+def startup_benchmarks(repeat: int) -> Dict[str, Dict[str, Any]]:
+    """
+    每个命令启动repeat次， 取最快的一次
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    for name, args in STARTUP_COMMANDS.items():
+        elapsed, modules = min(
+            (import_times(args) for _ in range(repeat)), key=lambda it: it[0]
+        )
+        results[f"startup.{name}"] = {
+            "seconds": elapsed,
+            "number": 1,
+            "ops_per_sec": 1 / elapsed,
+            "import_ms": sum(modules.values()),
+        }
+
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+app = typer.Typer()
+
+
+@app.command()
+def generate(
+    rows: int,
+    output: Annotated[Path, typer.Option("--output", "-o")] = Path("./ledger.csv"),
+    seed: Annotated[int, typer.Option("--seed")] = 42,
+):
+    """
+    生成可以用mass命令导入的模拟账本\n
+    第一个参数 账单数量， 如 10000 1000000 10000000\n
+    --seed 随机种子 相同的种子生成相同的账本 默认42
+    """
+    begin = time.perf_counter()
+    write_ledger(output, rows, seed)
+    print(
+        f"已生成 {rows} 条账单到 {output}， 耗时 {time.perf_counter() - begin:.2f} 秒"
+    )
+
+
+@app.command()
+def run(
+    backend: Annotated[
+        BenchBackend, typer.Option("--backend", "-b")
+    ] = BenchBackend.sqlite,
+    rows: Annotated[int, typer.Option("--rows", "-r", min=1)] = 10000,
+    seed: Annotated[int, typer.Option("--seed")] = 42,
+    chunkSize: Annotated[int, typer.Option("--chunk-size", "-cs", min=1)] = 1000,
+    number: Annotated[int, typer.Option("--number", "-n", min=1)] = 10000,
+    repeat: Annotated[int, typer.Option("--repeat", min=1)] = 3,
+    output: Annotated[Path, typer.Option("--output", "-o")] = Path(DEFAULT_RESULT_PATH),
+):
+    """
+    运行基准测试， 结果追加到JSON文件\n
+    --backend 默认为sqlite， mongodb使用配置文件里的数据库， 会在临时数据库里测试， 结束后删除\n
+    --rows 导入和查询的模拟账单数量 默认10000\n
+    --number 解析和格式化函数每轮调用的次数 默认10000
+    """
+    result = {
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": backend.value,
+        "rows": rows,
+        "seed": seed,
+        "results": {
+            **startup_benchmarks(repeat),
+            **micro_benchmarks(number, repeat),
+            **storage_benchmarks(backend, rows, seed, chunkSize),
+        },
+    }
+
+    history = json.loads(output.read_text("UTF-8")) if output.exists() else []
+    history.append(result)
+    output.write_text(json.dumps(history, ensure_ascii=False, indent=2), "UTF-8")
+
+    money_core.write_rows(
+        ["项目", "耗时(秒)", "次数/秒"],
+        [
+            [name, f"{it['seconds']:.4f}", f"{it['ops_per_sec']:.0f}"]
+            for name, it in result["results"].items()
+        ],
+    )
+    print(f"结果已经保存到 {output}")
+
+
+@app.command()
+def startup(
+    args: Annotated[Optional[List[str]], typer.Argument()] = None,
+    top: Annotated[int, typer.Option("--top", "-n", min=1)] = 15,
+):
+    """
+    用 -X importtime 分析money.py启动时导入最慢的模块\n
+    参数是传给money.py的命令行， 如 startup -- query --help， 默认 --help
+    """
+    elapsed, modules = import_times(args or ["--help"])
+    slowest = sorted(modules.items(), key=lambda it: -it[1])[:top]
+    money_core.write_rows(
+        ["模块", "累计导入(ms)"], [[name, f"{ms:.1f}"] for name, ms in slowest]
+    )
+    print(f"启动总耗时 {elapsed * 1000:.0f}ms， 导入共 {sum(modules.values()):.0f}ms")
+
+
+@app.command()
+def compare(
+    base: Annotated[str, typer.Option("--base")] = "",
+    head: Annotated[str, typer.Option("--head")] = "",
+    threshold: Annotated[float, typer.Option("--threshold", "-t")] = 0.1,
+    output: Annotated[Path, typer.Option("--output", "-o")] = Path(DEFAULT_RESULT_PATH),
+):
+    """
+    比较同一个后端和账单数量的两次运行结果， 默认比较最后一次和它之前的一次\n
+    --base --head 提交的哈希值， 选择该提交最后一次运行的结果\n
+    --threshold 吞吐量下降超过这个比例时标记为退化 默认0.1
+    """
+    history = json.loads(output.read_text("UTF-8")) if output.exists() else []
+
+    # 只比较同一个后端和账单数量的结果， 默认用最后一次运行和它之前的一次比较
+    afters = [it for it in history if head in ("", it["commit"])]
+    after = afters[-1] if afters else None
+    befores = [
+        it
+        for it in history
+        if after is not None
+        and it is not after
+        and base in ("", it["commit"])
+        and (it["backend"], it["rows"]) == (after["backend"], after["rows"])
+        and history.index(it) < history.index(after)
+    ]
+    if after is None or len(befores) == 0:
+        print("没有足够的基准测试结果可以比较")
+        exit(-1)
+
+    before = befores[-1]
+    rows, regressed = [], False
+    for name, it in after["results"].items():
+        if (old := before["results"].get(name)) is None:
+            continue
+        change = it["ops_per_sec"] / old["ops_per_sec"] - 1
+        flag = "退化" if change < -threshold else ""
+        regressed = regressed or flag != ""
+        rows.append(
+            [
+                name,
+                f"{old['ops_per_sec']:.0f}",
+                f"{it['ops_per_sec']:.0f}",
+                f"{change:+.1%}",
+                flag,
+            ]
+        )
+
+    print(f"{before['commit'] or '?'} -> {after['commit'] or '?'}")
+    money_core.write_rows(["项目", "之前 次数/秒", "之后 次数/秒", "变化", ""], rows)
+    if regressed:
+        exit(1)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,125 @@
+# --*-- Encoding: UTF-8 --*--
+# * description: 用NumPy计算的统计报表， report命令才导入这个模块， numpy是可选的依赖
+
+from typing import List, Any, Tuple
+from datetime import datetime, date
+
+from money_core import MoneyLogBatch, ReportPeriod
+
+
+def require_numpy() -> Any:
+    """
+    按需导入numpy， 没有安装的时候给出提示并退出
+    """
+    try:
+        import numpy
+    except ImportError:
+        print("这个功能需要numpy， 请运行 `poetry install -E analytics` 安装")
+        exit(-1)
+
+    return numpy
+
+
+class LedgerReport:
+    """
+    用NumPy向量化计算MoneyLogBatch的统计报表\n
+    按周期汇总 按标签汇总 支出金额的百分位 以及7日和30日滚动平均
+    """
+
+    def __init__(self, batch: MoneyLogBatch):
+        """
+        batch 不能为空， 账单按照本地时区划分到每一天
+        """
+        np = require_numpy()
+        self.tags = batch.tags
+        self.money, time_line, offsets, self.tag_ids = batch.to_numpy()
+        first = date.fromtimestamp(int(time_line.min()) / 1000)
+        last = date.fromtimestamp(int(time_line.max()) / 1000)
+        self.dates = np.arange(np.datetime64(first, "D"), np.datetime64(last, "D") + 1)
+        # 每一天零点的时间戳， 由datetime计算所以夏令时也是正确的
+        starts = np.array(
+            [
+                int(datetime(it.year, it.month, it.day).timestamp() * 1000)
+                for it in self.dates.tolist()
+            ],
+            dtype=np.int64,
+        )
+        days = np.searchsorted(starts, time_line, side="right") - 1
+        self.daily_total = np.bincount(
+            days, weights=self.money, minlength=len(self.dates)
+        )
+        self.daily_count = np.bincount(days, minlength=len(self.dates))
+        # 每一个标签id对应的账单下标
+        self.tag_rows = np.repeat(np.arange(len(batch)), np.diff(offsets))
+
+    def rolling(self, window: int) -> Any:
+        """
+        每一天为止最近window天的每日平均， 开头不足window天的按实际天数计算
+        """
+        np = require_numpy()
+        cumsum = np.concatenate(([0.0], np.cumsum(self.daily_total)))
+        end = np.arange(1, len(self.dates) + 1)
+        begin = np.maximum(end - window, 0)
+        return (cumsum[end] - cumsum[begin]) / (end - begin)
+
+    def periods(self, period: ReportPeriod) -> Tuple[List[str], List[List[Any]]]:
+        """
+        按周期汇总金额和数量， 附带周期最后一天的7日和30日滚动平均
+        """
+        np = require_numpy()
+        if period == ReportPeriod.day:
+            keys = self.dates
+        elif period == ReportPeriod.week:
+            # 1970-01-01是星期四
+            keys = self.dates - (self.dates.astype(np.int64) + 3) % 7
+        else:
+            keys = self.dates.astype("datetime64[M]")
+
+        labels, inverse = np.unique(keys, return_inverse=True)
+        totals = np.bincount(inverse, weights=self.daily_total)
+        counts = np.bincount(inverse, weights=self.daily_count)
+        # keys是递增的， 每个周期的最后一天就是inverse发生变化之前的位置
+        lastDays = np.append(np.nonzero(np.diff(inverse))[0], len(inverse) - 1)
+        rolling7, rolling30 = self.rolling(7)[lastDays], self.rolling(30)[lastDays]
+        rows = [
+            [label, f"{total:.2f}", int(count), f"{r7:.2f}", f"{r30:.2f}"]
+            for label, total, count, r7, r30 in zip(
+                labels.astype(str).tolist(),
+                totals.tolist(),
+                counts.tolist(),
+                rolling7.tolist(),
+                rolling30.tolist(),
+            )
+        ]
+        return (["周期", "金额", "笔数", "7日平均", "30日平均"], rows)
+
+    def tagTotals(self) -> Tuple[List[str], List[List[Any]]]:
+        """
+        按标签汇总金额和数量， 按金额的绝对值从大到小排序
+        """
+        np = require_numpy()
+        size = len(self.tags)
+        sums = np.bincount(
+            self.tag_ids, weights=self.money[self.tag_rows], minlength=size
+        )
+        counts = np.bincount(self.tag_ids, minlength=size)
+        order = np.argsort(-np.abs(sums), kind="stable")
+        rows = [
+            [self.tags[i], f"{sums[i]:.2f}", int(counts[i])] for i in order.tolist()
+        ]
+        return (["标签", "金额", "笔数"], rows)
+
+    def percentiles(self, qs: List[float]) -> Tuple[List[str], List[List[Any]]]:
+        """
+        支出金额（取绝对值）的百分位数
+        """
+        np = require_numpy()
+        outlay = -self.money[self.money < 0]
+        if len(outlay) == 0:
+            return (["百分位", "支出"], [[f"p{q:g}", "-"] for q in qs])
+
+        values = np.percentile(outlay, qs)
+        return (
+            ["百分位", "支出"],
+            [[f"p{q:g}", f"{v:.2f}"] for q, v in zip(qs, values.tolist())],
+        )
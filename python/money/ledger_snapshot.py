@@ -0,0 +1,197 @@
+# --*-- Encoding: UTF-8 --*--
+# * description: 账单集合在本地的内存映射列式快照， sync命令和--local查询才导入这个模块
+
+from typing import Set, List, Dict, Any, Union, Tuple, TYPE_CHECKING
+from pathlib import Path
+from array import array
+import json
+import mmap
+import os
+
+from money_core import MONEYLOG_PROJECTION, now_timestamp, MoneyLogBatch
+
+if TYPE_CHECKING:
+    from mongo_backend import MongoConnection
+
+
+SYNC_SAFETY_MARGIN = 60 * 1000  # 增量同步时多回溯的毫秒数， 容忍客户端之间的时钟误差
+
+
+def map_column(path: Path, typecode: str) -> Any:
+    """
+    只读地把一个列文件映射到内存， 返回元素类型为typecode的memoryview\n
+    文件不存在或者为空时返回空数组
+    """
+    if not path.exists() or path.stat().st_size == 0:
+        return array(typecode)
+
+    with path.open("rb") as fp:
+        mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return memoryview(mapped).cast(typecode)
+
+
+class LedgerSnapshot:
+    """
+    账单集合在本地的内存映射列式快照， 用sync命令增量更新\n
+    每一列保存为一个定长元素的文件， 标签字典和同步水位保存在meta.json里
+    """
+
+    COLUMNS = {"money": "d", "time_line": "q", "tag_offsets": "q", "tag_ids": "i"}
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+
+    def meta(self) -> Dict[str, Any]:
+        try:
+            with (self.path / "meta.json").open(encoding="UTF-8") as fp:
+                return json.load(fp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def exists(self) -> bool:
+        return self.meta() != {}
+
+    def load(self) -> MoneyLogBatch:
+        """
+        把快照映射为MoneyLogBatch， 数据只在访问的时候才从磁盘读入
+        """
+        meta = self.meta()
+        if meta == {}:
+            print("本地快照不存在， 请先运行 `python money.py sync` 命令同步账单")
+            exit(-1)
+
+        batch = MoneyLogBatch()
+        for name, typecode in self.COLUMNS.items():
+            setattr(batch, name, map_column(self.path / name, typecode))
+        if len(batch.tag_offsets) == 0:
+            batch.tag_offsets = array("q", [0])
+        batch.tags = meta["tags"]
+        batch.tag_index = {tag: i for i, tag in enumerate(batch.tags)}
+        return batch
+
+    def sync(
+        self, connection: "MongoConnection", full: bool = False
+    ) -> Tuple[int, int, int]:
+        """
+        同步上次同步之后新增 修改和删除的账单， full为True时重新下载全部账单\n
+        每次写入都会设置updated_at， 只按照这个水位读取账单， id已经在快照里的算作修改\n
+        只有追加的时候直接写到列文件末尾， 有修改或删除时重写整个快照\n
+        返回 (新增的账单数量, 修改的账单数量, 删除的账单数量)
+        """
+        meta = self.meta()
+        # 旧版本的快照按_id记录水位， 那时新增的账单没有updated_at， 需要重新下载
+        if full or "last_id" in meta:
+            meta, full = {}, True
+        startedAt = now_timestamp()
+        watermark = meta.get("watermark")
+
+        fresh = MoneyLogBatch()
+        fresh.tags = list(meta.get("tags", []))
+        fresh.tag_index = {tag: i for i, tag in enumerate(fresh.tags)}
+        freshIds: List[bytes] = []
+        changed = {} if watermark is None else {"updated_at": {"$gte": watermark}}
+        for it in connection.iterDocs(
+            changed, projection=MONEYLOG_PROJECTION, batch_size=10000
+        ):
+            fresh.append(it["money"], it["time_line"], it["tags"])
+            freshIds.append(it["_id"].binary)
+
+        deleted: Set[bytes] = set()
+        updated: Set[bytes] = set()
+        if watermark is not None:
+            deleted = {
+                it["_id"].binary
+                for it in connection.tombstones.find(
+                    {"deleted_at": {"$gte": watermark}}
+                )
+            }
+            # 快照里没有的账单被删除时不需要处理， 也不算作删除
+            held = self.heldIds(set(freshIds) | deleted)
+            deleted &= held
+            updated = held & set(freshIds)
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        rows = 0 if full else meta.get("rows", 0)
+        if deleted or updated:
+            # 修改过的账单先移除旧版本， 再和新增的账单一起追加
+            rows = self.rewrite(deleted | updated)
+
+        self.append(fresh, b"".join(freshIds), rows)
+        meta = {
+            "rows": rows + len(fresh),
+            "watermark": startedAt - SYNC_SAFETY_MARGIN,
+            "tags": fresh.tags,
+        }
+        with (self.path / "meta.json").open("w", encoding="UTF-8") as fp:
+            json.dump(meta, fp, ensure_ascii=False)
+
+        return (len(fresh) - len(updated), len(updated), len(deleted))
+
+    def heldIds(self, candidates: Set[bytes]) -> Set[bytes]:
+        """
+        返回candidates里已经在快照中的账单id， 逐个比较， 不会把快照的全部id读成集合
+        """
+        if not candidates or not (self.path / "ids").exists():
+            return set()
+
+        ids = (self.path / "ids").read_bytes()
+        return {
+            id for i in range(0, len(ids), 12) if (id := ids[i : i + 12]) in candidates
+        }
+
+    def rewrite(self, removed: Set[bytes]) -> int:
+        """
+        重写快照， 去掉_id在removed里的账单， 返回剩余的账单数量
+        """
+        old = self.load()
+        ids = (self.path / "ids").read_bytes()
+        kept = MoneyLogBatch()
+        keptIds = bytearray()
+        for i in range(len(old)):
+            if ids[i * 12 : i * 12 + 12] not in removed:
+                kept.money.append(old.money[i])
+                kept.time_line.append(old.time_line[i])
+                kept.tag_ids.extend(
+                    old.tag_ids[old.tag_offsets[i] : old.tag_offsets[i + 1]]
+                )
+                kept.tag_offsets.append(len(kept.tag_ids))
+                keptIds += ids[i * 12 : i * 12 + 12]
+        # 替换文件之前必须关闭内存映射， 否则Windows上无法覆盖
+        for name in self.COLUMNS:
+            column = getattr(old, name)
+            if isinstance(column, memoryview):
+                mapped = column.obj
+                column.release()
+                mapped.close()
+        del old
+
+        for name in self.COLUMNS:
+            target = self.path / name
+            temp = target.with_suffix(".tmp")
+            temp.write_bytes(getattr(kept, name).tobytes())
+            os.replace(temp, target)
+        (self.path / "ids").write_bytes(bytes(keptIds))
+        return len(kept)
+
+    def append(self, fresh: MoneyLogBatch, ids: bytes, rows: int):
+        """
+        把新的账单追加到列文件末尾， rows是快照里已有的账单数量
+        """
+        mode, tagBase = "wb", 0
+        if rows > 0:
+            mode, tagBase = "ab", (self.path / "tag_ids").stat().st_size // 4
+        offsets = array(
+            "q", (tagBase + it for it in fresh.tag_offsets[1 if rows > 0 else 0 :])
+        )
+        columns = {
+            "money": fresh.money,
+            "time_line": fresh.time_line,
+            "tag_offsets": offsets,
+            "tag_ids": fresh.tag_ids,
+        }
+        for name, column in columns.items():
+            with (self.path / name).open(mode) as fp:
+                fp.write(column.tobytes())
+        with (self.path / "ids").open(mode) as fp:
+            fp.write(ids)
@@ -0,0 +1,422 @@
+# --*-- Encoding: UTF-8 --*--
+# * description: 账单存储后端的公共接口和查询结果的惰性视图， SQLite和MongoDB后端都实现LedgerStorage
+
+from typing import (
+    List,
+    Dict,
+    Any,
+    Union,
+    Optional,
+    Tuple,
+    Callable,
+    Iterable,
+    Iterator,
+)
+import time
+from datetime import tzinfo
+import json
+import base64
+import typer
+
+from money_core import (
+    DEFAULT_PAGE_SIZE,
+    MONEYLOG_PROJECTION,
+    BATCH_PROJECTION,
+    chunked,
+    user_input,
+    confirm,
+    Sequel,
+    BulkEdit,
+    MoneyLog,
+    inputMoneyLog,
+    moneylog_doc,
+    LedgerSummary,
+    TagTrie,
+    tag_completion,
+    MoneyLogBatch,
+    MoneyLogRenderer,
+    PROFILER,
+    HistogramBucket,
+    BulkInsertReport,
+)
+
+
+class MoneyLogCollection:
+    """
+    数据库查询结果的惰性视图， 只有在访问的时候才读取和校验账单\n
+    按页读取， 内存占用和页大小成正比， 只读取账单需要的字段
+    """
+
+    def __init__(
+        self,
+        connection: "LedgerStorage",
+        query: Dict[str, Any] = {},
+        sortMode: Dict[str, int] = {},
+        page_size: int = DEFAULT_PAGE_SIZE,
+    ):
+        self.connection = connection
+        self.query = query
+        self.sortMode = sortMode
+        self.page_size = page_size
+
+    def __iter__(self) -> Iterator["MoneyLog"]:
+        docs = self.connection.iterDocs(
+            self.query,
+            sortMode=self.sortMode,
+            projection=MONEYLOG_PROJECTION,
+            batch_size=self.page_size,
+        )
+        yield from PROFILER.timed((MoneyLog(**it) for it in docs), "校验")
+
+    def page(self, number: int) -> List["MoneyLog"]:
+        """
+        读取并校验第number页（从0开始）的账单
+        """
+        docs = self.connection.iterDocs(
+            self.query,
+            sortMode=self.sortMode,
+            projection=MONEYLOG_PROJECTION,
+            batch_size=self.page_size,
+            skip=number * self.page_size,
+            limit=self.page_size,
+        )
+        return list(PROFILER.timed((MoneyLog(**it) for it in docs), "校验"))
+
+    def keysetPage(
+        self, after: str = "", size: int = DEFAULT_PAGE_SIZE
+    ) -> Tuple[List["MoneyLog"], str]:
+        """
+        按照(排序字段, _id)的键集分页读取一页账单， 返回这一页和下一页的标志\n
+        after 是上一页返回的标志， 空字符串表示第一页， 没有下一页时返回的标志为空字符串\n
+        和skip分页不同， 翻到很靠后的页也不会变慢
+        """
+        field, direction = next(iter(self.sortMode.items()), ("_id", 1))
+        operator = "$gt" if direction == 1 else "$lt"
+        query = self.query
+        if after != "":
+            try:
+                mark = json.loads(base64.urlsafe_b64decode(after.encode()))
+                value, lastId = mark["v"], self.connection.toId(mark["id"])
+            except (ValueError, KeyError, TypeError):
+                raise typer.BadParameter(f"Invalid Page Mark: {after}")
+
+            keyset: Dict[str, Any] = (
+                {"_id": {operator: lastId}}
+                if field == "_id"
+                else {
+                    "$or": [
+                        {field: {operator: value}},
+                        {field: value, "_id": {operator: lastId}},
+                    ]
+                }
+            )
+            query = {"$and": [self.query, keyset]}
+
+        sortMode = {**self.sortMode, "_id": direction}
+        docs = list(
+            self.connection.iterDocs(
+                query,
+                sortMode=sortMode,
+                projection=MONEYLOG_PROJECTION,
+                batch_size=size + 1,
+                limit=size + 1,
+            )
+        )
+        with PROFILER.phase("校验"):
+            moneyLogs = [MoneyLog(**it) for it in docs[:size]]
+        if len(docs) <= size:
+            return (moneyLogs, "")
+
+        last = docs[size - 1]
+        mark = {"v": None if field == "_id" else last[field], "id": str(last["_id"])}
+        nextMark = base64.urlsafe_b64encode(json.dumps(mark).encode()).decode()
+        return (moneyLogs, nextMark)
+
+    def processSequel(
+        self, sequel: Sequel, renderer: Optional[MoneyLogRenderer] = None
+    ):
+        """
+                处理查询到的数据集， 包括打印 求和 求平均\n
+        此外更新或者删除账单， 导出json/csv由query命令直接交给MoneyLogExporter
+        """
+
+        if sequel == Sequel.print:
+            self.showAll(renderer)
+        elif sequel in (Sequel.total, Sequel.average, Sequel.size):
+            self.summary().show(sequel)
+        elif sequel == Sequel.remove:
+            self.deleteOne()
+        elif sequel == Sequel.update:
+            self.updateOne()
+
+    def summary(self) -> LedgerSummary:
+        """
+        把账单集合读取为列式的MoneyLogBatch计算汇总信息， 不校验每一条账单
+        """
+        return self.connection.loadBatch(self.query).summary()
+
+    def showAll(self, renderer: Optional[MoneyLogRenderer] = None):
+        """
+        打印账单集合到屏幕上， 直接格式化读取到的文档， 不逐条构造MoneyLog
+        """
+        docs = self.connection.iterDocs(
+            self.query,
+            sortMode=self.sortMode,
+            projection=BATCH_PROJECTION,
+            batch_size=self.page_size,
+        )
+        with PROFILER.phase("格式化"):
+            (renderer or MoneyLogRenderer()).write(
+                (it["money"], it["tags"], it["time_line"]) for it in docs
+            )
+
+    def showPage(
+        self,
+        moneyLogs: Iterable["MoneyLog"],
+        showIndex: bool = False,
+        start: int = 1,
+        renderer: Optional[MoneyLogRenderer] = None,
+    ):
+        with PROFILER.phase("格式化"):
+            (renderer or MoneyLogRenderer()).write(
+                ((it.money, it.tags, it.time_line) for it in moneyLogs),
+                start=start if showIndex else 0,
+            )
+
+    @user_input("请输入账单序号后回车提交， 直接回车查看下一页")
+    def readIndex(self, lines: List[str]) -> str:
+        return lines[0]
+
+    def get(self) -> Union["MoneyLog", None]:
+        """
+        按页展示账单， 让用户通过索引选择一个账单
+        """
+        number = 0
+        while len(moneyLogs := self.page(number)) != 0:
+            start = number * self.page_size + 1
+            self.showPage(moneyLogs, showIndex=True, start=start)
+            if (answer := self.readIndex()) is None:
+                return None
+            elif answer == "":
+                number += 1
+                continue
+
+            try:
+                index = int(answer) - start
+                return moneyLogs[index] if index >= 0 else None
+            except (IndexError, ValueError):
+                return None
+
+        return None
+
+    def deleteOne(self):
+        """
+        从底层数据库里删除一个账单
+        """
+        print("删除一条账单")
+        if (moneyLog := self.get()) is not None:
+            print(f"即将彻底删除账单： \n{moneyLog.fmt()}\n不可恢复")
+            if confirm():
+                if self.connection.delete(moneyLog.id):
+                    print("删除完成")
+                else:
+                    print("删除失败")
+        else:
+            print("不是有效的序号， 删除已取消")
+
+    def updateOne(self):
+        """
+        在底层数据库里更新一个账单
+        """
+        print("修改一条账单")
+        if (moneyLog := self.get()) is not None:
+            print(
+                f"将要修改的账单： \n{moneyLog.fmt()}\n按照提示输入新值， 留空则不修改"
+            )
+
+            with tag_completion(self.connection.tagTrie):
+                newMoneyLog = inputMoneyLog(default_money=moneyLog)
+            if newMoneyLog is None or newMoneyLog == moneyLog:
+                print("账单保持不变")
+                return
+
+            print(f"账单即将修改为： \n{newMoneyLog.fmt()}")
+            if confirm():
+                if (
+                    resultMoneyLog := self.connection.updateOne(newMoneyLog=newMoneyLog)
+                ) is not None:
+                    print(f"修改成功， 最新账单:\n{resultMoneyLog.fmt()}")
+                else:
+                    print("修改失败")
+        else:
+            print("不是有效的序号， 操作已取消")
+
+
+class LedgerStorage:
+    """
+    账单存储后端的公共接口， 命令只通过这些方法读写账单\n
+    查询条件统一使用build_query构造的MongoDB查询格式， 排序条件使用SortMode.build的格式
+    """
+
+    def toId(self, value: str) -> Any:
+        """
+        把字符串形式的账单id转换为后端使用的id类型
+        """
+        raise NotImplementedError
+
+    def insert(self, moneyLog: Union["MoneyLog", None]) -> Union["MoneyLog", None]:
+        raise NotImplementedError
+
+    def insertChunk(
+        self, chunk: List["MoneyLog"], ordered: bool
+    ) -> Tuple[int, int, Any]:
+        """
+        写入一批账单， 返回 (新写入的数量, 跳过的重复账单数量, 失败原因)， 全部成功时失败原因为None\n
+        指纹已经存在的账单是重复导入的， 直接跳过
+        """
+        return self.insertDocs([moneylog_doc(it) for it in chunk], ordered)
+
+    def insertDocs(
+        self, docs: List[Dict[str, Any]], ordered: bool
+    ) -> Tuple[int, int, Any]:
+        """
+        和insertChunk相同， 直接写入moneylog_doc构造的文档
+        """
+        raise NotImplementedError
+
+    def insertMany(
+        self,
+        moneyLogs: Iterable["MoneyLog"],
+        chunk_size: int = 1000,
+        ordered: bool = False,
+        progress: Optional[Callable[[BulkInsertReport], None]] = None,
+    ) -> BulkInsertReport:
+        """
+        分批插入大量账单， 每一批只有一次网络往返\n
+        ordered为True时出错的批次在出错位置停止写入， 否则跳过出错的账单继续写入\n
+        progress 每写完一批调用一次， 用来报告进度
+        """
+        report = BulkInsertReport()
+        begin = time.perf_counter()
+        for chunk in chunked(moneyLogs, chunk_size):
+            report.chunks += 1
+            report.total += len(chunk)
+            inserted, skipped, reason = self.insertChunk(chunk, ordered)
+            report.inserted += inserted
+            report.skipped += skipped
+            if reason is not None:
+                report.errors.append(
+                    f"第 {report.chunks} 批有 {len(chunk) - inserted - skipped} 条账单写入失败： {reason}"
+                )
+
+            report.elapsed = time.perf_counter() - begin
+            if progress is not None:
+                progress(report)
+
+        report.elapsed = time.perf_counter() - begin
+        return report
+
+    def find(
+        self, query: Dict[str, Any] = {}, sortMode: Dict[str, int] = {}
+    ) -> Union[MoneyLogCollection, None]:
+        """
+        根据给定条件查询数据库， 返回的集合在访问时才读取账单
+        """
+        return MoneyLogCollection(self, query, sortMode=sortMode)
+
+    def iterDocs(
+        self,
+        query: Dict[str, Any] = {},
+        sortMode: Dict[str, int] = {},
+        projection: Optional[Dict[str, int]] = None,
+        batch_size: int = 1000,
+        skip: int = 0,
+        limit: int = 0,
+    ) -> Iterable[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def loadBatch(
+        self, query: Dict[str, Any] = {}, batch_size: int = 10000
+    ) -> MoneyLogBatch:
+        batch = MoneyLogBatch()
+        batch.extend_docs(self.iterDocs(query, batch_size=batch_size))
+        return batch
+
+    def summary(self, query: Dict[str, Any] = {}) -> LedgerSummary:
+        raise NotImplementedError
+
+    def histogram(
+        self, query: Dict[str, Any], bucket: HistogramBucket, zone: Tuple[str, tzinfo]
+    ) -> Dict[Any, Tuple[float, int]]:
+        """
+        在数据库里按照bucket和时区zone分组汇总符合条件的账单， 返回 {分组: (金额, 笔数)}\n
+        zone是 (MongoDB使用的时区字符串, Python的tzinfo)
+        """
+        raise NotImplementedError
+
+    def summaries(self, queries: List[Dict[str, Any]]) -> List[LedgerSummary]:
+        """
+        按顺序返回每个查询条件的汇总信息， 可以一次查询多个条件的后端应该覆盖这个方法
+        """
+        return [self.summary(it) for it in queries]
+
+    def ensureIndexes(self) -> List[Tuple[str, str, bool]]:
+        """
+        创建需要的索引， 已经存在的索引不会重复创建\n
+        返回每个索引的 (名称, 索引的字段, 是否存在)
+        """
+        raise NotImplementedError
+
+    def indexSizes(self) -> Dict[str, int]:
+        return {}
+
+    def tagUsage(self) -> Iterable[Tuple[str, int, int]]:
+        """
+        返回每个标签的 (标签, 使用次数, 最后使用的时间戳)
+        """
+        raise NotImplementedError
+
+    def explain(
+        self, query: Dict[str, Any] = {}, sortMode: Dict[str, int] = {}
+    ) -> List[List[Any]]:
+        """
+        执行查询计划分析， 返回 [项目, 值] 的列表， 包括选中的计划 使用的索引 扫描和返回的账单数量
+        """
+        raise NotImplementedError
+
+    def count(self, query: Dict[str, Any] = {}) -> int:
+        raise NotImplementedError
+
+    def updateMany(self, query: Dict[str, Any], edit: BulkEdit) -> int:
+        """
+        用一次批量写入修改全部符合条件的账单， 返回修改的账单数量
+        """
+        raise NotImplementedError
+
+    def deleteMany(self, query: Dict[str, Any]) -> int:
+        """
+        用一次批量写入删除全部符合条件的账单， 返回删除的账单数量
+        """
+        raise NotImplementedError
+
+    def dedup(self) -> Tuple[int, int]:
+        """
+        合并金额 时间 标签和来源编号都相同的账单， 每组只保留最早写入的一条\n
+        然后给还没有指纹的旧账单补上指纹， 返回 (删除的重复账单数量, 补上指纹的账单数量)
+        """
+        raise NotImplementedError
+
+    def tagTrie(self) -> TagTrie:
+        """
+        第一次使用时加载标签字典， 之后复用同一个前缀树
+        """
+        if (tagTrie := getattr(self, "_tagTrie", None)) is None:
+            tagTrie = self._tagTrie = TagTrie.from_usage(self.tagUsage())
+
+        return tagTrie
+
+    def delete(self, id: str) -> bool:
+        raise NotImplementedError
+
+    def updateOne(self, newMoneyLog: "MoneyLog") -> Union["MoneyLog", None]:
+        raise NotImplementedError
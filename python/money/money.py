@@ -3,146 +3,78 @@
 # * date： 2024-05
 # * description: 一个使用MongoDB数据库的简单个人记账小程序
 
-from typing import Set, List, Dict, Any, Union, Optional, Tuple, Callable
-from pprint import pprint
+from typing import (
+    Set,
+    List,
+    Dict,
+    Any,
+    Optional,
+    Tuple,
+    Callable,
+    Iterable,
+    Iterator,
+    TYPE_CHECKING,
+)
 from enum import Enum
 from pathlib import Path
 import re
+import time
 import calendar
-from datetime import datetime, date, timedelta
+from datetime import datetime, date, timedelta, timezone, tzinfo
 import json
-import logging
+import gzip
+import io
+import sys
+import os
+import glob
 from typing_extensions import Annotated
 import typer
-from pymongo import MongoClient
-from pymongo.errors import PyMongoError
-from bson.objectid import ObjectId
-from pydantic import ConfigDict, BaseModel, Field
-from pydantic.functional_validators import BeforeValidator
-import psutil
-import chardet
-
-MONGO_CONFIG_PATH = "./mongo_config.json"
-
-
-def err_process(err: Exception):
-    """
-    统一处理在程序的其他部分没有适当处理的错误
-    """
-    if isinstance(err, PyMongoError):
-        logging.critical(f"MongoDB数据库严重错误： {err}")
-        exit(-1)
-    elif isinstance(err, ParseMoneyLogError):
-        logging.critical(f"解析错误： {err}")
-        exit(-1)
-
-    elif isinstance(err, KeyboardInterrupt):
-        logging.info("应用程序已经终止运行")
-        exit(0)
-
-    raise err
-
-
-def parse_timestamp(dt_str: str) -> int:
-    dt_values = [int(it) for it in re.split(r"\.|T|:|-|\s", dt_str)]
-
-    dt = datetime(*dt_values[:6])
-    return int(dt.timestamp() * 1000)
-
-
-def user_input(prompt: Union[str, List[str]], line_total: int = 1):
-    """
-    装饰器 获取用户通过stdin输入的数据， 返回适当的数据
-    如果没有合适的数据返回None
-    """
-
-    def outwrapper(fun: Callable[..., Any]):
-        def wrapper(*args, **kwargs):
-            if isinstance(prompt, list) and len(prompt) != line_total:
-                raise ValueError(
-                    f"缺少提示， prompt如果是list类型， 必须和line_total长度相等\n prompt[List] len: {len(prompt)}, total_line: {line_total}"
-                )
-
-            try:
-                lines = []
-                for i in range(line_total):
-                    inner_prompt = prompt[i] if isinstance(prompt, list) else prompt
-
-                    lines.append(input(inner_prompt).strip())
-            except (EOFError, KeyboardInterrupt):
-                return None
-
-            if not lines:
-                return None
 
-            return fun(*args, lines=lines, **kwargs)
-
-        return wrapper
-
-    return outwrapper
-
-
-@user_input("确认操作 yes Or No")
-def confirm(lines: List[str]) -> bool:
-    result = lines[0].lower()
-    return result in ["y", "yes", "ok", "好", "好的", "确定"]
-
-
-class MoneyType(str, Enum):
-    """
-    账单类型 全部 所得 或者 支出
-    """
-
-    all = "all"
-    income = "income"
-    outlay = "outlay"
-
-
-class SortMode(str, Enum):
-    """
-    如何给查询的账单排序， 金额升序 金额逆序 日期升序 日期逆序
-    """
-
-    raw = "raw"
-    money = "money"
-    date = "date"
-    money_reverse = "money_reverse"
-    date_reverse = "date_reverse"
-
-    def build(self, moneyType: MoneyType = MoneyType.all) -> Dict[str, int]:
-        """
-        根据排序选项生成MongoDB排序条件
-        """
-        if self == SortMode.money or self == SortMode.money_reverse:
-            if moneyType == MoneyType.outlay:
-                return {"money": -1 if self == SortMode.money_reverse else 1}
-
-            return {"money": 1 if self == SortMode.money_reverse else -1}
-
-        elif self == SortMode.date or self == SortMode.date_reverse:
-            return {"time_line": 1 if self == SortMode.date else -1}
-        else:
-            return {}
-
-
-class Sequel(str, Enum):
-    """
-    如何处理查询结果 直接打印 求 总和 总数 平均 或者转换到json/csv格式字符串\n
-    此外可以对查询到的账单做删除更新等操作
-    这样一个查询命令干完了所有的事情
-    """
+# pymongo pydantic chardet这些导入很慢的依赖只在需要它们的命令里导入
+# 公共的类型和工具在money_core.py， 存储接口在ledger_storage.py
+# 存储后端在sqlite_backend.py和mongo_backend.py， pydantic模型在money_models.py
+# 本地快照在ledger_snapshot.py， NumPy统计报表在ledger_report.py
+from money_core import (
+    MONGO_CONFIG_PATH,
+    DEFAULT_PAGE_SIZE,
+    TAG_WILDCARDS,
+    BATCH_PROJECTION,
+    err_process,
+    parse_timestamp,
+    chunked,
+    fmt_size,
+    confirm,
+    MoneyType,
+    SortMode,
+    Sequel,
+    StorageBackend,
+    BulkEdit,
+    MoneyLog,
+    ParseMoneyLogError,
+    parseMoneyLog,
+    moneylog_doc,
+    TagTrie,
+    MoneyLogBatch,
+    write_rows,
+    MoneyLogRenderer,
+    PROFILER,
+    ReportPeriod,
+    ReportFormat,
+    HistogramBucket,
+    fold_buckets,
+    BulkInsertReport,
+    load_config,
+)
+from ledger_storage import LedgerStorage
 
-    print = "print"
-    size = "size"
-    total = "total"
-    average = "average"
-    json = "json"
-    csv = "csv"
-    remove = "remove"
-    update = "update"
+if TYPE_CHECKING:
+    from ledger_snapshot import LedgerSnapshot
 
 
-PyObjectId = Annotated[str, BeforeValidator(str)]  # MongoDB的id
+ENCODING_SAMPLE_SIZE = 64 * 1024  # 推测文件编码时最多读取的字节数
+READ_CHUNK_SIZE = 64 * 1024  # 流式读取导入文件时每次读取的字符数
+IMPORT_SUFFIXES = (".csv", ".json")  # mass命令可以导入的文件格式
+IMPORT_CHUNKS_PER_WORKER = 2  # 每个解析进程在队列里最多积压的批次
 
 
 class TimeQueryMode(str, Enum):
@@ -241,7 +173,7 @@ class TimeRangeStamp:
         begin = datetime(target_year, target_month, 1)
         if self.rangeType == TimeQueryRangeType.context_base_unit:
             max_day = calendar.monthrange(begin.year, begin.month)[1]
-            end = datetime(begin.year, begin.month, max_day, 23, 59, 59, 1000)
+            end = datetime(begin.year, begin.month, max_day, 23, 59, 59, 999000)
         else:
             end = now
 
@@ -252,7 +184,7 @@ class TimeRangeStamp:
         target_year = now.year - self.pattern[0]
         begin = datetime(target_year, 1, 1)
         if self.rangeType == TimeQueryRangeType.context_base_unit:
-            end = datetime(target_year, 12, 31, 23, 59, 59, 1000)
+            end = datetime(target_year, 12, 31, 23, 59, 59, 999000)
         else:
             end = now
 
@@ -270,13 +202,13 @@ class TimeRangeStamp:
         pattern = self.pattern
         if length == 6:
             begin = datetime(pattern[0], pattern[1], pattern[2])
-            end = datetime(pattern[3], pattern[4], pattern[5], 23, 59, 59, 1000)
+            end = datetime(pattern[3], pattern[4], pattern[5], 23, 59, 59, 999000)
         elif length == 4:
             begin = datetime(now.year, pattern[0], pattern[1])
-            end = datetime(now.year, pattern[2], pattern[3], 23, 59, 59, 1000)
+            end = datetime(now.year, pattern[2], pattern[3], 23, 59, 59, 999000)
         else:
             begin = datetime(now.year, now.month, pattern[0])
-            end = datetime(now.year, now.month, pattern[1], 23, 59, 59, 1000)
+            end = datetime(now.year, now.month, pattern[1], 23, 59, 59, 999000)
 
         return (begin, end)
 
@@ -337,336 +269,228 @@ def parse_condition(raw_str: str) -> Condition:
     raise typer.BadParameter(f"Invalid Condition: {raw_str}")
 
 
-class MoneyLog(BaseModel):
+def parse_duration(raw_str: str) -> int:
     """
-    表示一个账单 包括 金额 多个标签 发生时间戳， 此外有个可选的MongoDB id
+    把 -1d +2h30m 这样的时长解析为毫秒数， 单位可以是 d天 h小时 m分钟 s秒
     """
-
-    id: Optional[PyObjectId] = Field(alias="_id", default=None)
-    money: float = Field(...)
-    tags: Set[str] = Field(...)
-    time_line: int = Field(...)
-    model_config = ConfigDict(
-        populate_by_name=True,
-        arbitrary_types_allowed=True,
-    )
-
-    def fmt(self) -> str:
-        """
-        友好可读的形式格式化账单
-        """
-
-        money = (
-            f"所得 {self.money:.2f}￥"
-            if self.money >= 0
-            else f"支出 {+self.money:.2f}￥"
+    units = {"d": 86400000, "h": 3600000, "m": 60000, "s": 1000}
+    text = raw_str.strip()
+    sign = -1 if text.startswith("-") else 1
+    parts = re.findall(r"(\d+)\s*([dhms])", text.lstrip("+-"))
+    if not parts or re.sub(r"\d+\s*[dhms]|\s", "", text.lstrip("+-")) != "":
+        raise typer.BadParameter(f"Invalid Duration: {raw_str}")
+
+    return sign * sum(int(value) * units[unit] for value, unit in parts)
+
+
+def build_query(
+    timeMode: TimeQueryMode,
+    timeString: str,
+    condition: Optional[Condition] = None,
+    moneyType: MoneyType = MoneyType.all,
+    tags: str = "",
+    vocabulary: Optional[Callable[[], "TagTrie"]] = None,
+) -> Dict[str, Any]:
+    """
+    根据时间范围 金额条件 账单类型和标签构造MongoDB查询条件\n
+    vocabulary 返回标签字典， 只在标签包含通配符时调用， 通配符被展开为具体的标签
+    """
+    begin_timestamp, end_timestamp = TimeRangeStamp(timeMode, timeString)()
+    query: Dict[str, Any] = {
+        "time_line": {"$gte": begin_timestamp, "$lte": end_timestamp}
+    }
+    if moneyType != MoneyType.all:
+        query.update(
+            {"money": {("$gt" if moneyType == MoneyType.income else "$lt"): 0}}
         )
-        tags = "  ".join(self.tags)
-        return f"{money} {self.timestamp_fmt()} 标签： <{tags}>"
-
-    def timestamp_fmt(self) -> str:
-        """
-        把时间戳格式化为友好可读的字符串
-        """
-        now = datetime.now()
-        dt = datetime.fromtimestamp(self.time_line / 1000)
-        year = "" if now.year == dt.year else f"{dt.year}年"
-        month = "" if now.month == dt.month else f"{dt.month}月"
-        day = "" if now.day == dt.day else f"{dt.day}日"
-        fmt = f"{year}{month}{day} {dt.hour}点{dt.minute}分"
-        return fmt
-
+    if condition is not None:
+        query.update(condition.build(moneyType=moneyType))
 
-class ParseMoneyLogError(Exception):
-    pass
+    tagSet: Set[str] = set(filter(lambda it: len(it) != 0, tags.split(" ")))
+    patterns = {it for it in tagSet if any(ch in it for ch in TAG_WILDCARDS)}
+    if patterns and vocabulary is not None:
+        tagTrie = vocabulary()
+        tagSet = (tagSet - patterns).union(*(tagTrie.expand(it) for it in patterns))
+        if len(tagSet) == 0:
+            # 没有标签匹配通配符， 查询不应该返回任何账单
+            query.update({"tags": {"$in": []}})
 
+    if len(tagSet) != 0:
+        query.update({"tags": {"$in": list(tagSet)}})
 
-def check_value(obj: Any, name: str) -> Any:
-    if obj is None:
-        raise ParseMoneyLogError("解析为MoneyLog对象的时候出错, 没有提供默认的可用对象")
-    else:
-        return getattr(obj, name)
+    return query
 
 
-def parseMoneyLog(
-    lines: List[str], is_throw: bool = True, default_money: Union[MoneyLog, None] = None
-) -> Union[MoneyLog, None]:
+def detect_encoding(path: Path, sample_size: int = ENCODING_SAMPLE_SIZE) -> str:
     """
-    解析用户通过stdin输入的字符串， 返回一个MoneyLog对象
-    如果输入无效字段用默认提供的MoneyLog字段来替换
+    只读取文件开头的一小段内容推测文件编码， 不必对整个文件运行chardet
     """
-    try:
-        newMoney = float(lines[0])
-    except ValueError:
-        if is_throw:
-            newMoney = check_value(default_money, "money")
-        else:
-            return None
+    import chardet
 
-    try:
-        newTags = set(filter(lambda it: len(it) != 0, re.split(r"\s+|;", lines[1])))
-        if len(newTags) == 0:
-            raise ValueError("Tags Length As Zero.")
+    with path.open("rb") as fp:
+        sample = fp.read(sample_size)
 
-    except ValueError:
-        if is_throw:
-            newTags = check_value(default_money, "tags")
-        else:
-            return None
+    encoding = (chardet.detect(sample)["encoding"] or "UTF-8").lower()
+    # 样本里没有出现的字符可能超出推测出的编码， 换成兼容它的更大的字符集
+    supersets = {"ascii": "UTF-8", "gb2312": "GB18030", "gbk": "GB18030"}
+    return supersets.get(encoding, encoding)
 
-    try:
-        newTime_line = parse_timestamp(lines[2])
-    except ValueError:
-        if is_throw:
-            newTime_line = check_value(default_money, "time_line")
-        else:
-            return None
 
-    newId = default_money.id if default_money is not None else None
-    return MoneyLog(_id=newId, money=newMoney, tags=newTags, time_line=newTime_line)
-
-
-@user_input(
-    ["输入金额： ", "输入标签（用空格隔开）： ", "输入日期时间： "], line_total=3
-)
-def inputMoneyLog(
-    lines: List[str], default_money: Union[MoneyLog, None] = None
-) -> Union[MoneyLog, None]:
-    return parseMoneyLog(lines=lines, default_money=default_money)
-
-
-class MoneyLogCollection(BaseModel):
+def iter_json_array(fp: Any, read_size: int = READ_CHUNK_SIZE) -> Iterator[Any]:
     """
-    把账单集合包装起来， 统一处理
+    逐个解析文本流里JSON数组的元素， 不需要把整个文件读入内存\n
+    为了兼容旧的导出文件， 单引号会被替换为双引号
     """
-
-    moneyLogs: List[MoneyLog]
-
-    def processSequel(self, sequel: Sequel):
-        """
-                处理查询到的数据集， 包括打印 求和 求平均 转换到json/csv\n
-        此外更新或者删除账单
-        """
-
-        if sequel == Sequel.print:
-            self.showAll()
-        elif sequel == Sequel.total or sequel == Sequel.average:
-            total = sum([it.money for it in self.moneyLogs])
-            if sequel == Sequel.total:
-                print(f"总计： {total:.2f}￥")
-            else:
-                firstDate = date.fromtimestamp(
-                    min([it.time_line for it in self.moneyLogs]) / 1000
-                )
-                firstTime = datetime(firstDate.year, firstDate.month, firstDate.day)
-                lastTime = datetime.fromtimestamp(
-                    max([it.time_line for it in self.moneyLogs]) / 1000
-                )
-                days = (lastTime - firstTime).days + 1
-
-                print(f"在{days}天内每日平均为： {(total/days):2f}￥")
-
-        elif sequel == Sequel.size:
-            print(f"总共有 {len(self.moneyLogs)} 条账单")
-        elif sequel == Sequel.json or sequel == Sequel.csv:
-            json = list(
-                (
-                    it.model_dump(mode="json", include={"money", "tags", "time_line"})
-                    for it in self.moneyLogs
-                )
-            )
-            for ml in json:
-                ml.update(
-                    {"time_line": f"{datetime.fromtimestamp(ml['time_line'] / 1000)}"}
-                )
-            with open(f"./moneyLogs.{sequel}", "w", encoding="UTF-8") as fp:
-                if sequel == Sequel.json:
-                    pprint(json, stream=fp)
-                else:
-                    csv_content = "\n".join(
-                        (
-                            f"{it['money']},{';'.join(it['tags'])},{it['time_line']}"
-                            for it in json
-                        )
-                    )
-
-                    fp.write(csv_content)
-
-        elif sequel == Sequel.remove:
-            self.deleteOne()
-        elif sequel == Sequel.update:
-            self.updateOne()
-
-    def showAll(self, showIndex: bool = False):
-        """
-        打印账单集合到屏幕上
-        """
-        pos = 1
-        for moneyLog in self.moneyLogs:
-            indexStr = f"{pos}. --- " if showIndex else ""
-            print(f"{indexStr}{moneyLog.fmt()}")
-            pos += 1
-
-    @user_input("请输入账单序号， 回车提交")
-    def get(self, lines: List[str]) -> Union[MoneyLog, None]:
-        """
-        让用户通过索引选择一个账单
-        """
-
-        try:
-            index = int(lines[0])
-            return self.moneyLogs[index - 1]
-        except (IndexError, ValueError):
-            return None
-
-    def deleteOne(self):
-        """
-        从底层数据库里删除一个账单
-        """
-        print("删除一条账单")
-        self.showAll(True)
-        if (moneyLog := self.get()) is not None:
-            print(f"即将彻底删除账单： \n{moneyLog.fmt()}\n不可恢复")
-            if confirm():
-                if MongoConnection().delete(moneyLog.id):
-                    print("删除完成")
-                else:
-                    print("删除失败")
-        else:
-            print("不是有效的序号， 删除已取消")
-
-    def updateOne(self):
-        """
-        在底层数据库里更新一个账单
-        """
-        print("修改一条账单")
-        self.showAll(True)
-
-        if (moneyLog := self.get()) is not None:
-            print(
-                f"将要修改的账单： \n{moneyLog.fmt()}\n按照提示输入新值， 留空则不修改"
-            )
-
-            newMoneyLog = inputMoneyLog(default_money=moneyLog)
-            if newMoneyLog is None or newMoneyLog == moneyLog:
-                print("账单保持不变")
+    separator = re.compile(r"[\s,]*")
+    decoder = json.JSONDecoder()
+    buffer, pos, started, eof = "", 0, False, False
+    while True:
+        pos = separator.match(buffer, pos).end()
+        if pos < len(buffer):
+            if not started:
+                if buffer[pos] != "[":
+                    raise ParseMoneyLogError("JSON账单文件的内容必须是一个数组")
+                started, pos = True, pos + 1
+                continue
+            if buffer[pos] == "]":
                 return
-
-            print(f"账单即将修改为： \n{newMoneyLog.fmt()}")
-            if confirm():
-                if (
-                    resultMoneyLog := MongoConnection().updateOne(
-                        newMoneyLog=newMoneyLog
-                    )
-                ) is not None:
-                    print(f"修改成功， 最新账单:\n{resultMoneyLog.fmt()}")
-                else:
-                    print("修改失败")
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                # 元素恰好结束在缓冲区末尾时可能被截断 比如数字， 读取更多内容再解析
+                if end < len(buffer) or eof:
+                    yield item
+                    pos = end
+                    continue
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ParseMoneyLogError(f"JSON账单文件格式错误： {e}")
+        elif eof:
+            if started:
+                raise ParseMoneyLogError("JSON账单文件不完整， 缺少数组的结束符号")
+            return
+
+        chunk = fp.read(read_size)
+        eof = not chunk
+        buffer, pos = buffer[pos:] + chunk.replace("'", '"'), 0
+
+
+def iterMoneyLogFile(path: Path) -> Iterator["MoneyLog"]:
+    """
+    流式读取.csv或.json账单文件， 逐条产生MoneyLog对象\n
+    内存占用和文件大小无关
+    """
+    with path.open("r", encoding=detect_encoding(path)) as fp:
+        if path.suffix == ".csv":
+            for line in fp:
+                # 可选的第四列是来源编号
+                if len(lines := line.rstrip("\r\n").split(",")) in (3, 4):
+                    if (ml := parseMoneyLog(lines=lines, is_throw=True)) is not None:
+                        if len(lines) == 4 and lines[3].strip() != "":
+                            ml.source_id = lines[3].strip()
+                        yield ml
         else:
-            print("不是有效的序号， 操作已取消")
+            for it in iter_json_array(fp):
+                try:
+                    it.update({"time_line": parse_timestamp(it["time_line"])})
+                    yield MoneyLog(**it)
+                # pydantic的ValidationError是ValueError的子类
+                except (KeyError, TypeError, AttributeError, ValueError) as e:
+                    raise ParseMoneyLogError(f"无效的JSON账单记录 {it}： {e}")
 
 
-class MongoConnection:
+class MoneyLogExporter:
     """
-    定义mongoDB数据库连接， 并提供了若干常用方法
+    把账单逐条写入文件或者标准输出， 支持csv json和ndjson格式， 可选gzip压缩\n
+    每写一条账单只占用这一条账单的内存
     """
 
-    def __init__(self):
+    def __init__(self, sequel: Sequel, output: str = "", compress: bool = False):
         """
-        初始化数据库连接， 定义数据库名称和集合
+        * sequel 导出格式 json csv 或 ndjson\n
+        * output 导出文件的路径， "-" 表示标准输出， 默认为 ./moneyLogs.<格式>\n
+        * compress 是否使用gzip压缩， 路径以.gz结尾时自动压缩
         """
-        if not self.__is_running():
-            raise PyMongoError("MongoDB Server Is Not Running")
-        try:
-            fp = Path(MONGO_CONFIG_PATH).open()
-            config = json.load(fp)
-        except (FileNotFoundError, json.JSONDecodeError):
-            print(
-                "找不到MongoDB配置文件或配置文件已经损坏\n请运行 `python money.py config-mongodb` 命令初始化一个配置文件"
-            )
-            exit(-1)
-
-        self.db_cli = MongoClient(config["host"])
-
-        self.db = self.db_cli[config["db_name"]]
-        self.collection = self.db[config["collection_name"]]
+        self.sequel = sequel
+        self.path = output if output else f"./moneyLogs.{sequel.value}"
+        if compress and output == "":
+            self.path += ".gz"
+        self.compress = compress or self.path.endswith(".gz")
+
+    def open(self) -> Any:
+        if self.path == "-":
+            if not self.compress:
+                return io.TextIOWrapper(
+                    sys.stdout.buffer, encoding="UTF-8", write_through=False
+                )
+            binary = gzip.GzipFile(fileobj=sys.stdout.buffer, mode="wb")
+            return io.TextIOWrapper(binary, encoding="UTF-8")
+        elif self.compress:
+            return gzip.open(self.path, "wt", encoding="UTF-8")
 
-    def __is_running(self) -> bool:
-        try:
-            mongoService = psutil.win_service_get("MongoDB")
-            return mongoService.status() == "running"
-        except psutil.NoSuchProcess:
-            return False
+        return open(self.path, "w", encoding="UTF-8")
 
-    def insert(self, moneyLog: Union[MoneyLog, None]) -> Union[MoneyLog, None]:
+    def export(self, docs: Iterable[Dict[str, Any]]) -> int:
         """
-        插入一个新的账单
+        逐条写入包含money tags time_line字段的账单文档， 返回写入的账单数量
         """
-        if moneyLog is None:
-            return None
+        total = 0
+        fp = self.open()
         try:
-            result = self.collection.insert_one(
-                moneyLog.model_dump(mode="json", by_alias=True, exclude=set(["id"]))
-            )
-
-            if (result.acknowledged) and (
-                newItem := self.collection.find_one({"_id": result.inserted_id})
-            ) is not None:
-                return MoneyLog(**newItem)
-        except PyMongoError as e:
-            err_process(e)
+            with PROFILER.phase("格式化"):
+                if self.sequel == Sequel.json:
+                    fp.write("[")
+                for it in docs:
+                    row = {
+                        "money": it["money"],
+                        "tags": list(it["tags"]),
+                        "time_line": f"{datetime.fromtimestamp(it['time_line'] / 1000)}",
+                    }
+                    if self.sequel == Sequel.csv:
+                        fp.write(
+                            f"{row['money']},{';'.join(row['tags'])},{row['time_line']}\n"
+                        )
+                    elif self.sequel == Sequel.json:
+                        fp.write(
+                            ("\n" if total == 0 else ",\n")
+                            + json.dumps(row, ensure_ascii=False)
+                        )
+                    else:
+                        fp.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    total += 1
+                if self.sequel == Sequel.json:
+                    fp.write("\n]\n")
+        finally:
+            if self.path == "-" and not self.compress:
+                fp.flush()
+                fp.detach()  # 不要关闭标准输出
+            else:
+                fp.close()
 
-        return None
+        return total
 
-    def find(
-        self, query: Dict[str, Any] = {}, sortMode: Dict[str, int] = {}
-    ) -> Union[MoneyLogCollection, None]:
-        """
-        根据给定条件查询数据库
-        """
-        try:
-            if (cursor := self.collection.find(query)) is not None:
-                if sortMode != {}:
-                    cursor.sort(sortMode)
 
-                return MoneyLogCollection(moneyLogs=cursor)
-        except PyMongoError as e:
-            err_process(e)
+def open_storage() -> LedgerStorage:
+    """
+    根据配置文件的backend选择存储后端
+    """
+    config = load_config()
+    if config["backend"] == StorageBackend.sqlite:
+        from sqlite_backend import SqliteConnection
 
-        return None
+        return SqliteConnection(config["sqlite_path"])
 
-    def delete(self, id: PyObjectId) -> bool:
-        """
-        从mongoDB里删除一条记录
-        """
-        try:
-            if (
-                result := self.collection.delete_one({"_id": ObjectId(id)})
-            ) is not None:
-                return result.deleted_count != 0
-        except PyMongoError as e:
-            err_process(e)
+    from mongo_backend import MongoConnection
 
-        return False
+    return MongoConnection()
 
-    def updateOne(self, newMoneyLog: MoneyLog) -> Union[MoneyLog, None]:
-        """
-        从MongoDB数据库里更新一条记录
-        """
-        try:
-            result = self.collection.update_one(
-                {"_id": ObjectId(newMoneyLog.id)},
-                {"$set": newMoneyLog.model_dump(mode="json", exclude=set(["id"]))},
-            )
 
-            if (result.modified_count == 1) and (
-                newItem := self.collection.find_one({"_id": ObjectId(newMoneyLog.id)})
-            ) is not None:
-                return MoneyLog(**newItem)
-        except PyMongoError as e:
-            err_process(e)
+def open_snapshot() -> "LedgerSnapshot":
+    """
+    打开配置文件里snapshot_path指定的本地快照
+    """
+    from ledger_snapshot import LedgerSnapshot
 
-        return None
+    return LedgerSnapshot(load_config()["snapshot_path"])
 
 
 # 初始化cli应用程序
@@ -674,12 +498,19 @@ app = typer.Typer()
 
 
 @app.callback()
-def callback():
+def callback(
+    ctx: typer.Context,
+    profile: Annotated[bool, typer.Option("--profile")] = False,
+):
     """
     * 一个简单的个人记账程序\n
     * 后端直接和MongoDB数据库交互\n
+    * --profile 命令结束后在标准错误打印每个阶段的耗时和MongoDB命令统计， 如：\n
+    python money.py --profile query -s total\n
     """
-    pass
+    if profile:
+        PROFILER.start()
+        ctx.call_on_close(PROFILER.report)
 
 
 @app.command()
@@ -687,6 +518,20 @@ def config_mongodb(
     host: str = "mongodb://localhost:27017",
     db_name: str = "money_db",
     collection_name: str = "money_log",
+    max_pool_size: int = 10,
+    min_pool_size: int = 0,
+    connect_timeout_ms: int = 5000,
+    server_selection_timeout_ms: int = 5000,
+    socket_timeout_ms: int = 0,
+    read_concern: str = "local",
+    write_concern: str = "1",
+    probe_timeout_ms: int = 500,
+    probe_cache_ttl: int = 30,
+    create_indexes: bool = False,
+    snapshot_path: str = "./money_snapshot",
+    backend: StorageBackend = StorageBackend.mongodb,
+    sqlite_path: str = "./money.db",
+    timezone: str = "",
 ):
     """
     写入一个MongoDB配置文件\n
@@ -695,12 +540,71 @@ def config_mongodb(
     host: MongoDB数据库主机名称， 默认本地机器的27017端口\n
     db_name 数据库名称 默认： money_db\n
     collection_name 应用程序使用的文档集合的名称 默认 money_log\n
+    max_pool_size min_pool_size 连接池的最大和最小连接数 默认 10 和 0\n
+    connect_timeout_ms 建立连接的超时时间 默认5000毫秒\n
+    server_selection_timeout_ms 选择可用服务器的超时时间 默认5000毫秒\n
+    socket_timeout_ms 网络读写的超时时间 默认0 不限制\n
+    read_concern 读关注级别 默认 local\n
+    write_concern 写关注 可以是数字或者majority 默认 1\n
+    probe_timeout_ms 启动时用ping探测服务是否可用的超时时间 默认500毫秒\n
+    probe_cache_ttl 探测成功后多少秒内不再探测 默认30秒 0表示每次都探测\n
+    create_indexes 写入配置后立即创建账单集合需要的索引 需要MongoDB服务正常运行\n
+    snapshot_path sync命令保存本地快照的目录 默认 ./money_snapshot\n
+    backend 存储后端 mongodb 或者 sqlite， sqlite不需要运行数据库服务 默认 mongodb\n
+    sqlite_path SQLite数据库文件的路径 默认 ./money.db\n
+    timezone histogram命令按时间分组使用的时区 如 Asia/Shanghai 或 +08:00 默认留空使用系统时区\n
     """
     with open(MONGO_CONFIG_PATH, "wt") as fp:
-        config = {"host": host, "db_name": db_name, "collection_name": collection_name}
+        config = {
+            "backend": backend.value,
+            "sqlite_path": sqlite_path,
+            "host": host,
+            "db_name": db_name,
+            "collection_name": collection_name,
+            "max_pool_size": max_pool_size,
+            "min_pool_size": min_pool_size,
+            "connect_timeout_ms": connect_timeout_ms,
+            "server_selection_timeout_ms": server_selection_timeout_ms,
+            "socket_timeout_ms": socket_timeout_ms,
+            "read_concern": read_concern,
+            "write_concern": int(write_concern)
+            if write_concern.isdigit()
+            else write_concern,
+            "probe_timeout_ms": probe_timeout_ms,
+            "probe_cache_ttl": probe_cache_ttl,
+            "snapshot_path": snapshot_path,
+            "timezone": timezone,
+        }
         json.dump(config, fp)
         print(f"MongoDB配置已经写入到程序同一个目录下的{MONGO_CONFIG_PATH}文件里")
 
+    if create_indexes:
+        indexes()
+
+
+@app.command()
+def indexes():
+    """
+    创建并检查账单集合需要的索引， 打印每个索引占用的空间\n
+    MongoDB后端：\n
+    time_line 按时间范围查询\n
+    tags_time_line 按标签和时间范围查询\n
+    money_time_line 按金额条件和时间范围查询\n
+    updated_at 按修改时间增量同步本地快照\n
+    fingerprint 账单内容指纹的唯一索引， 导入时跳过重复的账单\n
+    SQLite后端的标签索引是 tag_log_id\n
+    """
+    storage = open_storage()
+    indexStates = storage.ensureIndexes()
+    sizes = storage.indexSizes()
+    for name, keys, ok in indexStates:
+        size = fmt_size(sizes[name]) if name in sizes else "未知"
+        print(f"{name} <{keys}> {'正常' if ok else '缺失'} 大小： {size}")
+
+    if not all(ok for _, _, ok in indexStates):
+        print("部分索引创建失败， 请检查数据库日志")
+        exit(-1)
+
 
 @app.command()
 def add(
@@ -723,7 +627,7 @@ def add(
 
     tagSet = set(filter(lambda it: len(it) != 0, tags.split(" ")))
     ml = MoneyLog(money=money, tags=tagSet, time_line=int(when.timestamp() * 1000))
-    newMoneyLog = MongoConnection().insert(ml)
+    newMoneyLog = open_storage().insert(ml)
     if newMoneyLog is not None:
         print(f"成功新增： \n{newMoneyLog.fmt()}")
     else:
@@ -745,6 +649,24 @@ def query(
     tags: Annotated[str, typer.Option("--tags", "-t")] = "",
     sortMode: Annotated[SortMode, typer.Option("--sort-mode", "-sm")] = SortMode.raw,
     sequel: Annotated[Sequel, typer.Option("--sequel", "-s")] = Sequel.print,
+    output: Annotated[str, typer.Option("--output", "-o")] = "",
+    compress: Annotated[bool, typer.Option("--gzip", "-z")] = False,
+    batchSize: Annotated[int, typer.Option("--batch-size", "-bs", min=1)] = 1000,
+    pageSize: Annotated[int, typer.Option("--page-size", "-ps", min=0)] = 0,
+    after: Annotated[str, typer.Option("--after", "-a")] = "",
+    local: Annotated[bool, typer.Option("--local", "-l")] = False,
+    explain: Annotated[bool, typer.Option("--explain", "-e")] = False,
+    setTags: Annotated[Optional[str], typer.Option("--set-tags")] = None,
+    addTags: Annotated[str, typer.Option("--add-tags")] = "",
+    removeTags: Annotated[str, typer.Option("--remove-tags")] = "",
+    setMoney: Annotated[Optional[float], typer.Option("--set-money")] = None,
+    scaleMoney: Annotated[Optional[float], typer.Option("--scale-money")] = None,
+    shiftTime: Annotated[
+        Optional[int], typer.Option("--shift-time", parser=parse_duration)
+    ] = None,
+    dryRun: Annotated[bool, typer.Option("--dry-run")] = False,
+    align: Annotated[bool, typer.Option("--align", "-al")] = False,
+    pager: Annotated[bool, typer.Option("--pager", "-pg")] = False,
 ):
     """
     * 根据给定条件查询账单， 查询到的账单可以进一步处理\n\n
@@ -777,7 +699,8 @@ def query(
     * --money-type 账单类型 默认为 all 所有账单 可以是如下值：\n
     all 所有 income 所得 outla 支出\n\n
 
-    * --tags 账单标签可以是用双引号括起来的多个标签， 标签之间用空格隔开\n\n
+    * --tags 账单标签可以是用双引号括起来的多个标签， 标签之间用空格隔开\n
+    标签可以使用通配符 * ? []， 如 "餐*" 匹配所有以餐开头的标签\n\n
 
     --sort-mode 排序模式 默认为raw， 不排序\n
     排序模式包括：\n
@@ -786,80 +709,799 @@ def query(
 
     * --sequel 如何处理账单， 默认为： print 打印到屏幕\n
     可以是如下值： print 打印 size 总数 total 求和 average 求平均\n
-    json导出为json文件， csv 导出为csv文件\n
-    导出的文件保存在同一个目录下\n
+    json导出为json文件， csv 导出为csv文件， ndjson 导出为每行一个json对象的文件\n
+    导出的文件默认保存在同一个目录下\n
     update 在查询到的账单里选择一条记录修改\n
-    remove 在查询到的账单里选择一条记录删除\n\n
+    remove 在查询到的账单里选择一条记录删除\n
+    update_all 用下面的选项一次修改查询到的全部账单\n
+    remove_all 一次删除查询到的全部账单\n\n
+
+    * --set-tags 把标签替换为这些标签 --add-tags 添加标签 --remove-tags 删除标签\n
+    * --set-money 把金额设为这个值 --scale-money 把金额乘以这个倍数\n
+    * --shift-time 把时间平移一段时长， 如 -1d +2h30m， 单位 d h m s\n
+    * --dry-run 只显示会修改或删除多少条账单， 不做任何修改\n
+    批量修改和删除只需要确认一次， 如：\n
+    --time-mode month --time-string 5 --tags 外卖 --sequel update_all --add-tags 餐饮\n\n
+
+    * --output 导出文件的路径， "-" 表示输出到标准输出， 默认为 ./moneyLogs.<格式>\n
+    * --gzip 使用gzip压缩导出的内容， 路径以.gz结尾时自动压缩\n
+    * --batch-size 导出时每次从数据库读取的账单数量 默认1000\n\n
+
+    * --page-size 打印时每页的账单数量， 默认0 一次打印全部账单\n
+    * --after 从上一页末尾打印的翻页标志之后继续打印下一页\n
+    * --align 打印时金额和日期按列对齐\n
+    * --pager 打印到环境变量PAGER指定的分页程序， 默认为less\n\n
+
+    * --local 从sync命令同步的本地快照里查询， 不连接数据库， 不能删除或修改账单\n\n
+
+    * --explain 不处理账单， 打印数据库为查询条件选择的计划 使用的索引以及扫描和返回的账单数量\n\n
 
     """
 
-    begin_timestamp, end_timestamp = TimeRangeStamp(timeMode, timeString)()
-    query: Dict[str, Any] = {
-        "time_line": {"$gte": begin_timestamp, "$lte": end_timestamp}
-    }
-    if moneyType != MoneyType.all:
-        query.update(
-            {"money": {("$gt" if moneyType == MoneyType.income else "$lt"): 0}}
+    with PROFILER.phase("解析参数"):
+        query = build_query(
+            timeMode, timeString, condition, moneyType, tags, tag_vocabulary(local)
         )
-    if condition is not None:
-        query.update(condition.build(moneyType=moneyType))
+    renderer = MoneyLogRenderer(align=align, pager=pager)
+
+    if explain:
+        if local:
+            print("本地快照没有索引， 总是扫描全部账单")
+            exit(0)
+        print(f"查询条件： {json.dumps(query, ensure_ascii=False)}")
+        for name, value in open_storage().explain(query, sortMode.build()):
+            print(f"{name}： {value}")
+    elif local:
+        queryLocal(
+            query, sortMode, sequel, output=output, compress=compress, renderer=renderer
+        )
+    elif sequel in (Sequel.update_all, Sequel.remove_all):
+        edit = BulkEdit(
+            setTags=None if setTags is None else split_tags(setTags),
+            addTags=split_tags(addTags),
+            removeTags=split_tags(removeTags),
+            setMoney=setMoney,
+            scaleMoney=scaleMoney,
+            shiftTime=shiftTime or 0,
+        )
+        bulkProcess(open_storage(), query, sequel, edit, dryRun=dryRun)
+    elif sequel in (Sequel.total, Sequel.average, Sequel.size):
+        storage = open_storage()
+        with PROFILER.phase("查询"):
+            result = storage.summary(query)
+        result.show(sequel)
+    elif sequel in (Sequel.json, Sequel.csv, Sequel.ndjson):
+        exporter = MoneyLogExporter(sequel, output=output, compress=compress)
+        total = exporter.export(
+            open_storage().iterDocs(
+                query,
+                sortMode=sortMode.build(),
+                projection=BATCH_PROJECTION,
+                batch_size=batchSize,
+            )
+        )
+        if exporter.path != "-":
+            print(f"已经导出 {total} 条账单到 {exporter.path}")
+    elif (mls := open_storage().find(query, sortMode=sortMode.build())) is not None:
+        if sequel == Sequel.print and (pageSize > 0 or after != ""):
+            moneyLogs, nextMark = mls.keysetPage(after, pageSize or DEFAULT_PAGE_SIZE)
+            mls.showPage(moneyLogs, renderer=renderer)
+            if nextMark != "":
+                print(f"查看下一页： --after {nextMark}")
+        else:
+            mls.processSequel(sequel, renderer)
 
-    tagSet: Set[str] = set(filter(lambda it: len(it) != 0, tags.split(" ")))
 
-    if len(tagSet) != 0:
-        query.update({"tags": {"$in": list(tagSet)}})
+def split_tags(tags: str) -> Set[str]:
+    return set(filter(lambda it: len(it) != 0, tags.split(" ")))
+
 
-    if (mls := MongoConnection().find(query, sortMode=sortMode.build())) is not None:
-        mls.processSequel(sequel)
+def bulkProcess(
+    storage: LedgerStorage,
+    query: Dict[str, Any],
+    sequel: Sequel,
+    edit: BulkEdit,
+    dryRun: bool = False,
+):
+    """
+    批量修改或删除符合条件的全部账单， 先显示匹配的数量， 只确认一次
+    """
+    if sequel == Sequel.update_all and edit.empty():
+        raise typer.BadParameter(
+            "update_all 至少需要一个修改选项， 如 --add-tags --set-money --shift-time"
+        )
+
+    total = storage.count(query)
+    action = f"修改为： {edit.fmt()}" if sequel == Sequel.update_all else "彻底删除"
+    print(f"查询到 {total} 条账单， 将要{action}")
+    if total == 0 or dryRun:
+        return
+
+    if sequel == Sequel.remove_all:
+        print("删除以后不可恢复")
+    if not confirm():
+        print("操作已取消")
+        return
+
+    if sequel == Sequel.update_all:
+        print(f"已经修改 {storage.updateMany(query, edit)} 条账单")
+    else:
+        print(f"已经删除 {storage.deleteMany(query)} 条账单")
+
+
+def tag_vocabulary(local: bool) -> Callable[[], TagTrie]:
+    """
+    返回按需加载标签字典的函数， local为True时从本地快照统计
+    """
+    if local:
+        return lambda: open_snapshot().load().tagTrie()
+
+    return lambda: open_storage().tagTrie()
+
+
+def queryLocal(
+    query: Dict[str, Any],
+    sortMode: SortMode,
+    sequel: Sequel,
+    output: str = "",
+    compress: bool = False,
+    renderer: Optional[MoneyLogRenderer] = None,
+):
+    """
+    在本地快照里执行query命令， 查询条件的含义和数据库查询相同
+    """
+    if sequel in (Sequel.remove, Sequel.update, Sequel.update_all, Sequel.remove_all):
+        print("本地快照是只读的， 删除或修改账单请去掉 --local 选项")
+        exit(-1)
+
+    with PROFILER.phase("查询"):
+        batch = open_snapshot().load().select(query)
+    if sequel in (Sequel.total, Sequel.average, Sequel.size):
+        batch.summary().show(sequel)
+    elif sequel in (Sequel.json, Sequel.csv, Sequel.ndjson):
+        exporter = MoneyLogExporter(sequel, output=output, compress=compress)
+        total = exporter.export(batch.docs(batch.order(sortMode.build())))
+        if exporter.path != "-":
+            print(f"已经导出 {total} 条账单到 {exporter.path}")
+    else:
+        docs = batch.docs(batch.order(sortMode.build()))
+        with PROFILER.phase("格式化"):
+            (renderer or MoneyLogRenderer()).write(
+                (it["money"], it["tags"], it["time_line"]) for it in docs
+            )
+
+
+def parse_percentiles(raw_str: str) -> List[float]:
+    try:
+        qs = [float(it) for it in re.split(r"[\s,]+", raw_str.strip()) if it]
+    except ValueError:
+        raise typer.BadParameter(f"Invalid Percentiles: {raw_str}")
+
+    if len(qs) == 0 or any(it < 0 or it > 100 for it in qs):
+        raise typer.BadParameter(f"Percentiles must be between 0 and 100: {raw_str}")
+
+    return qs
+
+
+def parse_window(
+    raw_str: str, timeMode: TimeQueryMode
+) -> Tuple[TimeQueryMode, str, int, int]:
+    """
+    把 [时间模式:]时间字符串 解析为 (时间模式, 时间字符串, 开始时间戳, 结束时间戳)\n
+    省略时间模式时使用timeMode， 如 -1 year:-1 range:2024-04-01 2024-04-30
+    """
+    mode, sep, pattern = raw_str.partition(":")
+    if sep == "":
+        mode, pattern = timeMode.value, raw_str
+    if mode not in TimeQueryMode.__members__ or pattern.strip() == "":
+        raise typer.BadParameter(f"Invalid Window: {raw_str}")
+
+    queryMode, pattern = TimeQueryMode(mode), pattern.strip()
+    try:
+        begin, end = TimeRangeStamp(queryMode, pattern)()
+    except (LookupError, ValueError) as e:
+        raise typer.BadParameter(f"Invalid Window: {raw_str} ({e})")
+
+    return (queryMode, pattern, begin, end)
+
+
+def histogram_timezone(name: str) -> Tuple[str, tzinfo]:
+    """
+    把配置文件里的时区解析为 (MongoDB使用的时区字符串, Python的tzinfo)\n
+    可以是 Asia/Shanghai 这样的时区名称或者 +08:00 这样的固定偏移， 留空使用系统当前的UTC偏移
+    """
+    if name == "":
+        offset = datetime.now().astimezone().utcoffset() or timedelta()
+    elif (result := re.fullmatch(r"([+-])(\d{2}):?(\d{2})", name)) is not None:
+        offset = timedelta(hours=int(result.group(2)), minutes=int(result.group(3)))
+        offset = -offset if result.group(1) == "-" else offset
+    else:
+        from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+        try:
+            return (name, ZoneInfo(name))
+        except (ZoneInfoNotFoundError, ValueError):
+            print(f"配置文件里的时区无效： {name}")
+            exit(-1)
+
+    minutes = int(offset.total_seconds()) // 60
+    sign = "-" if minutes < 0 else "+"
+    return (f"{sign}{abs(minutes) // 60:02d}:{abs(minutes) % 60:02d}", timezone(offset))
+
+
+def histogram_bar(value: float, peak: float, width: int) -> str:
+    """
+    用方块字符画一条长度和value成正比的横条， peak对应width个字符
+    """
+    if peak <= 0:
+        return ""
+
+    eighths = round(abs(value) / peak * width * 8)
+    return "█" * (eighths // 8) + ("", "▏", "▎", "▍", "▌", "▋", "▊", "▉")[eighths % 8]
+
+
+def period_windows(begin: int, end: int, period: ReportPeriod) -> List[Tuple[int, int]]:
+    """
+    把 [begin, end] 按照本地时间的周期边界切分为互不相交的时间段， 每一段都是闭区间
+    """
+    windows = []
+    current = begin
+    while current <= end:
+        day = date.fromtimestamp(current / 1000)
+        if period == ReportPeriod.day:
+            boundary = day + timedelta(days=1)
+        elif period == ReportPeriod.week:
+            boundary = day + timedelta(days=7 - day.weekday())
+        else:
+            boundary = date(day.year + day.month // 12, day.month % 12 + 1, 1)
+        nextBegin = int(
+            datetime(boundary.year, boundary.month, boundary.day).timestamp() * 1000
+        )
+        windows.append((current, min(nextBegin - 1, end)))
+        current = nextBegin
+
+    return windows
+
+
+def load_batch_async(query: Dict[str, Any], period: ReportPeriod) -> MoneyLogBatch:
+    """
+    把查询按照汇总周期切分， 用异步连接同时查询每一个周期， 合并为一个MoneyLogBatch
+    """
+    import asyncio
+    from mongo_backend import AsyncMongoConnection
+
+    timeRange = query["time_line"]
+    queries = [
+        {**query, "time_line": {"$gte": begin, "$lte": end}}
+        for begin, end in period_windows(timeRange["$gte"], timeRange["$lte"], period)
+    ]
+
+    async def load() -> MoneyLogBatch:
+        async with AsyncMongoConnection() as storage:
+            return await storage.loadBatches(queries)
+
+    return asyncio.run(load())
+
+
+def async_supported() -> bool:
+    """
+    --async 只支持MongoDB后端， SQLite后端提示以后按顺序执行
+    """
+    if load_config()["backend"] == StorageBackend.mongodb:
+        return True
+
+    print("SQLite后端不支持 --async， 按顺序执行", file=sys.stderr)
+    return False
 
 
 @app.command()
-def mass(path: Path):
+def report(
+    timeMode: Annotated[
+        TimeQueryMode, typer.Option("--time-mode", "-tm")
+    ] = TimeQueryMode.year,
+    timeString: Annotated[str, typer.Option("--time-string", "-ts")] = "=0",
+    condition: Annotated[
+        Optional[Condition], typer.Option("--condition", "-c", parser=parse_condition)
+    ] = None,
+    moneyType: Annotated[
+        MoneyType, typer.Option("--money-type", "-mt")
+    ] = MoneyType.all,
+    tags: Annotated[str, typer.Option("--tags", "-t")] = "",
+    period: Annotated[
+        ReportPeriod, typer.Option("--period", "-p")
+    ] = ReportPeriod.month,
+    percentiles: Annotated[str, typer.Option("--percentiles", "-pc")] = "50 90 99",
+    fmt: Annotated[ReportFormat, typer.Option("--format", "-f")] = ReportFormat.table,
+    local: Annotated[bool, typer.Option("--local", "-l")] = False,
+    useAsync: Annotated[bool, typer.Option("--async")] = False,
+):
     """
-    从指定文件里导入账单\n
-    path .csv文件， 后续支持更多文件
+    * 统计报表 需要安装numpy\n\n
+
+    * --time-mode --time-string --condition --money-type --tags 和query命令相同\n
+    默认统计今年一月一号到当前的账单\n
+    * --period 汇总周期 day week 或 month 默认为 month\n
+    * --percentiles 需要计算的支出百分位， 用空格隔开 默认 "50 90 99"\n
+    * --format 输出格式 table 文本表格 或 csv 默认为 table\n
+    * --local 从sync命令同步的本地快照里统计， 不连接数据库\n
+    * --async 按汇总周期切分查询， 同时查询每一个周期， 只支持MongoDB后端\n\n
+
+    报表包括： 每个周期的金额 笔数 以及周期最后一天的7日和30日滚动平均\n
+    每个标签的金额和笔数， 支出金额的百分位
     """
+    qs = parse_percentiles(percentiles)
+    query = build_query(
+        timeMode, timeString, condition, moneyType, tags, tag_vocabulary(local)
+    )
+    if local:
+        batch = open_snapshot().load().select(query)
+    elif useAsync and async_supported():
+        batch = load_batch_async(query, period)
+    else:
+        batch = open_storage().loadBatch(query)
+    if len(batch) == 0:
+        print("没有符合条件的账单")
+        return
+
+    from ledger_report import LedgerReport
+
+    ledgerReport = LedgerReport(batch)
+    sections = [
+        ("周期汇总", ledgerReport.periods(period)),
+        ("标签汇总", ledgerReport.tagTotals()),
+        ("支出百分位", ledgerReport.percentiles(qs)),
+    ]
+    for i, (title, (header, rows)) in enumerate(sections):
+        if i != 0:
+            print()
+        if fmt == ReportFormat.table:
+            print(f"{title}：")
+        write_rows(header, rows, asCsv=fmt == ReportFormat.csv)
 
-    if (not path.exists()) or (not path.is_file()):
-        raise typer.BadParameter(
-            f"{path} 的内容不可读取， 请检查文件是否存在， 是否有可读权限"
+
+@app.command()
+def compare(
+    windows: Annotated[List[str], typer.Option("--time-string", "-ts")] = [
+        "-1",
+        "=0",
+    ],
+    timeMode: Annotated[
+        TimeQueryMode, typer.Option("--time-mode", "-tm")
+    ] = TimeQueryMode.month,
+    condition: Annotated[
+        Optional[Condition], typer.Option("--condition", "-c", parser=parse_condition)
+    ] = None,
+    moneyType: Annotated[
+        MoneyType, typer.Option("--money-type", "-mt")
+    ] = MoneyType.all,
+    tags: Annotated[str, typer.Option("--tags", "-t")] = "",
+    fmt: Annotated[ReportFormat, typer.Option("--format", "-f")] = ReportFormat.table,
+    local: Annotated[bool, typer.Option("--local", "-l")] = False,
+):
+    """
+    * 并排比较多个时间段的金额和笔数， 以及每个时间段相对上一个时间段的变化\n\n
+
+    * --time-string 可以重复多次， 每次指定一个时间段， 格式为 [时间模式:]时间字符串\n
+    时间字符串的含义和query命令相同， 省略时间模式时使用 --time-mode 默认为 month\n
+    默认比较上个月和本月一号到当前， 如：\n
+    -ts -1 -ts =0 // 上个月和本月\n
+    -ts year:-2 -ts year:-1 -ts year:=0 // 最近三年\n
+    -ts "range:2023-05-01 2023-05-31" -ts "range:2024-05-01 2024-05-31" // 两年的五月\n\n
+
+    * --condition --money-type --tags 和query命令相同， 对每个时间段都生效\n
+    * --format 输出格式 table 文本表格 或 csv 默认为 table\n
+    * --local 从sync命令同步的本地快照里统计， 不连接数据库\n\n
+
+    MongoDB后端用一次$facet聚合同时统计全部时间段， 不管比较几个时间段都只有一次往返
+    """
+    parsed = [parse_window(it, timeMode) for it in windows]
+    query = build_query(
+        parsed[0][0], parsed[0][1], condition, moneyType, tags, tag_vocabulary(local)
+    )
+    queries = [
+        {**query, "time_line": {"$gte": begin, "$lte": end}}
+        for _, _, begin, end in parsed
+    ]
+    with PROFILER.phase("查询"):
+        if local:
+            batch = open_snapshot().load()
+            results = [batch.select(it).summary() for it in queries]
+        else:
+            results = open_storage().summaries(queries)
+
+    rows = []
+    previous = None
+    for label, (_, _, begin, end), result in zip(windows, parsed, results):
+        delta = rate = "-"
+        if previous is not None:
+            delta = f"{result.total - previous.total:+.2f}"
+            if previous.total != 0:
+                rate = f"{(result.total - previous.total) / abs(previous.total):+.1%}"
+        rows.append(
+            [
+                label,
+                date.fromtimestamp(begin / 1000).isoformat(),
+                date.fromtimestamp(end / 1000).isoformat(),
+                f"{result.total:.2f}",
+                result.count,
+                delta,
+                rate,
+            ]
         )
+        previous = result
+    write_rows(
+        ["时间段", "开始", "结束", "金额", "笔数", "金额变化", "变化率"],
+        rows,
+        asCsv=fmt == ReportFormat.csv,
+    )
 
-    buffer = path.read_bytes()
-    encoding = chardet.detect(buffer)["encoding"]
-
-    content = buffer.decode(encoding=encoding if encoding else "UTF-8")
-    if path.suffix == ".csv":
-        moneyCollection = MoneyLogCollection(
-            moneyLogs=list(
-                (
-                    parseMoneyLog(lines=lines, is_throw=True)
-                    for it in content.splitlines()
-                    if (lines := it.split(",")).__len__() == 3
-                )
+
+@app.command()
+def histogram(
+    timeMode: Annotated[
+        TimeQueryMode, typer.Option("--time-mode", "-tm")
+    ] = TimeQueryMode.year,
+    timeString: Annotated[str, typer.Option("--time-string", "-ts")] = "=0",
+    condition: Annotated[
+        Optional[Condition], typer.Option("--condition", "-c", parser=parse_condition)
+    ] = None,
+    moneyType: Annotated[
+        MoneyType, typer.Option("--money-type", "-mt")
+    ] = MoneyType.all,
+    tags: Annotated[str, typer.Option("--tags", "-t")] = "",
+    bucket: Annotated[
+        HistogramBucket, typer.Option("--bucket", "-b")
+    ] = HistogramBucket.day,
+    width: Annotated[int, typer.Option("--width", "-w", min=1)] = 40,
+    fmt: Annotated[ReportFormat, typer.Option("--format", "-f")] = ReportFormat.table,
+    local: Annotated[bool, typer.Option("--local", "-l")] = False,
+):
+    """
+    * 按时间分组统计账单的金额和笔数， 画成文本柱状图\n\n
+
+    * --time-mode --time-string --condition --money-type --tags 和query命令相同\n
+    默认统计今年一月一号到当前的账单\n
+    * --bucket 分组方式 默认为 day， 可以是如下值：\n
+    day 每天 week 每周（周一开始） month 每月 hour 一天里的每个小时 weekday 一周里的星期几\n
+    * --width 柱状图最长的横条的字符数 默认40\n
+    * --format 输出格式 table 文本柱状图 或 csv 默认为 table\n
+    * --local 从sync命令同步的本地快照里统计， 不连接数据库\n\n
+
+    分组使用配置文件里的timezone时区， 留空使用系统时区\n
+    分组在数据库里完成， 只有每个分组的汇总结果通过网络返回， MongoDB后端需要5.0以上的版本
+    """
+    query = build_query(
+        timeMode, timeString, condition, moneyType, tags, tag_vocabulary(local)
+    )
+    zone = histogram_timezone(load_config()["timezone"])
+    with PROFILER.phase("查询"):
+        if local:
+            batch = open_snapshot().load().select(query)
+            buckets = fold_buckets(
+                ((it["time_line"], it["money"], 1) for it in batch.docs()),
+                bucket,
+                zone[1],
             )
-        )
-    elif path.suffix == ".json":
-        content = content.replace("'", '"')
-        pyDict = json.loads(content)
-        for it in pyDict:
-            it.update({"time_line": parse_timestamp(it["time_line"])})
+        else:
+            buckets = open_storage().histogram(query, bucket, zone)
+    if len(buckets) == 0:
+        print("没有符合条件的账单")
+        return
+
+    keys = bucket.keys(buckets.keys())
+    values = [buckets.get(it, (0.0, 0)) for it in keys]
+    rows = [
+        [bucket.label(key), f"{total:.2f}", count]
+        for key, (total, count) in zip(keys, values)
+    ]
+    if fmt == ReportFormat.csv:
+        write_rows(["分组", "金额", "笔数"], rows, asCsv=True)
+        return
+
+    buffer = io.StringIO()
+    write_rows(["分组", "金额", "笔数"], rows, stream=buffer)
+    lines = buffer.getvalue().splitlines()
+    peak = max(abs(total) for total, _ in values)
+    print(lines[0])
+    for line, (total, _) in zip(lines[1:], values):
+        print(f"{line}  {histogram_bar(total, peak, width)}".rstrip())
+
+
+@app.command()
+def tags(
+    pattern: Annotated[str, typer.Argument()] = "",
+    limit: Annotated[int, typer.Option("--limit", "-n", min=0)] = 20,
+    rebuild: Annotated[bool, typer.Option("--rebuild")] = False,
+    local: Annotated[bool, typer.Option("--local", "-l")] = False,
+):
+    """
+    * 列出最常用的标签， 包括使用次数和最后一次使用的日期\n\n
 
-        moneyCollection = MoneyLogCollection(moneyLogs=pyDict)
+    * 第一个参数 标签前缀或者通配符， 比如 餐 或者 *费 默认列出全部标签\n
+    * --limit 最多列出的标签数量 0表示全部 默认20\n
+    * --rebuild 从全部账单重新统计标签字典\n
+    * --local 从sync命令同步的本地快照里统计\n\n
 
+    query和report命令的--tags也可以使用通配符， 如 --tags "餐*"
+    """
+    storage = None if local else open_storage()
+    if rebuild and hasattr(storage, "rebuildTagDictionary"):
+        storage.rebuildTagDictionary()
+
+    tagTrie = tag_vocabulary(local)() if storage is None else storage.tagTrie()
+    if any(ch in pattern for ch in TAG_WILDCARDS):
+        found = sorted(tagTrie.expand(pattern), key=lambda it: -tagTrie.usage[it][0])
+        found = found[:limit] if limit > 0 else found
     else:
-        print("暂时不支持该文件格式的账单导入")
+        found = tagTrie.complete(pattern, limit=limit)
+
+    if len(found) == 0:
+        print("没有匹配的标签")
+        return
+
+    rows = []
+    for it in found:
+        count, lastUsed = tagTrie.usage[it]
+        rows.append([it, count, date.fromtimestamp(lastUsed / 1000).isoformat()])
+    write_rows(["标签", "笔数", "最后使用"], rows)
+
+
+@app.command()
+def dedup():
+    """
+    合并账单集合里已经存在的重复账单， 然后给旧账单补上内容指纹\n
+    金额 时间 标签和来源编号都相同的账单是重复的， 每组只保留最早写入的一条\n
+    之后mass命令按指纹跳过重复的账单， 重复导入同一个文件不会产生重复账单\n
+    MongoDB后端需要5.2以上的版本
+    """
+    begin = time.perf_counter()
+    removed, filled = open_storage().dedup()
+    print(
+        f"删除 {removed} 条重复账单， 给 {filled} 条旧账单补上指纹， 耗时 {time.perf_counter() - begin:.2f} 秒"
+    )
+
+
+@app.command()
+def rebuild_rollups():
+    """
+    扫描全部账单重建按天汇总的集合\n
+    之后add mass以及删除修改账单会自动更新汇总集合\n
+    query命令的total average和size会尽量从汇总集合读取整天的数据\n
+    只在使用MongoDB后端时需要
+    """
+    if load_config()["backend"] != StorageBackend.mongodb:
+        print("SQLite后端直接使用索引统计， 不需要汇总集合")
+        exit(0)
+
+    begin = time.perf_counter()
+    total = open_storage().rebuildRollups()
+    print(
+        f"汇总集合重建完成， 共 {total} 行， 耗时 {time.perf_counter() - begin:.2f} 秒"
+    )
+
+
+@app.command()
+def sync(full: Annotated[bool, typer.Option("--full")] = False):
+    """
+    把账单集合同步到本地快照， 之后query和report命令可以用 --local 选项离线查询\n
+    默认只同步上次同步之后新增 修改和删除的账单\n
+    --full 丢弃本地快照， 重新下载全部账单\n
+    快照的位置由配置文件的snapshot_path指定\n
+    """
+    if load_config()["backend"] != StorageBackend.mongodb:
+        print("SQLite后端的数据已经保存在本地， 不需要同步")
         exit(0)
 
-    mongoConnection = MongoConnection()
-    for ml in moneyCollection.moneyLogs:
-        if ml is None:
-            continue
-        if newMoneyLog := mongoConnection.insert(ml):
-            print(f"导入成功， \n{newMoneyLog.fmt()}")
+    snapshot = open_snapshot()
+    begin = time.perf_counter()
+    added, updated, deleted = snapshot.sync(open_storage(), full=full)
+    print(
+        f"同步完成， 新增 {added} 条账单， 更新 {updated} 条， 移除 {deleted} 条已删除的账单， 快照共有 {snapshot.meta()['rows']} 条账单， 耗时 {time.perf_counter() - begin:.2f} 秒"
+    )
+
+
+def insert_many_async(
+    moneyLogs: Iterable["MoneyLog"],
+    chunk_size: int,
+    ordered: bool,
+    progress: Callable[[BulkInsertReport], None],
+    inflight: int,
+) -> BulkInsertReport:
+    """
+    用异步连接批量导入账单， 参数和LedgerStorage.insertMany相同
+    """
+    import asyncio
+    from mongo_backend import AsyncMongoConnection
+
+    async def insert() -> BulkInsertReport:
+        async with AsyncMongoConnection() as storage:
+            return await storage.insertMany(
+                moneyLogs,
+                chunk_size=chunk_size,
+                ordered=ordered,
+                progress=progress,
+                inflight=inflight,
+            )
+
+    return asyncio.run(insert())
+
+
+def expand_import_paths(paths: List[Path]) -> List[Path]:
+    """
+    把命令行给出的文件 目录和通配符展开为要导入的账单文件， 重复的文件只导入一次\n
+    目录递归查找， 目录和通配符里不支持的文件格式直接跳过
+    """
+    found: Dict[Path, Path] = {}
+    for path in paths:
+        if path.is_dir():
+            candidates = sorted(it for it in path.rglob("*") if it.is_file())
+        elif any(ch in str(path) for ch in "*?["):
+            candidates = sorted(Path(it) for it in glob.glob(str(path), recursive=True))
+            candidates = [it for it in candidates if it.is_file()]
+        elif path.is_file():
+            if path.suffix not in IMPORT_SUFFIXES:
+                raise typer.BadParameter(f"暂时不支持该文件格式的账单导入： {path}")
+            candidates = [path]
         else:
-            print(f"导入失败， \n{ml.fmt()}")
+            raise typer.BadParameter(
+                f"{path} 的内容不可读取， 请检查文件是否存在， 是否有可读权限"
+            )
+
+        for it in candidates:
+            if it.suffix in IMPORT_SUFFIXES:
+                found.setdefault(it.resolve(), it)
+
+    return list(found.values())
+
+
+_import_queue: Any = None  # 解析进程把账单批次放进这个队列， 由主进程统一写入
+
+
+def init_import_worker(queue: Any):
+    global _import_queue
+    _import_queue = queue
+
 
+def parse_import_file(index: int, path: str, chunk_size: int):
+    """
+    在解析进程里运行， 推测编码并解析校验一个账单文件\n
+    每一批账单以 (文件序号, [账单文档, ...], None) 的形式放进队列\n
+    结束时放入 (文件序号, None, 错误原因)， 成功时错误原因为None
+    """
+    error = None
+    try:
+        for chunk in chunked(iterMoneyLogFile(Path(path)), chunk_size):
+            _import_queue.put((index, [moneylog_doc(it) for it in chunk], None))
+    except ParseMoneyLogError as e:
+        error = str(e)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        _import_queue.put((index, None, error))
+
+
+def mass_parallel(
+    paths: List[Path],
+    chunk_size: int,
+    ordered: bool,
+    jobs: int,
+    progress: Callable[[BulkInsertReport], None],
+) -> Tuple[BulkInsertReport, List[List[Any]]]:
+    """
+    用进程池并行解析多个文件， 解析好的批次经过有界队列交给主进程， 由主进程逐批写入\n
+    返回总的导入结果和每个文件的 [文件, 解析, 写入, 重复, 失败, 错误]\n
+    解析进程全部启动以后才连接数据库， 子进程不会继承数据库连接
+    """
+    import multiprocessing
+    import queue as queues
+    from concurrent.futures import ProcessPoolExecutor
+
+    report = BulkInsertReport()
+    files = [[str(it), 0, 0, 0, 0, ""] for it in paths]
+    begin = time.perf_counter()
+    pending = multiprocessing.Queue(maxsize=jobs * IMPORT_CHUNKS_PER_WORKER)
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=init_import_worker, initargs=(pending,)
+    ) as pool:
+        futures = [
+            pool.submit(parse_import_file, i, str(it), chunk_size)
+            for i, it in enumerate(paths)
+        ]
+        storage = open_storage()
+        unfinished = set(range(len(paths)))
+        while unfinished:
+            try:
+                index, docs, error = pending.get(timeout=1)
+            except queues.Empty:
+                # 解析进程意外退出时不会再放入结束标记
+                for i in list(unfinished):
+                    if futures[i].done() and futures[i].exception() is not None:
+                        files[i][5] = str(futures[i].exception())
+                        unfinished.discard(i)
+                continue
+
+            if docs is None:
+                files[index][5] = error or ""
+                unfinished.discard(index)
+                continue
+
+            inserted, skipped, reason = storage.insertDocs(docs, ordered)
+            failed = len(docs) - inserted - skipped
+            files[index][1] += len(docs)
+            files[index][2] += inserted
+            files[index][3] += skipped
+            files[index][4] += failed
+            report.chunks += 1
+            report.total += len(docs)
+            report.inserted += inserted
+            report.skipped += skipped
+            if reason is not None:
+                report.errors.append(
+                    f"{paths[index]} 有 {failed} 条账单写入失败： {reason}"
+                )
+            report.elapsed = time.perf_counter() - begin
+            progress(report)
+
+    report.elapsed = time.perf_counter() - begin
+    return (report, files)
+
+
+@app.command()
+def mass(
+    paths: Annotated[List[Path], typer.Argument()],
+    chunkSize: Annotated[int, typer.Option("--chunk-size", "-cs", min=1)] = 1000,
+    ordered: Annotated[bool, typer.Option("--ordered/--unordered")] = False,
+    useAsync: Annotated[bool, typer.Option("--async")] = False,
+    inflight: Annotated[int, typer.Option("--in-flight", "-if", min=1)] = 4,
+    jobs: Annotated[int, typer.Option("--jobs", "-j", min=1)] = os.cpu_count() or 1,
+):
+    """
+    从指定的文件 目录或者通配符里导入账单\n
+    paths .csv和.json文件， 目录会递归查找这两种文件， 通配符如 "exports/**/*.csv"\n
+    csv文件可选的第四列和json账单的source_id是账单的来源编号， 比如银行流水号\n
+    内容指纹已经存在的账单会被跳过， 重复导入同一个文件是安全的\n
+    --chunk-size 每一批写入数据库的账单数量 默认1000\n
+    --ordered 按顺序写入， 遇到错误的批次停止写入剩余账单 默认 --unordered 跳过错误继续写入\n
+    --async 使用异步连接， 解析下一批账单的同时写入前面的批次， 只支持MongoDB后端\n
+    --in-flight 使用--async时最多同时写入的批次数量 默认4\n
+    --jobs 导入多个文件时并行解析的进程数量 默认为CPU核心数\n
+    多个文件由进程池并行解析， 解析好的账单由一个进程统一写入， 最后列出每个文件的导入结果\n
+    """
+
+    files = expand_import_paths(paths)
+    if len(files) == 0:
+        print("没有找到可以导入的 .csv 或 .json 文件")
+        exit(0)
+
+    def progress(report: BulkInsertReport):
+        print(f"\r{report.progress_fmt()}", end="", flush=True)
+
+    if len(files) > 1:
+        if useAsync:
+            print("导入多个文件时使用进程池， 忽略 --async", file=sys.stderr)
+        report, rows = mass_parallel(
+            files,
+            chunkSize,
+            ordered,
+            min(jobs, len(files)),
+            progress,
+        )
+        print()
+        write_rows(["文件", "解析", "写入", "重复", "失败", "错误"], rows)
+    elif useAsync and async_supported():
+        report = insert_many_async(
+            iterMoneyLogFile(files[0]), chunkSize, ordered, progress, inflight
+        )
+        print()
+    else:
+        report = open_storage().insertMany(
+            iterMoneyLogFile(files[0]),
+            chunk_size=chunkSize,
+            ordered=ordered,
+            progress=progress,
+        )
+        print()
+    print(report.fmt())
     print("请你子西核对， 程序可能忽略了， 不符合格式要求的账单记录")
 
 
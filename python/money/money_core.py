@@ -0,0 +1,1167 @@
+# --*-- Encoding: UTF-8 --*--
+# * description: money.py和各个存储后端共用的常量 枚举 账单批次和格式化工具， 不导入项目里的其他模块
+
+from typing import (
+    Set,
+    List,
+    Dict,
+    Any,
+    Union,
+    Optional,
+    Tuple,
+    Callable,
+    Iterable,
+    Iterator,
+    TextIO,
+    TYPE_CHECKING,
+)
+from enum import Enum
+from pathlib import Path
+from itertools import islice
+from array import array
+import re
+import time
+from datetime import datetime, date, timedelta, tzinfo
+import json
+import io
+import sys
+import csv
+import os
+import operator
+import unicodedata
+import fnmatch
+import logging
+from functools import lru_cache
+import dataclasses
+from contextlib import contextmanager
+import typer
+
+
+MONGO_CONFIG_PATH = "./mongo_config.json"
+DEFAULT_PAGE_SIZE = 20  # 分页展示和读取账单时每页的数量
+TAG_WILDCARDS = "*?["  # 标签里出现这些字符时按照通配符展开
+MONEYLOG_PROJECTION = {"money": 1, "tags": 1, "time_line": 1}  # 构造MoneyLog需要的字段
+# 列式统计需要的字段
+BATCH_PROJECTION = {"_id": 0, "money": 1, "tags": 1, "time_line": 1}
+# 本地快照支持的比较运算符
+FILTER_OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "$eq": operator.eq,
+    "$ne": operator.ne,
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$lt": operator.lt,
+    "$lte": operator.le,
+}
+DEFAULT_MONGO_CONFIG: Dict[str, Any] = {
+    "backend": "mongodb",  # mongodb 或者 sqlite
+    "sqlite_path": "./money.db",
+    "host": "mongodb://localhost:27017",
+    "db_name": "money_db",
+    "collection_name": "money_log",
+    "max_pool_size": 10,
+    "min_pool_size": 0,
+    "connect_timeout_ms": 5000,
+    "server_selection_timeout_ms": 5000,
+    "socket_timeout_ms": 0,  # 0表示不限制
+    "read_concern": "local",
+    "write_concern": 1,
+    "probe_timeout_ms": 500,
+    "probe_cache_ttl": 30,  # 秒 0表示每次都探测
+    "snapshot_path": "./money_snapshot",
+    "timezone": "",  # histogram命令分组使用的时区 留空使用系统时区
+}
+WEEKDAY_NAMES = ["周一", "周二", "周三", "周四", "周五", "周六", "周日"]
+
+
+def err_process(err: Exception):
+    """
+    统一处理在程序的其他部分没有适当处理的错误
+    """
+    # 没有导入过pymongo或sqlite3的时候不可能出现对应数据库的错误
+    if "pymongo" in sys.modules and isinstance(
+        err, sys.modules["pymongo"].errors.PyMongoError
+    ):
+        logging.critical(f"MongoDB数据库严重错误： {err}")
+        exit(-1)
+    elif "sqlite3" in sys.modules and isinstance(err, sys.modules["sqlite3"].Error):
+        logging.critical(f"SQLite数据库严重错误： {err}")
+        exit(-1)
+    elif isinstance(err, ParseMoneyLogError):
+        logging.critical(f"解析错误： {err}")
+        exit(-1)
+
+    elif isinstance(err, KeyboardInterrupt):
+        logging.info("应用程序已经终止运行")
+        exit(0)
+
+    raise err
+
+
+def parse_timestamp(dt_str: str) -> int:
+    dt_values = [int(it) for it in re.split(r"\.|T|:|-|\s", dt_str)]
+
+    dt = datetime(*dt_values[:6])
+    return int(dt.timestamp() * 1000)
+
+
+def now_timestamp() -> int:
+    """
+    当前时间的毫秒时间戳
+    """
+    return int(time.time() * 1000)
+
+
+def day_start(time_line: int) -> int:
+    """
+    时间戳所在的那一天本地时间零点的毫秒时间戳
+    """
+    day = date.fromtimestamp(time_line / 1000)
+    return int(datetime(day.year, day.month, day.day).timestamp() * 1000)
+
+
+def next_day_start(time_line: int) -> int:
+    """
+    时间戳所在的那一天的下一天本地时间零点的毫秒时间戳
+    """
+    day = date.fromtimestamp(time_line / 1000) + timedelta(days=1)
+    return int(datetime(day.year, day.month, day.day).timestamp() * 1000)
+
+
+def money_kind(money: float) -> str:
+    """
+    汇总表按照账单类型分开统计， 和MoneyType的income outlay对应， 0元的账单单独统计
+    """
+    return "income" if money > 0 else "outlay" if money < 0 else "zero"
+
+
+def chunked(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """
+    把可迭代对象按照size切分成若干批次， 最后一批可能不足size
+    """
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def fmt_size(size: float) -> str:
+    """
+    把字节数格式化为友好可读的字符串
+    """
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+
+    return f"{size:.1f}TB"
+
+
+def user_input(prompt: Union[str, List[str]], line_total: int = 1):
+    """
+    装饰器 获取用户通过stdin输入的数据， 返回适当的数据
+    如果没有合适的数据返回None
+    """
+
+    def outwrapper(fun: Callable[..., Any]):
+        def wrapper(*args, **kwargs):
+            if isinstance(prompt, list) and len(prompt) != line_total:
+                raise ValueError(
+                    f"缺少提示， prompt如果是list类型， 必须和line_total长度相等\n prompt[List] len: {len(prompt)}, total_line: {line_total}"
+                )
+
+            try:
+                lines = []
+                for i in range(line_total):
+                    inner_prompt = prompt[i] if isinstance(prompt, list) else prompt
+
+                    lines.append(input(inner_prompt).strip())
+            except (EOFError, KeyboardInterrupt):
+                return None
+
+            if not lines:
+                return None
+
+            return fun(*args, lines=lines, **kwargs)
+
+        return wrapper
+
+    return outwrapper
+
+
+@user_input("确认操作 yes Or No")
+def confirm(lines: List[str]) -> bool:
+    result = lines[0].lower()
+    return result in ["y", "yes", "ok", "好", "好的", "确定"]
+
+
+class MoneyType(str, Enum):
+    """
+    账单类型 全部 所得 或者 支出
+    """
+
+    all = "all"
+    income = "income"
+    outlay = "outlay"
+
+
+class SortMode(str, Enum):
+    """
+    如何给查询的账单排序， 金额升序 金额逆序 日期升序 日期逆序
+    """
+
+    raw = "raw"
+    money = "money"
+    date = "date"
+    money_reverse = "money_reverse"
+    date_reverse = "date_reverse"
+
+    def build(self, moneyType: MoneyType = MoneyType.all) -> Dict[str, int]:
+        """
+        根据排序选项生成MongoDB排序条件
+        """
+        if self == SortMode.money or self == SortMode.money_reverse:
+            if moneyType == MoneyType.outlay:
+                return {"money": -1 if self == SortMode.money_reverse else 1}
+
+            return {"money": 1 if self == SortMode.money_reverse else -1}
+
+        elif self == SortMode.date or self == SortMode.date_reverse:
+            return {"time_line": 1 if self == SortMode.date else -1}
+        else:
+            return {}
+
+
+class Sequel(str, Enum):
+    """
+    如何处理查询结果 直接打印 求 总和 总数 平均 或者转换到json/csv格式字符串\n
+    此外可以对查询到的账单做删除更新等操作
+    这样一个查询命令干完了所有的事情
+    """
+
+    print = "print"
+    size = "size"
+    total = "total"
+    average = "average"
+    json = "json"
+    csv = "csv"
+    ndjson = "ndjson"
+    remove = "remove"
+    update = "update"
+    update_all = "update_all"
+    remove_all = "remove_all"
+
+
+class StorageBackend(str, Enum):
+    """
+    账单的存储后端 MongoDB 或者 嵌入式的SQLite
+    """
+
+    mongodb = "mongodb"
+    sqlite = "sqlite"
+
+
+class BulkEdit:
+    """
+    对符合查询条件的全部账单做的同一个修改\n
+    标签依次执行 替换 添加 删除， 金额可以设为固定值或者乘以一个倍数， 时间可以整体平移
+    """
+
+    def __init__(
+        self,
+        setTags: Optional[Set[str]] = None,
+        addTags: Set[str] = set(),
+        removeTags: Set[str] = set(),
+        setMoney: Optional[float] = None,
+        scaleMoney: Optional[float] = None,
+        shiftTime: int = 0,
+    ):
+        if setMoney is not None and scaleMoney is not None:
+            raise typer.BadParameter("--set-money 和 --scale-money 不能同时使用")
+
+        self.setTags = setTags
+        self.addTags = addTags
+        self.removeTags = removeTags
+        self.setMoney = setMoney
+        self.scaleMoney = scaleMoney
+        self.shiftTime = shiftTime
+
+    def empty(self) -> bool:
+        return (
+            self.setTags is None
+            and not self.addTags
+            and not self.removeTags
+            and self.setMoney is None
+            and self.scaleMoney is None
+            and self.shiftTime == 0
+        )
+
+    def apply(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        返回修改以后的账单文档， 只包含money tags time_line字段
+        """
+        tags = set(doc["tags"]) if self.setTags is None else set(self.setTags)
+        money = doc["money"] if self.setMoney is None else self.setMoney
+        if self.scaleMoney is not None:
+            money = money * self.scaleMoney
+        return {
+            "money": money,
+            "tags": sorted((tags | self.addTags) - self.removeTags),
+            "time_line": doc["time_line"] + self.shiftTime,
+        }
+
+    def fmt(self) -> str:
+        """
+        友好可读的形式描述这个修改
+        """
+        items = []
+        if self.setTags is not None:
+            items.append(f"标签替换为 <{'  '.join(sorted(self.setTags))}>")
+        if self.addTags:
+            items.append(f"添加标签 <{'  '.join(sorted(self.addTags))}>")
+        if self.removeTags:
+            items.append(f"删除标签 <{'  '.join(sorted(self.removeTags))}>")
+        if self.setMoney is not None:
+            items.append(f"金额设为 {self.setMoney:.2f}￥")
+        if self.scaleMoney is not None:
+            items.append(f"金额乘以 {self.scaleMoney}")
+        if self.shiftTime != 0:
+            items.append(f"时间平移 {timedelta(milliseconds=self.shiftTime)}")
+        return "， ".join(items)
+
+
+class LazyModel:
+    """
+    pydantic模型的占位对象， 第一次创建实例或者访问属性的时候才导入money_models和pydantic\n
+    不需要读写账单的命令 比如 --help config-mongodb 因此不会导入pydantic
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    @property
+    def model(self) -> Any:
+        if (model := self.__dict__.get("_model")) is None:
+            # 导入pydantic的时间单独统计， 不计入正在进行的查询等阶段
+            with PROFILER.phase("导入"):
+                import money_models
+
+            model = self._model = getattr(money_models, self.name)
+        return model
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        return self.model(*args, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def __repr__(self) -> str:
+        return self.name
+
+
+# 类型检查器看到的是真正的pydantic模型， 注解里用字符串 "MoneyLog" 引用它
+if TYPE_CHECKING:
+    from money_models import MoneyLog
+else:
+    MoneyLog = LazyModel("MoneyLog")
+
+
+class ParseMoneyLogError(Exception):
+    pass
+
+
+def check_value(obj: Any, name: str) -> Any:
+    if obj is None:
+        raise ParseMoneyLogError("解析为MoneyLog对象的时候出错, 没有提供默认的可用对象")
+    else:
+        return getattr(obj, name)
+
+
+def parseMoneyLog(
+    lines: List[str],
+    is_throw: bool = True,
+    default_money: Union["MoneyLog", None] = None,
+) -> Union["MoneyLog", None]:
+    """
+    解析用户通过stdin输入的字符串， 返回一个MoneyLog对象
+    如果输入无效字段用默认提供的MoneyLog字段来替换
+    """
+    try:
+        newMoney = float(lines[0])
+    except ValueError:
+        if is_throw:
+            newMoney = check_value(default_money, "money")
+        else:
+            return None
+
+    try:
+        newTags = set(filter(lambda it: len(it) != 0, re.split(r"\s+|;", lines[1])))
+        if len(newTags) == 0:
+            raise ValueError("Tags Length As Zero.")
+
+    except ValueError:
+        if is_throw:
+            newTags = check_value(default_money, "tags")
+        else:
+            return None
+
+    try:
+        newTime_line = parse_timestamp(lines[2])
+    except ValueError:
+        if is_throw:
+            newTime_line = check_value(default_money, "time_line")
+        else:
+            return None
+
+    newId = default_money.id if default_money is not None else None
+    return MoneyLog(_id=newId, money=newMoney, tags=newTags, time_line=newTime_line)
+
+
+@user_input(
+    ["输入金额： ", "输入标签（用空格隔开）： ", "输入日期时间： "], line_total=3
+)
+def inputMoneyLog(
+    lines: List[str], default_money: Union["MoneyLog", None] = None
+) -> Union["MoneyLog", None]:
+    return parseMoneyLog(lines=lines, default_money=default_money)
+
+
+def moneylog_fingerprint(
+    money: float, tags: Iterable[str], time_line: int, source_id: Optional[str] = None
+) -> str:
+    """
+    账单内容的稳定指纹， 由金额 时间戳 排序后的标签和可选的来源编号计算\n
+    同一个账单无论导入多少次， 在哪个进程里导入， 指纹都相同
+    """
+    from hashlib import blake2b
+
+    content = "\x1f".join(
+        (f"{money:.2f}", str(time_line), "\x1e".join(sorted(tags)), source_id or "")
+    )
+    return blake2b(content.encode("UTF-8"), digest_size=16).hexdigest()
+
+
+def moneylog_doc(moneyLog: "MoneyLog") -> Dict[str, Any]:
+    """
+    导入账单时写入数据库的文档， 不包含_id， 比model_dump快得多\n
+    包含内容指纹， 有来源编号时也包含来源编号
+    """
+    doc = {
+        "money": moneyLog.money,
+        "tags": list(moneyLog.tags),
+        "time_line": moneyLog.time_line,
+        "fingerprint": moneylog_fingerprint(
+            moneyLog.money, moneyLog.tags, moneyLog.time_line, moneyLog.source_id
+        ),
+    }
+    if moneyLog.source_id is not None:
+        doc["source_id"] = moneyLog.source_id
+
+    return doc
+
+
+@dataclasses.dataclass
+class LedgerSummary:
+    """
+    一组账单的汇总信息 总金额 总数 最早和最晚的时间戳\n
+    只求总计和平均的命令用不到pydantic， 所以这里是普通的dataclass
+    """
+
+    total: float = 0.0
+    count: int = 0
+    first: Optional[int] = None
+    last: Optional[int] = None
+
+    @classmethod
+    def from_doc(cls, doc: Dict[str, Any]) -> "LedgerSummary":
+        """
+        从聚合管道返回的文档构造， 忽略_id等其他字段
+        """
+        return cls(
+            total=doc["total"],
+            count=doc["count"],
+            first=doc.get("first"),
+            last=doc.get("last"),
+        )
+
+    def merge(self, other: "LedgerSummary") -> "LedgerSummary":
+        """
+        合并两组不相交的账单的汇总信息
+        """
+        firsts = [it for it in (self.first, other.first) if it is not None]
+        lasts = [it for it in (self.last, other.last) if it is not None]
+        return LedgerSummary(
+            total=self.total + other.total,
+            count=self.count + other.count,
+            first=min(firsts) if firsts else None,
+            last=max(lasts) if lasts else None,
+        )
+
+    def show(self, sequel: Sequel):
+        """
+        根据sequel打印总计 总数 或者每日平均
+        """
+        if sequel == Sequel.total:
+            print(f"总计： {self.total:.2f}￥")
+        elif sequel == Sequel.size:
+            print(f"总共有 {self.count} 条账单")
+        elif self.first is None or self.last is None:
+            print("没有符合条件的账单")
+        else:
+            firstDate = date.fromtimestamp(self.first / 1000)
+            firstTime = datetime(firstDate.year, firstDate.month, firstDate.day)
+            lastTime = datetime.fromtimestamp(self.last / 1000)
+            days = (lastTime - firstTime).days + 1
+
+            print(f"在{days}天内每日平均为： {(self.total / days):2f}￥")
+
+
+class TagTrie:
+    """
+    内存里的标签前缀树， 用于标签补全以及展开通配符\n
+    每个标签记录使用次数和最后一次使用的时间戳， 补全结果按照使用次数从多到少排列
+    """
+
+    def __init__(self):
+        self.root: Dict[str, Any] = {}
+        self.usage: Dict[str, Tuple[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.usage)
+
+    def insert(self, tag: str, count: int = 1, last_used: int = 0):
+        node = self.root
+        for ch in tag:
+            node = node.setdefault(ch, {})
+        node[""] = tag
+        self.usage[tag] = (count, last_used)
+
+    @classmethod
+    def from_usage(cls, usage: Iterable[Tuple[str, int, int]]) -> "TagTrie":
+        tagTrie = cls()
+        for tag, count, last_used in usage:
+            tagTrie.insert(tag, count, last_used)
+
+        return tagTrie
+
+    def complete(self, prefix: str = "", limit: int = 0) -> List[str]:
+        """
+        返回以prefix开头的标签， limit大于0时只返回使用次数最多的limit个
+        """
+        node = self.root
+        for ch in prefix:
+            if (node := node.get(ch)) is None:
+                return []
+
+        found, stack = [], [node]
+        while stack:
+            for key, child in stack.pop().items():
+                if key == "":
+                    found.append(child)
+                else:
+                    stack.append(child)
+
+        found.sort(key=lambda it: (-self.usage[it][0], it))
+        return found[:limit] if limit > 0 else found
+
+    def expand(self, pattern: str) -> List[str]:
+        """
+        把 * ? [] 通配符展开为字典里匹配的标签， 只遍历第一个通配符之前的前缀下面的子树
+        """
+        end = min(
+            (i for i, ch in enumerate(pattern) if ch in TAG_WILDCARDS), default=-1
+        )
+        if end == -1:
+            return [pattern]
+
+        return [
+            it
+            for it in self.complete(pattern[:end])
+            if fnmatch.fnmatchcase(it, pattern)
+        ]
+
+
+@contextmanager
+def tag_completion(vocabulary: Callable[[], TagTrie]):
+    """
+    在这个上下文里用input输入时可以按Tab补全标签， 字典在第一次补全的时候才加载\n
+    没有readline的平台上什么也不做
+    """
+    try:
+        import readline
+    except ImportError:
+        yield
+        return
+
+    matches: List[str] = []
+    tagTries: List[TagTrie] = []
+
+    def completer(text: str, state: int) -> Optional[str]:
+        nonlocal matches
+        if state == 0:
+            if not tagTries:
+                tagTries.append(vocabulary())
+            matches = tagTries[0].complete(text, limit=50)
+        return matches[state] if state < len(matches) else None
+
+    oldCompleter, oldDelims = readline.get_completer(), readline.get_completer_delims()
+    readline.set_completer(completer)
+    readline.set_completer_delims(" ;")
+    readline.parse_and_bind("tab: complete")
+    try:
+        yield
+    finally:
+        readline.set_completer(oldCompleter)
+        readline.set_completer_delims(oldDelims)
+
+
+class MoneyLogBatch:
+    """
+    只读的列式账单集合， 用于统计分析， 修改单个账单仍然使用MoneyLog\n
+    金额和时间戳保存在紧凑的数组里， 标签被字典编码为整数id， 不为每一条账单构造对象
+    """
+
+    def __init__(self):
+        self.money = array("d")
+        self.time_line = array("q")
+        # 第i条账单的标签id保存在 tag_ids[tag_offsets[i]:tag_offsets[i + 1]]
+        self.tag_offsets = array("q", [0])
+        self.tag_ids = array("i")
+        self.tags: List[str] = []  # 标签id到标签的映射
+        self.tag_index: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.money)
+
+    def tag_id(self, tag: str) -> int:
+        """
+        返回标签的整数id， 新标签被驻留并分配一个新的id
+        """
+        if (tid := self.tag_index.get(tag)) is None:
+            tid = self.tag_index[sys.intern(tag)] = len(self.tags)
+            self.tags.append(tag)
+
+        return tid
+
+    def append(self, money: float, time_line: int, tags: Iterable[str]):
+        self.money.append(money)
+        self.time_line.append(time_line)
+        self.tag_ids.extend(self.tag_id(it) for it in tags)
+        self.tag_offsets.append(len(self.tag_ids))
+
+    def extend_docs(self, docs: Iterable[Dict[str, Any]]):
+        for it in docs:
+            self.append(it["money"], it["time_line"], it["tags"])
+
+    def extend_raw(self, raw: bytes):
+        """
+        追加一批服务器返回的原始BSON数据
+        """
+        import bson
+
+        self.extend_docs(bson.decode_all(raw))
+
+    @classmethod
+    def from_raw_batches(cls, batches: Iterable[bytes]) -> "MoneyLogBatch":
+        batch = cls()
+        for it in batches:
+            batch.extend_raw(it)
+
+        return batch
+
+    def row_tags(self, index: int) -> List[str]:
+        begin, end = self.tag_offsets[index], self.tag_offsets[index + 1]
+        return [self.tags[it] for it in self.tag_ids[begin:end]]
+
+    def tagTrie(self) -> TagTrie:
+        """
+        统计每个标签的使用次数和最后使用时间， 构造标签字典
+        """
+        counts = [0] * len(self.tags)
+        lastUsed = [0] * len(self.tags)
+        for i in range(len(self)):
+            for tid in self.tag_ids[self.tag_offsets[i] : self.tag_offsets[i + 1]]:
+                counts[tid] += 1
+                lastUsed[tid] = max(lastUsed[tid], self.time_line[i])
+
+        return TagTrie.from_usage(zip(self.tags, counts, lastUsed))
+
+    def summary(self) -> LedgerSummary:
+        if len(self) == 0:
+            return LedgerSummary()
+
+        return LedgerSummary(
+            total=sum(self.money),
+            count=len(self),
+            first=min(self.time_line),
+            last=max(self.time_line),
+        )
+
+    def matcher(self, query: Dict[str, Any]) -> Callable[[int], bool]:
+        """
+        把build_query构造的MongoDB查询条件编译为判断第i条账单是否符合条件的函数\n
+        支持money和time_line的比较运算以及tags的$in
+        """
+        checks: List[Callable[[int], bool]] = []
+        for field, condition in query.items():
+            if field == "tags":
+                if not isinstance(condition, dict) or list(condition) != ["$in"]:
+                    raise ValueError(f"本地快照不支持的标签条件： {condition}")
+                wanted = {
+                    self.tag_index[it]
+                    for it in condition["$in"]
+                    if it in self.tag_index
+                }
+                offsets, tag_ids = self.tag_offsets, self.tag_ids
+                checks.append(
+                    lambda i, wanted=wanted: any(
+                        tag_ids[j] in wanted for j in range(offsets[i], offsets[i + 1])
+                    )
+                )
+            elif field in ("money", "time_line"):
+                column = self.money if field == "money" else self.time_line
+                conditions = (
+                    condition if isinstance(condition, dict) else {"$eq": condition}
+                )
+                for name, value in conditions.items():
+                    if name not in FILTER_OPERATORS:
+                        raise ValueError(f"本地快照不支持的查询条件： {name}")
+                    compare = FILTER_OPERATORS[name]
+                    checks.append(
+                        lambda i, column=column, compare=compare, value=value: compare(
+                            column[i], value
+                        )
+                    )
+            else:
+                raise ValueError(f"本地快照不支持的查询字段： {field}")
+
+        return lambda i: all(check(i) for check in checks)
+
+    def select(self, query: Dict[str, Any]) -> "MoneyLogBatch":
+        """
+        返回符合查询条件的账单组成的新MoneyLogBatch， 和原来的批次共用标签字典
+        """
+        match = self.matcher(query)
+        result = MoneyLogBatch()
+        result.tags, result.tag_index = self.tags, self.tag_index
+        for i in range(len(self)):
+            if match(i):
+                result.money.append(self.money[i])
+                result.time_line.append(self.time_line[i])
+                result.tag_ids.extend(
+                    self.tag_ids[self.tag_offsets[i] : self.tag_offsets[i + 1]]
+                )
+                result.tag_offsets.append(len(result.tag_ids))
+
+        return result
+
+    def order(self, sortMode: Dict[str, int] = {}) -> List[int]:
+        """
+        按照SortMode.build生成的排序条件返回账单的下标
+        """
+        indexes = list(range(len(self)))
+        if sortMode != {}:
+            field, direction = next(iter(sortMode.items()))
+            column = self.money if field == "money" else self.time_line
+            indexes.sort(key=lambda i: column[i], reverse=direction == -1)
+
+        return indexes
+
+    def docs(self, indexes: Optional[Iterable[int]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        按照indexes的顺序逐条产生包含money tags time_line字段的账单文档
+        """
+        for i in indexes if indexes is not None else range(len(self)):
+            yield {
+                "money": self.money[i],
+                "tags": self.row_tags(i),
+                "time_line": self.time_line[i],
+            }
+
+    def to_numpy(self) -> Tuple[Any, Any, Any, Any]:
+        """
+        不复制数据转换为NumPy数组 money time_line tag_offsets tag_ids， 需要安装numpy
+        """
+        import numpy as np
+
+        return (
+            np.frombuffer(self.money, dtype=np.float64),
+            np.frombuffer(self.time_line, dtype=np.int64),
+            np.frombuffer(self.tag_offsets, dtype=np.int64),
+            np.frombuffer(self.tag_ids, dtype=np.int32),
+        )
+
+
+def display_width(text: str) -> int:
+    """
+    终端上显示文本需要的列数， 中文等宽字符占两列
+    """
+    return sum(2 if unicodedata.east_asian_width(it) in "WF" else 1 for it in text)
+
+
+def write_rows(
+    header: List[str], rows: List[List[Any]], asCsv: bool = False, stream: Any = None
+):
+    """
+    把表格写入stream， 可以是对齐的文本表格或者csv\n
+    文本表格第一列左对齐， 其他列右对齐
+    """
+    stream = stream if stream is not None else sys.stdout
+    cells = [header] + [[str(it) for it in row] for row in rows]
+    if asCsv:
+        csv.writer(stream, lineterminator="\n").writerows(cells)
+        return
+
+    widths = [max(display_width(row[i]) for row in cells) for i in range(len(header))]
+    for row in cells:
+        line = []
+        for i, cell in enumerate(row):
+            padding = " " * (widths[i] - display_width(cell))
+            line.append(cell + padding if i == 0 else padding + cell)
+        stream.write("  ".join(line) + "\n")
+
+
+@contextmanager
+def open_pager(enabled: bool) -> Iterator[TextIO]:
+    """
+    enabled为True时启动$PAGER指定的分页程序， 返回写入分页程序的文本流， 否则返回标准输出\n
+    分页程序启动失败时退回到标准输出， 用户提前退出分页程序时忽略剩下的输出
+    """
+    if not enabled:
+        yield sys.stdout
+        return
+
+    import subprocess
+    import shlex
+
+    command = os.environ.get("PAGER") or ("more" if os.name == "nt" else "less")
+    try:
+        pager = subprocess.Popen(
+            shlex.split(command, posix=os.name != "nt"), stdin=subprocess.PIPE
+        )
+    except (OSError, ValueError) as e:
+        print(f"无法启动分页程序 {command}： {e}， 直接打印到屏幕", file=sys.stderr)
+        yield sys.stdout
+        return
+
+    stream = io.TextIOWrapper(
+        pager.stdin, encoding=sys.stdout.encoding or "UTF-8", errors="replace"
+    )
+    try:
+        with stream:
+            yield stream
+    except BrokenPipeError:
+        pass
+    pager.wait()
+
+
+class MoneyLogRenderer:
+    """
+    批量打印账单， 整个批次只取一次当前时间， 每一天的日期前缀只格式化一次\n
+    攒够一批行以后一次写入， align为True时金额和日期按列对齐， pager为True时输出到$PAGER
+    """
+
+    CHUNK_ROWS = 4096  # 每次写入的行数
+    DATE_WIDTH = display_width("2024年12月31日")  # 对齐时日期前缀占的列数
+
+    def __init__(self, align: bool = False, pager: bool = False):
+        self.align = align
+        self.pager = pager
+        self.now = datetime.now()
+        # 本地日期的序数 -> (当天零点, 第二天零点, 日期前缀)
+        self.days: Dict[int, Tuple[int, int, str]] = {}
+        self.today: Tuple[int, int, str] = (0, 0, "")
+
+    def datePrefix(self, dt: datetime) -> str:
+        now = self.now
+        year = "" if now.year == dt.year else f"{dt.year}年"
+        month = "" if now.month == dt.month else f"{dt.month}月"
+        day = "" if now.day == dt.day else f"{dt.day}日"
+        prefix = f"{year}{month}{day}"
+        if self.align:
+            prefix += " " * (self.DATE_WIDTH - display_width(prefix))
+        return prefix
+
+    def timestamp(self, time_line: int) -> str:
+        """
+        把时间戳格式化为友好可读的字符串， 和上一条账单同一天时不再构造datetime
+        """
+        start, end, prefix = self.today
+        if start <= time_line < end:
+            minutes = (time_line - start) // 60000
+            hour, minute = divmod(minutes, 60)
+        else:
+            dt = datetime.fromtimestamp(time_line / 1000)
+            hour, minute = dt.hour, dt.minute
+            key = dt.toordinal()
+            if (day := self.days.get(key)) is None:
+                midnight = datetime(dt.year, dt.month, dt.day)
+                start = int(midnight.timestamp() * 1000)
+                end = int((midnight + timedelta(days=1)).timestamp() * 1000)
+                # 夏令时切换的那一天不是24小时， 不能用零点推算时分
+                if end - start != 86400000:
+                    start = end = 0
+                day = self.days[key] = (start, end, self.datePrefix(dt))
+            self.today = day
+            prefix = day[2]
+
+        if self.align:
+            return f"{prefix} {hour:>2}点{minute:>2}分"
+        return f"{prefix} {hour}点{minute}分"
+
+    def line(self, money: float, tags: Iterable[str], time_line: int) -> str:
+        """
+        一条账单格式化以后的一行， 不包括换行符
+        """
+        kind = "所得" if money >= 0 else "支出"
+        amount = f"{money:>10.2f}" if self.align else f"{money:.2f}"
+        tagStr = "  ".join(tags)
+        return f"{kind} {amount}￥ {self.timestamp(time_line)} 标签： <{tagStr}>"
+
+    def write(self, rows: Iterable[Tuple[float, Iterable[str], int]], start: int = 0):
+        """
+        打印(money, tags, time_line)形式的账单， start大于0时在每行前面加上从start开始的序号\n
+        返回打印的账单数量
+        """
+        count = 0
+        with open_pager(self.pager) as stream:
+            lines: List[str] = []
+            for money, tags, time_line in rows:
+                line = self.line(money, tags, time_line)
+                lines.append(line if start == 0 else f"{start + count}. --- {line}")
+                count += 1
+                if len(lines) == self.CHUNK_ROWS:
+                    stream.write("\n".join(lines) + "\n")
+                    lines.clear()
+            if len(lines) != 0:
+                stream.write("\n".join(lines) + "\n")
+            stream.flush()
+
+        return count
+
+
+class PhaseProfiler:
+    """
+    --profile 打开时记录每个阶段的耗时， 关闭时不做任何事情\n
+    阶段可以嵌套， 内层阶段的时间不计入外层阶段
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.begin = 0.0
+        self.phases: Dict[str, float] = {}
+        self.stack: List[List[Any]] = []
+        self.commands: Any = None  # 连接MongoDB的时候创建mongo_backend.CommandCounter
+
+    def start(self):
+        self.__init__()
+        self.enabled = True
+        self.begin = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+
+        now = time.perf_counter()
+        if self.stack:
+            parent = self.stack[-1]
+            self.phases[parent[0]] = self.phases.get(parent[0], 0) + now - parent[1]
+        self.stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            _, start = self.stack.pop()
+            self.phases[name] = self.phases.get(name, 0) + now - start
+            if self.stack:
+                self.stack[-1][1] = now
+
+    def timed(self, iterable: Iterable[Any], name: str) -> Iterable[Any]:
+        """
+        取出每一个元素的时间计入name阶段， 适合统计游标从服务器读取数据的时间
+        """
+        if not self.enabled:
+            return iterable
+
+        def wrapper(iterator: Iterator[Any]) -> Iterator[Any]:
+            while True:
+                with self.phase(name):
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                yield item
+
+        return wrapper(iter(iterable))
+
+    def report(self):
+        """
+        把各个阶段的耗时和MongoDB命令统计打印到标准错误， 不影响导出到标准输出的内容
+        """
+        total = time.perf_counter() - self.begin
+        rows = [
+            [name, f"{seconds * 1000:.1f}", f"{seconds / total:.1%}"]
+            for name, seconds in self.phases.items()
+        ]
+        other = total - sum(self.phases.values())
+        rows.append(["其他", f"{other * 1000:.1f}", f"{other / total:.1%}"])
+        rows.append(["总计", f"{total * 1000:.1f}", "100.0%"])
+        sys.stderr.write("\n")
+        write_rows(["阶段", "耗时(ms)", "占比"], rows, stream=sys.stderr)
+        if self.commands is not None and sum(self.commands.commands.values()) != 0:
+            sys.stderr.write("\n")
+            write_rows(["MongoDB", ""], self.commands.rows(), stream=sys.stderr)
+
+
+PROFILER = PhaseProfiler()
+
+
+class ReportPeriod(str, Enum):
+    """
+    统计报表的汇总周期 日 周（周一开始） 月
+    """
+
+    day = "day"
+    week = "week"
+    month = "month"
+
+
+class ReportFormat(str, Enum):
+    """
+    统计报表的输出格式 对齐的文本表格 或者 csv
+    """
+
+    table = "table"
+    csv = "csv"
+
+
+class HistogramBucket(str, Enum):
+    """
+    histogram命令的分组方式 日 周（周一开始） 月 一天里的小时 一周里的星期几
+    """
+
+    day = "day"
+    week = "week"
+    month = "month"
+    hour = "hour"
+    weekday = "weekday"
+
+    def key(self, time_line: int, tz: tzinfo) -> Any:
+        """
+        时间戳在时区tz里所属的分组， 日 周 月返回分组第一天的date， 小时返回0-23， 星期几返回1-7
+        """
+        dt = datetime.fromtimestamp(time_line / 1000, tz)
+        if self == HistogramBucket.hour:
+            return dt.hour
+        elif self == HistogramBucket.weekday:
+            return dt.isoweekday()
+        elif self == HistogramBucket.day:
+            return dt.date()
+        elif self == HistogramBucket.week:
+            return dt.date() - timedelta(days=dt.weekday())
+        return dt.date().replace(day=1)
+
+    def keys(self, found: Iterable[Any]) -> List[Any]:
+        """
+        按顺序列出全部分组， 最早和最晚的分组之间没有账单的分组也包括在内
+        """
+        if self == HistogramBucket.hour:
+            return list(range(24))
+        elif self == HistogramBucket.weekday:
+            return list(range(1, 8))
+
+        found = sorted(found)
+        if len(found) == 0:
+            return []
+        result, current = [], found[0]
+        while current <= found[-1]:
+            result.append(current)
+            if self == HistogramBucket.day:
+                current = current + timedelta(days=1)
+            elif self == HistogramBucket.week:
+                current = current + timedelta(days=7)
+            else:
+                current = date(
+                    current.year + current.month // 12, current.month % 12 + 1, 1
+                )
+        return result
+
+    def label(self, key: Any) -> str:
+        if self == HistogramBucket.hour:
+            return f"{key:02d}:00"
+        elif self == HistogramBucket.weekday:
+            return WEEKDAY_NAMES[key - 1]
+        elif self == HistogramBucket.month:
+            return key.strftime("%Y-%m")
+        return key.isoformat()
+
+
+def fold_buckets(
+    slots: Iterable[Tuple[int, float, int]], bucket: HistogramBucket, tz: tzinfo
+) -> Dict[Any, Tuple[float, int]]:
+    """
+    把 (时间戳, 金额, 笔数) 合并到所属的分组， 返回 {分组: (金额, 笔数)}
+    """
+    buckets: Dict[Any, Tuple[float, int]] = {}
+    for timeLine, total, count in slots:
+        key = bucket.key(timeLine, tz)
+        oldTotal, oldCount = buckets.get(key, (0.0, 0))
+        buckets[key] = (oldTotal + total, oldCount + count)
+
+    return buckets
+
+
+@dataclasses.dataclass
+class BulkInsertReport:
+    """
+    批量导入账单的统计结果
+    """
+
+    total: int = 0
+    inserted: int = 0
+    skipped: int = 0
+    chunks: int = 0
+    elapsed: float = 0.0
+    errors: List[str] = dataclasses.field(default_factory=list)
+
+    @property
+    def failed(self) -> int:
+        return self.total - self.inserted - self.skipped
+
+    @property
+    def throughput(self) -> float:
+        return self.inserted / self.elapsed if self.elapsed > 0 else 0.0
+
+    def progress_fmt(self) -> str:
+        return f"已写入 {self.inserted}/{self.total} 条账单， 跳过重复 {self.skipped} 条， 共 {self.chunks} 批， 约 {self.throughput:.0f} 条/秒"
+
+    def fmt(self) -> str:
+        """
+        友好可读的形式格式化导入结果
+        """
+        lines = [
+            f"共处理 {self.total} 条账单， 成功 {self.inserted} 条， 跳过重复 {self.skipped} 条， 失败 {self.failed} 条",
+            f"分 {self.chunks} 批写入， 耗时 {self.elapsed:.2f} 秒， 约 {self.throughput:.0f} 条/秒",
+        ]
+        lines.extend(self.errors)
+        return "\n".join(lines)
+
+
+@lru_cache(maxsize=None)
+def load_config() -> Dict[str, Any]:
+    """
+    读取并缓存MongoDB配置文件， 每个进程只读取一次\n
+    配置文件里缺少的项使用默认值
+    """
+    try:
+        with PROFILER.phase("配置"), Path(MONGO_CONFIG_PATH).open() as fp:
+            config = json.load(fp)
+    except (FileNotFoundError, json.JSONDecodeError):
+        print(
+            "找不到MongoDB配置文件或配置文件已经损坏\n请运行 `python money.py config-mongodb` 命令初始化一个配置文件"
+        )
+        exit(-1)
+
+    return {**DEFAULT_MONGO_CONFIG, **config}
@@ -0,0 +1,41 @@
+# --*-- Encoding: UTF-8 --*--
+# * description: money.py使用的pydantic模型， 第一次使用模型的时候才导入这个模块
+
+from typing import Set, Optional
+from typing_extensions import Annotated
+from pydantic import ConfigDict, BaseModel, Field
+from pydantic.functional_validators import BeforeValidator
+
+from money_core import MoneyLogRenderer
+
+PyObjectId = Annotated[str, BeforeValidator(str)]  # MongoDB的id
+# 导入文件里账单原来的编号， 比如银行流水号
+SourceId = Annotated[str, BeforeValidator(str)]
+
+
+class MoneyLog(BaseModel):
+    """
+    表示一个账单 包括 金额 多个标签 发生时间戳， 此外有个可选的MongoDB id
+    """
+
+    id: Optional[PyObjectId] = Field(alias="_id", default=None)
+    money: float = Field(...)
+    tags: Set[str] = Field(...)
+    time_line: int = Field(...)
+    source_id: Optional[SourceId] = None
+    model_config = ConfigDict(
+        populate_by_name=True,
+        arbitrary_types_allowed=True,
+    )
+
+    def fmt(self) -> str:
+        """
+        友好可读的形式格式化账单
+        """
+        return MoneyLogRenderer().line(self.money, self.tags, self.time_line)
+
+    def timestamp_fmt(self) -> str:
+        """
+        把时间戳格式化为友好可读的字符串
+        """
+        return MoneyLogRenderer().timestamp(self.time_line)
@@ -0,0 +1,1445 @@
+# --*-- Encoding: UTF-8 --*--
+# * description: money.py的MongoDB存储后端， 只有配置文件选择mongodb后端时才导入这个模块和pymongo
+
+from typing import (
+    List,
+    Dict,
+    Any,
+    Union,
+    Optional,
+    Tuple,
+    Iterable,
+    Callable,
+    AsyncIterator,
+)
+from functools import lru_cache
+from pathlib import Path
+import json
+import time
+import asyncio
+from datetime import timezone, tzinfo
+from pymongo import (
+    monitoring,
+    MongoClient,
+    AsyncMongoClient,
+    IndexModel,
+    UpdateOne,
+    ASCENDING,
+    timeout as mongo_timeout,
+)
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError, BulkWriteError, OperationFailure
+import bson
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+
+from money_core import (
+    MONEYLOG_PROJECTION,
+    BATCH_PROJECTION,
+    PROFILER,
+    MoneyType,
+    HistogramBucket,
+    MoneyLogBatch,
+    BulkEdit,
+    MoneyLog,
+    LedgerSummary,
+    BulkInsertReport,
+    err_process,
+    load_config,
+    chunked,
+    fmt_size,
+    now_timestamp,
+    day_start,
+    next_day_start,
+    money_kind,
+    moneylog_doc,
+    moneylog_fingerprint,
+)
+from ledger_storage import LedgerStorage
+
+MONGO_PROBE_CACHE_PATH = "./.mongo_probe.json"  # 最近一次成功探测MongoDB服务的记录
+TAG_DICTIONARY_META = {"_id": {"meta": 1}}  # 标签字典已经初始化的标记
+ROLLUP_ALL_TAGS = "*"  # 汇总表里不区分标签的汇总行使用的标签
+ROLLUP_KINDS = {  # 每种账单类型在汇总表里对应的kind
+    MoneyType.all: ["income", "outlay", "zero"],
+    MoneyType.income: ["income"],
+    MoneyType.outlay: ["outlay"],
+}
+# 查询总是按照time_line范围筛选， 经常附带tags和money条件， tags是多键索引
+LEDGER_INDEXES: List[IndexModel] = [
+    IndexModel([("time_line", ASCENDING)], name="time_line"),
+    IndexModel([("tags", ASCENDING), ("time_line", ASCENDING)], name="tags_time_line"),
+    IndexModel(
+        [("money", ASCENDING), ("time_line", ASCENDING)], name="money_time_line"
+    ),
+    # sync命令按照修改时间增量读取账单
+    IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    # 只有导入的账单有指纹， 手动添加的账单和旧账单不参与唯一约束
+    IndexModel(
+        [("fingerprint", ASCENDING)],
+        name="fingerprint",
+        unique=True,
+        partialFilterExpression={"fingerprint": {"$type": "string"}},
+    ),
+]
+FINGERPRINT_INDEX = LEDGER_INDEXES[-1]
+
+
+class CommandCounter(monitoring.CommandListener):
+    """
+    统计pymongo发给服务器的命令， 每个命令都是一次网络往返
+    """
+
+    def __init__(self):
+        self.commands: Dict[str, int] = {}
+        self.failures = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.duration_micros = 0
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        self.commands[event.command_name] = self.commands.get(event.command_name, 0) + 1
+        self.bytes_sent += len(bson.encode(event.command))
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self.duration_micros += event.duration_micros
+        self.bytes_received += len(bson.encode(event.reply))
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self.duration_micros += event.duration_micros
+        self.failures += 1
+
+    def rows(self) -> List[List[Any]]:
+        roundTrips = sum(self.commands.values())
+        return [
+            ["命令", " ".join(f"{k}x{v}" for k, v in self.commands.items()) or "无"],
+            ["往返次数", roundTrips],
+            ["失败的命令", self.failures],
+            ["发送", fmt_size(self.bytes_sent)],
+            ["接收", fmt_size(self.bytes_received)],
+            ["命令往返耗时(ms)", f"{self.duration_micros / 1000:.1f}"],
+        ]
+
+
+def plan_stages(plan: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    把explain返回的查询计划树按照从外到内的顺序展开为阶段列表
+    """
+    stages, pending = [], [plan]
+    while pending:
+        stage = pending.pop(0)
+        stages.append(stage)
+        if "inputStage" in stage:
+            pending.append(stage["inputStage"])
+        pending.extend(stage.get("inputStages", []))
+
+    return stages
+
+
+def probe_cached(config: Dict[str, Any]) -> bool:
+    """
+    probe_cache_ttl秒内是否已经成功探测过同一个MongoDB服务
+    """
+    ttl = config["probe_cache_ttl"]
+    if ttl <= 0:
+        return False
+
+    try:
+        with Path(MONGO_PROBE_CACHE_PATH).open() as fp:
+            record = json.load(fp)
+        return (
+            record["host"] == config["host"] and 0 <= time.time() - record["time"] < ttl
+        )
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+
+def remember_probe(config: Dict[str, Any], running: bool):
+    """
+    把探测结果写入本地缓存文件， 探测失败时删除缓存
+    """
+    cache = Path(MONGO_PROBE_CACHE_PATH)
+    if not running:
+        if cache.exists():
+            cache.unlink()
+        return
+
+    if config["probe_cache_ttl"] > 0:
+        try:
+            with cache.open("wt") as fp:
+                json.dump({"host": config["host"], "time": time.time()}, fp)
+        except OSError:
+            pass
+
+
+def is_mongo_running(client: MongoClient, config: Dict[str, Any]) -> bool:
+    """
+    用ping命令探测MongoDB服务是否可用， 本地和远程主机都适用\n
+    探测时间不超过probe_timeout_ms， 成功的结果在probe_cache_ttl秒内缓存到本地文件
+    """
+    if probe_cached(config):
+        return True
+
+    try:
+        with mongo_timeout(config["probe_timeout_ms"] / 1000):
+            client.admin.command("ping")
+        running = True
+    except PyMongoError:
+        running = False
+
+    remember_probe(config, running)
+    return running
+
+
+async def is_mongo_running_async(
+    client: AsyncMongoClient, config: Dict[str, Any]
+) -> bool:
+    """
+    is_mongo_running的异步版本， 共用同一个探测缓存
+    """
+    if probe_cached(config):
+        return True
+
+    try:
+        with mongo_timeout(config["probe_timeout_ms"] / 1000):
+            await client.admin.command("ping")
+        running = True
+    except PyMongoError:
+        running = False
+
+    remember_probe(config, running)
+    return running
+
+
+def client_options(config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    同步和异步客户端共用的连接选项， --profile 打开时注册命令计数器
+    """
+    writeConcern = config["write_concern"]
+    options: Dict[str, Any] = dict(
+        maxPoolSize=config["max_pool_size"],
+        minPoolSize=config["min_pool_size"],
+        connectTimeoutMS=config["connect_timeout_ms"],
+        serverSelectionTimeoutMS=config["server_selection_timeout_ms"],
+        socketTimeoutMS=config["socket_timeout_ms"] or None,
+        readConcernLevel=config["read_concern"],
+        w=int(writeConcern) if str(writeConcern).isdigit() else writeConcern,
+    )
+    if PROFILER.enabled:
+        if PROFILER.commands is None:
+            PROFILER.commands = CommandCounter()
+        options["event_listeners"] = [PROFILER.commands]
+
+    return options
+
+
+@lru_cache(maxsize=None)
+def get_mongo_client() -> MongoClient:
+    """
+    延迟创建进程内唯一的MongoClient， 所有命令和辅助函数共用它的连接池
+    """
+    config = load_config()
+    client: MongoClient = MongoClient(config["host"], **client_options(config))
+    with PROFILER.phase("连接"):
+        running = is_mongo_running(client, config)
+    if not running:
+        client.close()
+        raise PyMongoError(f"MongoDB Server Is Not Running: {config['host']}")
+
+    return client
+
+
+@lru_cache(maxsize=None)
+def get_collection() -> Collection:
+    """
+    返回配置文件指定的账单集合， 每个进程只创建一次
+    """
+    config = load_config()
+    return get_mongo_client()[config["db_name"]][config["collection_name"]]
+
+
+class MongoConnection(LedgerStorage):
+    """
+    定义mongoDB数据库连接， 并提供了若干常用方法
+    """
+
+    def __init__(self):
+        """
+        使用进程内共享的数据库连接， 定义数据库名称和集合\n
+        连接只在第一次使用的时候建立， 之后的实例都复用同一个连接池
+        """
+        self.collection = get_collection()
+        self.db = self.collection.database
+        self.db_cli = self.db.client
+
+    def insert(self, moneyLog: Union["MoneyLog", None]) -> Union["MoneyLog", None]:
+        """
+        插入一个新的账单
+        """
+        if moneyLog is None:
+            return None
+        try:
+            doc = moneyLog.model_dump(
+                mode="json", by_alias=True, exclude=set(["id", "source_id"])
+            )
+            doc["updated_at"] = now_timestamp()
+            result = self.collection.insert_one(doc)
+            self.applyRollups([doc])
+            self.recordTags([doc])
+
+            if (result.acknowledged) and (
+                newItem := self.collection.find_one({"_id": result.inserted_id})
+            ) is not None:
+                return MoneyLog(**newItem)
+        except PyMongoError as e:
+            err_process(e)
+
+        return None
+
+    def toId(self, value: str) -> Any:
+        try:
+            return ObjectId(value)
+        except InvalidId as e:
+            raise ValueError(e)
+
+    @staticmethod
+    def upsertOperations(docs: List[Dict[str, Any]]) -> List[UpdateOne]:
+        """
+        按照指纹upsert账单， 指纹已经存在时什么也不做， 新写入的账单带有供sync使用的updated_at
+        """
+        updatedAt = now_timestamp()
+        return [
+            UpdateOne(
+                {"fingerprint": it["fingerprint"]},
+                {
+                    "$setOnInsert": {
+                        **{k: v for k, v in it.items() if k != "fingerprint"},
+                        "updated_at": updatedAt,
+                    }
+                },
+                upsert=True,
+            )
+            for it in docs
+        ]
+
+    @staticmethod
+    def upsertOutcome(
+        docs: List[Dict[str, Any]], details: Dict[str, Any]
+    ) -> Tuple[int, int, List[Dict[str, Any]], Any]:
+        """
+        从bulk_write的结果里找出 (新写入的数量, 跳过的重复数量, 新写入的账单, 失败原因)
+        """
+        written = [docs[it["index"]] for it in details.get("upserted", [])]
+        writeErrors = details.get("writeErrors", [])
+        reason = writeErrors[0].get("errmsg") if writeErrors else None
+        return (len(written), details.get("nMatched", 0), written, reason)
+
+    def ensureFingerprintIndex(self):
+        """
+        按照指纹upsert需要指纹的唯一索引， 每个连接只检查一次
+        """
+        if not getattr(self, "_fingerprintIndexed", False):
+            self.collection.create_indexes([FINGERPRINT_INDEX])
+            self._fingerprintIndexed = True
+
+    def insertDocs(
+        self, docs: List[Dict[str, Any]], ordered: bool
+    ) -> Tuple[int, int, Any]:
+        """
+        用一次bulk_write按照指纹upsert整批账单， 重复的账单在服务器端跳过
+        """
+        try:
+            self.ensureFingerprintIndex()
+            result = self.collection.bulk_write(
+                self.upsertOperations(docs), ordered=ordered
+            )
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+        except PyMongoError as e:
+            err_process(e)
+            return (0, 0, None)
+
+        inserted, skipped, written, reason = self.upsertOutcome(docs, details)
+        self.applyRollups(written)
+        self.recordTags(written)
+        return (inserted, skipped, reason)
+
+    def iterDocs(
+        self,
+        query: Dict[str, Any] = {},
+        sortMode: Dict[str, int] = {},
+        projection: Optional[Dict[str, int]] = None,
+        batch_size: int = 1000,
+        skip: int = 0,
+        limit: int = 0,
+    ) -> Iterable[Dict[str, Any]]:
+        """
+        返回一个按批次从服务器读取的游标， 不做任何校验， 文档只包含projection指定的字段\n
+        skip和limit用来分页， limit为0表示不限制
+        """
+        try:
+            cursor = self.collection.find(
+                query, projection, skip=skip, limit=limit
+            ).batch_size(batch_size)
+            if sortMode != {}:
+                # 大的排序结果可能超过服务器的内存排序限制
+                cursor.sort(sortMode).allow_disk_use(True)
+
+            return PROFILER.timed(cursor, "查询")
+        except PyMongoError as e:
+            err_process(e)
+
+        return []
+
+    def loadBatch(
+        self, query: Dict[str, Any] = {}, batch_size: int = 10000
+    ) -> MoneyLogBatch:
+        """
+        直接从服务器返回的原始BSON批次构造列式的MoneyLogBatch
+        """
+        try:
+            with PROFILER.phase("解码"):
+                return MoneyLogBatch.from_raw_batches(
+                    PROFILER.timed(
+                        self.collection.find_raw_batches(
+                            query, BATCH_PROJECTION, batch_size=batch_size
+                        ),
+                        "查询",
+                    )
+                )
+        except PyMongoError as e:
+            err_process(e)
+
+        return MoneyLogBatch()
+
+    @staticmethod
+    def rawSummaryPipeline(query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [
+            {"$match": query},
+            {
+                "$group": {
+                    "_id": None,
+                    "total": {"$sum": "$money"},
+                    "count": {"$sum": 1},
+                    "first": {"$min": "$time_line"},
+                    "last": {"$max": "$time_line"},
+                }
+            },
+        ]
+
+    @staticmethod
+    def rollupSummaryPipeline(rollupQuery: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [
+            {"$match": rollupQuery},
+            {
+                "$group": {
+                    "_id": None,
+                    "total": {"$sum": "$sum"},
+                    "count": {"$sum": "$count"},
+                    "first": {"$min": "$first"},
+                    "last": {"$max": "$last"},
+                }
+            },
+        ]
+
+    def summary(self, query: Dict[str, Any] = {}) -> LedgerSummary:
+        """
+        在服务器端计算符合条件的账单的总金额 总数和时间范围， 只有很小的文档通过网络返回\n
+        整天的部分尽量从汇总表读取， 只有首尾不完整的两天扫描原始账单
+        """
+        if (plan := self.rollupPlan(query)) is None:
+            return self.rawSummary(query)
+
+        begin, end, fullBegin, fullEnd, rollupQuery = plan
+        result = LedgerSummary()
+        try:
+            for it in self.rollups.aggregate(self.rollupSummaryPipeline(rollupQuery)):
+                result = LedgerSummary.from_doc(it)
+        except PyMongoError as e:
+            err_process(e)
+
+        for edgeBegin, edgeEnd in ((begin, fullBegin - 1), (fullEnd, end)):
+            if edgeBegin <= edgeEnd:
+                edge = {**query, "time_line": {"$gte": edgeBegin, "$lte": edgeEnd}}
+                result = result.merge(self.rawSummary(edge))
+
+        return result
+
+    def rawSummary(self, query: Dict[str, Any] = {}) -> LedgerSummary:
+        """
+        在服务器端用一次聚合计算符合条件的原始账单的汇总信息
+        """
+        try:
+            for it in self.collection.aggregate(self.rawSummaryPipeline(query)):
+                return LedgerSummary.from_doc(it)
+        except PyMongoError as e:
+            err_process(e)
+
+        return LedgerSummary()
+
+    @staticmethod
+    def histogramPipeline(
+        query: Dict[str, Any], bucket: HistogramBucket, tz: str
+    ) -> List[Dict[str, Any]]:
+        at = {"date": {"$toDate": "$time_line"}, "timezone": tz}
+        if bucket == HistogramBucket.hour:
+            key: Dict[str, Any] = {"$hour": at}
+        elif bucket == HistogramBucket.weekday:
+            key = {"$isoDayOfWeek": at}
+        else:
+            key = {"$dateTrunc": {**at, "unit": bucket.value, "startOfWeek": "monday"}}
+        return [
+            {"$match": query},
+            {
+                "$group": {
+                    "_id": key,
+                    "total": {"$sum": "$money"},
+                    "count": {"$sum": 1},
+                }
+            },
+        ]
+
+    def histogram(
+        self, query: Dict[str, Any], bucket: HistogramBucket, zone: Tuple[str, tzinfo]
+    ) -> Dict[Any, Tuple[float, int]]:
+        """
+        用$dateTrunc $hour $isoDayOfWeek在服务器端分组， 只返回每个分组的汇总结果\n
+        $dateTrunc返回分组开始的UTC时间， 转换为时区里分组第一天的date
+        """
+        buckets: Dict[Any, Tuple[float, int]] = {}
+        try:
+            for it in self.collection.aggregate(
+                self.histogramPipeline(query, bucket, zone[0]), allowDiskUse=True
+            ):
+                key = it["_id"]
+                if bucket not in (HistogramBucket.hour, HistogramBucket.weekday):
+                    begin = key.replace(tzinfo=timezone.utc).timestamp()
+                    key = bucket.key(int(begin * 1000), zone[1])
+                buckets[key] = (it["total"], it["count"])
+        except PyMongoError as e:
+            err_process(e)
+
+        return buckets
+
+    def summaries(self, queries: List[Dict[str, Any]]) -> List[LedgerSummary]:
+        """
+        用一次$facet聚合同时计算多个查询条件的汇总信息， 不管有几个查询条件都只有一次往返\n
+        $facet里的子管道不能使用索引， 所以先用全部条件的$or筛选一次
+        """
+        if len(queries) <= 1:
+            return [self.summary(it) for it in queries]
+
+        names = [f"w{i}" for i in range(len(queries))]
+        pipeline: List[Dict[str, Any]] = [
+            {"$match": {"$or": queries}},
+            {
+                "$facet": {
+                    name: self.rawSummaryPipeline(query)
+                    for name, query in zip(names, queries)
+                }
+            },
+        ]
+        try:
+            for it in self.collection.aggregate(pipeline, allowDiskUse=True):
+                return [
+                    LedgerSummary.from_doc(it[name][0]) if it[name] else LedgerSummary()
+                    for name in names
+                ]
+        except PyMongoError as e:
+            err_process(e)
+
+        return [LedgerSummary() for _ in queries]
+
+    def ensureIndexes(self) -> List[Tuple[str, str, bool]]:
+        try:
+            self.collection.create_indexes(LEDGER_INDEXES)
+            existing = self.collection.index_information()
+        except PyMongoError as e:
+            err_process(e)
+
+        result = []
+        for it in LEDGER_INDEXES:
+            name, keys = it.document["name"], dict(it.document["key"])
+            ok = name in existing and dict(existing[name]["key"]) == keys
+            result.append((name, ", ".join(f"{k}:{v}" for k, v in keys.items()), ok))
+
+        return result
+
+    def indexSizes(self) -> Dict[str, int]:
+        """
+        返回集合里每个索引占用的字节数， 服务器不支持统计时返回空字典
+        """
+        try:
+            for it in self.collection.aggregate([{"$collStats": {"storageStats": {}}}]):
+                return it["storageStats"]["indexSizes"]
+        except OperationFailure:
+            pass
+        except PyMongoError as e:
+            err_process(e)
+
+        return {}
+
+    def explain(
+        self, query: Dict[str, Any] = {}, sortMode: Dict[str, int] = {}
+    ) -> List[List[Any]]:
+        """
+        用executionStats级别的explain命令真正执行一次查询， 统计扫描和返回的文档数量
+        """
+        command: Dict[str, Any] = {
+            "find": self.collection.name,
+            "filter": query,
+            "projection": MONEYLOG_PROJECTION,
+        }
+        if sortMode != {}:
+            command["sort"] = sortMode
+        try:
+            result = self.db.command("explain", command, verbosity="executionStats")
+        except PyMongoError as e:
+            err_process(e)
+
+        planner, stats = result["queryPlanner"], result.get("executionStats", {})
+        # 使用基于槽位的执行引擎时计划在queryPlan字段里
+        winning = planner["winningPlan"].get("queryPlan", planner["winningPlan"])
+        stages = plan_stages(winning)
+        indexes = [
+            f"{it['indexName']} {json.dumps(it.get('keyPattern', {}))}"
+            for it in stages
+            if "indexName" in it
+        ]
+        return [
+            ["选中的计划", " <- ".join(it["stage"] for it in stages)],
+            ["使用的索引", "  ".join(indexes) or "无 全集合扫描"],
+            ["被拒绝的计划", len(planner.get("rejectedPlans", []))],
+            ["扫描的索引键", stats.get("totalKeysExamined", "-")],
+            ["扫描的账单", stats.get("totalDocsExamined", "-")],
+            ["返回的账单", stats.get("nReturned", "-")],
+            ["服务器执行耗时(ms)", stats.get("executionTimeMillis", "-")],
+        ]
+
+    @property
+    def rollups(self) -> Collection:
+        """
+        按 天 x 标签 x 账单类型 汇总的集合， 标签为ROLLUP_ALL_TAGS的行汇总当天全部账单
+        """
+        return self.db[f"{self.collection.name}_rollups"]
+
+    def hasRollups(self) -> bool:
+        """
+        汇总表是否已经用rebuild-rollups初始化过， 没有初始化时写入不维护汇总表\n
+        结果在实例上缓存
+        """
+        if not hasattr(self, "_hasRollups"):
+            try:
+                self._hasRollups = self.rollups.find_one({"_id": "meta"}) is not None
+            except PyMongoError as e:
+                err_process(e)
+        return self._hasRollups
+
+    def rollupPlan(
+        self, query: Dict[str, Any]
+    ) -> Optional[Tuple[int, int, int, int, Dict[str, Any]]]:
+        """
+        判断查询能否使用汇总表， 可以时返回\n
+        (开始时间戳, 结束时间戳, 第一个完整天的零点, 最后一个完整天之后的零点, 汇总表查询条件)\n
+        汇总表还没有用rebuild-rollups初始化， 查询有金额条件或者多个标签时返回None
+        """
+        if (plan := self.planRollups(query)) is None or not self.hasRollups():
+            return None
+
+        return plan
+
+    @staticmethod
+    def planRollups(
+        query: Dict[str, Any],
+    ) -> Optional[Tuple[int, int, int, int, Dict[str, Any]]]:
+        """
+        rollupPlan里不需要访问数据库的部分， 不检查汇总表是否已经初始化
+        """
+        timeRange = query.get("time_line", {})
+        if set(query) - {"time_line", "money", "tags"} or set(timeRange) != {
+            "$gte",
+            "$lte",
+        }:
+            return None
+
+        moneyType = MoneyType.all
+        if "money" in query:
+            if query["money"] == {"$gt": 0}:
+                moneyType = MoneyType.income
+            elif query["money"] == {"$lt": 0}:
+                moneyType = MoneyType.outlay
+            else:
+                return None
+
+        tag = ROLLUP_ALL_TAGS
+        if "tags" in query:
+            if len(query["tags"].get("$in", [])) != 1 or len(query["tags"]) != 1:
+                return None
+            tag = query["tags"]["$in"][0]
+
+        begin, end = timeRange["$gte"], timeRange["$lte"]
+        fullBegin = begin if day_start(begin) == begin else next_day_start(begin)
+        # 只有end是某一天的最后一毫秒时这一天才是完整的
+        # TimeRangeStamp把一天的结束设为23:59:59.999
+        fullEnd = day_start(end + 1)
+        if fullBegin >= fullEnd:
+            return None
+
+        return (
+            begin,
+            end,
+            fullBegin,
+            fullEnd,
+            {
+                "day": {"$gte": fullBegin, "$lt": fullEnd},
+                "tag": tag,
+                "kind": {"$in": ROLLUP_KINDS[moneyType]},
+            },
+        )
+
+    @staticmethod
+    def rollupDeltas(
+        docs: Iterable[Dict[str, Any]],
+    ) -> Dict[Tuple[int, str, str], Dict[str, Any]]:
+        """
+        把账单按照 (天, 标签, 账单类型) 累加成汇总表的增量
+        """
+        deltas: Dict[Tuple[int, str, str], Dict[str, Any]] = {}
+        for it in docs:
+            money, timeLine = it["money"], it["time_line"]
+            day, kind = day_start(timeLine), money_kind(money)
+            for tag in list(it["tags"]) + [ROLLUP_ALL_TAGS]:
+                if (delta := deltas.get((day, tag, kind))) is None:
+                    deltas[(day, tag, kind)] = {
+                        "sum": money,
+                        "count": 1,
+                        "min": money,
+                        "max": money,
+                        "first": timeLine,
+                        "last": timeLine,
+                    }
+                    continue
+                delta["sum"] += money
+                delta["count"] += 1
+                delta["min"], delta["max"] = (
+                    min(delta["min"], money),
+                    max(delta["max"], money),
+                )
+                delta["first"] = min(delta["first"], timeLine)
+                delta["last"] = max(delta["last"], timeLine)
+
+        return deltas
+
+    @classmethod
+    def rollupOperations(
+        cls, docs: List[Dict[str, Any]], sign: int = 1
+    ) -> List[UpdateOne]:
+        """
+        把账单的增量转换为汇总表的upsert操作， 同步和异步连接共用
+        """
+        operations = []
+        for (day, tag, kind), delta in cls.rollupDeltas(docs).items():
+            update: Dict[str, Any] = {
+                "$inc": {"sum": sign * delta["sum"], "count": sign * delta["count"]},
+                "$setOnInsert": {"day": day, "tag": tag, "kind": kind},
+            }
+            if sign > 0:
+                update["$min"] = {"min": delta["min"], "first": delta["first"]}
+                update["$max"] = {"max": delta["max"], "last": delta["last"]}
+            operations.append(
+                UpdateOne(
+                    {"_id": {"day": day, "tag": tag, "kind": kind}}, update, upsert=True
+                )
+            )
+
+        return operations
+
+    def applyRollups(self, docs: List[Dict[str, Any]], sign: int = 1):
+        """
+        用$inc把新增（sign为1）或者删除（sign为-1）的账单原子地累加到汇总表\n
+        删除以后最大最小值可能失效， 重新计算受影响的那几天
+        """
+        if len(docs) == 0 or not self.hasRollups():
+            return
+
+        try:
+            self.rollups.bulk_write(self.rollupOperations(docs, sign), ordered=False)
+        except PyMongoError as e:
+            err_process(e)
+
+        if sign < 0:
+            self.refreshRollupExtremes({day_start(it["time_line"]) for it in docs})
+
+    def refreshRollupExtremes(self, days: Iterable[int]):
+        """
+        从原始账单重新计算这几天汇总行的最大最小值， 删除已经没有账单的汇总行
+        """
+        for day in days:
+            try:
+                extremes = self.rollupDeltas(
+                    {
+                        "money": it["money"],
+                        "time_line": it["time_line"],
+                        "tags": it["tags"],
+                    }
+                    for it in self.collection.find(
+                        {"time_line": {"$gte": day, "$lt": next_day_start(day)}},
+                        BATCH_PROJECTION,
+                    )
+                )
+                operations = [
+                    UpdateOne(
+                        {"_id": {"day": key[0], "tag": key[1], "kind": key[2]}},
+                        {
+                            "$set": {
+                                name: value[name]
+                                for name in ("min", "max", "first", "last")
+                            }
+                        },
+                    )
+                    for key, value in extremes.items()
+                ]
+                if operations:
+                    self.rollups.bulk_write(operations, ordered=False)
+                self.rollups.delete_many({"day": day, "count": {"$lte": 0}})
+            except PyMongoError as e:
+                err_process(e)
+
+    def rebuildRollups(self, batch_size: int = 10000) -> int:
+        """
+        扫描一次全部原始账单重建汇总表， 先写入临时集合再替换， 返回汇总行的数量
+        """
+        temp = self.db[f"{self.rollups.name}_rebuilding"]
+        try:
+            temp.drop()
+            for chunk in chunked(
+                self.iterDocs({}, projection=BATCH_PROJECTION, batch_size=batch_size),
+                batch_size,
+            ):
+                operations = [
+                    UpdateOne(
+                        {"_id": {"day": day, "tag": tag, "kind": kind}},
+                        {
+                            "$inc": {"sum": delta["sum"], "count": delta["count"]},
+                            "$min": {"min": delta["min"], "first": delta["first"]},
+                            "$max": {"max": delta["max"], "last": delta["last"]},
+                            "$setOnInsert": {"day": day, "tag": tag, "kind": kind},
+                        },
+                        upsert=True,
+                    )
+                    for (day, tag, kind), delta in self.rollupDeltas(chunk).items()
+                ]
+                temp.bulk_write(operations, ordered=False)
+            temp.insert_one({"_id": "meta", "built_at": now_timestamp()})
+            temp.create_index([("tag", ASCENDING), ("day", ASCENDING)])
+            temp.rename(self.rollups.name, dropTarget=True)
+            self._hasRollups = True
+            return self.rollups.count_documents({}) - 1
+        except PyMongoError as e:
+            err_process(e)
+
+        return 0
+
+    @property
+    def tagDictionary(self) -> Collection:
+        """
+        标签字典集合， 文档的_id是标签， 记录使用次数count和最后使用时间last_used
+        """
+        return self.db[f"{self.collection.name}_tags"]
+
+    def hasTagDictionary(self) -> bool:
+        if not hasattr(self, "_hasTagDictionary"):
+            try:
+                self._hasTagDictionary = (
+                    self.tagDictionary.find_one(TAG_DICTIONARY_META) is not None
+                )
+            except PyMongoError as e:
+                err_process(e)
+        return self._hasTagDictionary
+
+    def rebuildTagDictionary(self):
+        """
+        用一次聚合从全部账单重新统计标签字典， 结果直接在服务器端写入字典集合
+        """
+        try:
+            self.collection.aggregate(
+                [
+                    {"$unwind": {"path": "$tags"}},
+                    {
+                        "$group": {
+                            "_id": "$tags",
+                            "count": {"$sum": 1},
+                            "last_used": {"$max": "$time_line"},
+                        }
+                    },
+                    {"$out": self.tagDictionary.name},
+                ],
+                allowDiskUse=True,
+            )
+            self.tagDictionary.insert_one(
+                {**TAG_DICTIONARY_META, "built_at": now_timestamp()}
+            )
+            self._hasTagDictionary = True
+            self.__dict__.pop("_tagTrie", None)
+        except PyMongoError as e:
+            err_process(e)
+
+    def tagUsage(self) -> Iterable[Tuple[str, int, int]]:
+        """
+        读取标签字典， 字典还没有初始化时先从全部账单统计一次
+        """
+        if not self.hasTagDictionary():
+            self.rebuildTagDictionary()
+
+        try:
+            for it in self.tagDictionary.find({"_id": {"$type": "string"}}):
+                yield (it["_id"], it["count"], it.get("last_used", 0))
+        except PyMongoError as e:
+            err_process(e)
+
+    @staticmethod
+    def tagOperations(docs: List[Dict[str, Any]], sign: int = 1) -> List[UpdateOne]:
+        """
+        把账单用到的标签转换为标签字典的upsert操作， 同步和异步连接共用
+        """
+        deltas: Dict[str, List[int]] = {}
+        for it in docs:
+            for tag in it["tags"]:
+                delta = deltas.setdefault(tag, [0, 0])
+                delta[0] += 1
+                delta[1] = max(delta[1], it["time_line"])
+
+        operations = []
+        for tag, (count, lastUsed) in deltas.items():
+            update: Dict[str, Any] = {"$inc": {"count": sign * count}}
+            if sign > 0:
+                update["$max"] = {"last_used": lastUsed}
+            operations.append(UpdateOne({"_id": tag}, update, upsert=True))
+
+        return operations
+
+    def recordTags(self, docs: List[Dict[str, Any]], sign: int = 1):
+        """
+        写入（sign为1）或者删除（sign为-1）账单以后更新标签字典的使用次数\n
+        字典还没有初始化时不维护， 第一次读取字典时会完整统计
+        """
+        if len(docs) == 0 or not self.hasTagDictionary():
+            return
+
+        try:
+            self.tagDictionary.bulk_write(self.tagOperations(docs, sign), ordered=False)
+            if sign < 0:
+                self.tagDictionary.delete_many(
+                    {
+                        "_id": {
+                            "$in": list({tag for it in docs for tag in it["tags"]})
+                        },
+                        "count": {"$lte": 0},
+                    }
+                )
+        except PyMongoError as e:
+            err_process(e)
+        self.__dict__.pop("_tagTrie", None)
+
+    @property
+    def tombstones(self) -> Collection:
+        """
+        记录被删除账单的集合， 用于增量同步本地快照
+        """
+        return self.db[f"{self.collection.name}_deleted"]
+
+    def count(self, query: Dict[str, Any] = {}) -> int:
+        try:
+            return self.collection.count_documents(query)
+        except PyMongoError as e:
+            err_process(e)
+
+        return 0
+
+    def maintainsDerived(self) -> bool:
+        """
+        汇总表或者标签字典已经初始化时， 批量修改之前需要先读取旧的账单计算增量
+        """
+        return self.hasRollups() or self.hasTagDictionary()
+
+    def updateMany(self, query: Dict[str, Any], edit: BulkEdit) -> int:
+        """
+        用聚合管道形式的update_many在服务器端一次修改全部账单， 同时设置updated_at供sync使用\n
+        需要维护汇总表和标签字典时先读取旧账单， 只修改读取到的这些账单
+        """
+        tags: Any = (
+            "$tags" if edit.setTags is None else {"$literal": sorted(edit.setTags)}
+        )
+        if edit.addTags:
+            tags = {"$setUnion": [tags, {"$literal": sorted(edit.addTags)}]}
+        if edit.removeTags:
+            tags = {"$setDifference": [tags, {"$literal": sorted(edit.removeTags)}]}
+        money: Any = "$money" if edit.setMoney is None else {"$literal": edit.setMoney}
+        if edit.scaleMoney is not None:
+            money = {"$multiply": ["$money", edit.scaleMoney]}
+        update = [
+            {
+                "$set": {
+                    "tags": tags,
+                    "money": money,
+                    "time_line": {"$add": ["$time_line", edit.shiftTime]},
+                    "updated_at": now_timestamp(),
+                }
+            },
+            # 指纹标识导入时的原始账单， 修改以后不再适用
+            {"$unset": "fingerprint"},
+        ]
+
+        try:
+            if not self.maintainsDerived():
+                return self.collection.update_many(query, update).modified_count
+
+            old = list(self.collection.find(query, MONEYLOG_PROJECTION))
+            result = self.collection.update_many(
+                {"_id": {"$in": [it["_id"] for it in old]}}, update
+            )
+            new = [edit.apply(it) for it in old]
+            self.applyRollups(old, sign=-1)
+            self.applyRollups(new)
+            self.recordTags(old, sign=-1)
+            self.recordTags(new)
+            return result.modified_count
+        except PyMongoError as e:
+            err_process(e)
+
+        return 0
+
+    def deleteMany(self, query: Dict[str, Any]) -> int:
+        """
+        用一次delete_many删除全部账单， 再一次写入全部墓碑记录供sync使用
+        """
+        projection = MONEYLOG_PROJECTION if self.maintainsDerived() else {"_id": 1}
+        try:
+            old = list(self.collection.find(query, projection))
+            if len(old) == 0:
+                return 0
+
+            ids = [it["_id"] for it in old]
+            result = self.collection.delete_many({"_id": {"$in": ids}})
+            deletedAt = now_timestamp()
+            self.tombstones.insert_many(
+                [{"_id": it, "deleted_at": deletedAt} for it in ids], ordered=False
+            )
+            if projection is MONEYLOG_PROJECTION:
+                self.applyRollups(old, sign=-1)
+                self.recordTags(old, sign=-1)
+            return result.deleted_count
+        except PyMongoError as e:
+            err_process(e)
+
+        return 0
+
+    def dedup(self) -> Tuple[int, int]:
+        """
+        在服务器端按照金额 时间 排序后的标签和来源编号分组找出重复的账单， 每组保留_id最小的一条\n
+        删除走deleteMany， 墓碑记录 汇总和标签字典随之更新
+        """
+        pipeline: List[Dict[str, Any]] = [
+            {"$sort": {"_id": 1}},
+            {
+                "$group": {
+                    "_id": {
+                        "money": "$money",
+                        "time_line": "$time_line",
+                        "tags": {"$sortArray": {"input": "$tags", "sortBy": 1}},
+                        "source_id": "$source_id",
+                    },
+                    "ids": {"$push": "$_id"},
+                }
+            },
+            {"$match": {"ids.1": {"$exists": True}}},
+        ]
+        removed = filled = 0
+        try:
+            extra = [
+                id
+                for it in self.collection.aggregate(pipeline, allowDiskUse=True)
+                for id in it["ids"][1:]
+            ]
+            for chunk in chunked(extra, 1000):
+                removed += self.deleteMany({"_id": {"$in": chunk}})
+
+            self.ensureFingerprintIndex()
+            lastId = None
+            while True:
+                query: Dict[str, Any] = {"fingerprint": {"$exists": False}}
+                if lastId is not None:
+                    query["_id"] = {"$gt": lastId}
+                docs = list(
+                    self.collection.find(query, {**MONEYLOG_PROJECTION, "source_id": 1})
+                    .sort("_id", ASCENDING)
+                    .limit(1000)
+                )
+                if len(docs) == 0:
+                    break
+                lastId = docs[-1]["_id"]
+                operations = [
+                    UpdateOne(
+                        {"_id": it["_id"]},
+                        {
+                            "$set": {
+                                "fingerprint": moneylog_fingerprint(
+                                    it["money"],
+                                    it["tags"],
+                                    it["time_line"],
+                                    it.get("source_id"),
+                                )
+                            }
+                        },
+                    )
+                    for it in docs
+                ]
+                try:
+                    filled += self.collection.bulk_write(
+                        operations, ordered=False
+                    ).modified_count
+                except BulkWriteError as e:
+                    # 和已有指纹冲突的旧账单保持没有指纹
+                    filled += e.details.get("nModified", 0)
+        except PyMongoError as e:
+            err_process(e)
+
+        return (removed, filled)
+
+    def delete(self, id: str) -> bool:
+        """
+        从mongoDB里删除一条记录
+        """
+        try:
+            if (
+                doc := self.collection.find_one_and_delete(
+                    {"_id": ObjectId(id)}, projection=BATCH_PROJECTION
+                )
+            ) is not None:
+                self.tombstones.insert_one(
+                    {"_id": ObjectId(id), "deleted_at": now_timestamp()}
+                )
+                self.applyRollups([doc], sign=-1)
+                self.recordTags([doc], sign=-1)
+                return True
+        except PyMongoError as e:
+            err_process(e)
+
+        return False
+
+    def updateOne(self, newMoneyLog: "MoneyLog") -> Union["MoneyLog", None]:
+        """
+        从MongoDB数据库里更新一条记录
+        """
+        try:
+            newDoc = newMoneyLog.model_dump(
+                mode="json", exclude=set(["id", "source_id"])
+            )
+            oldDoc = self.collection.find_one_and_update(
+                {"_id": ObjectId(newMoneyLog.id)},
+                {
+                    "$set": {**newDoc, "updated_at": now_timestamp()},
+                    "$unset": {"fingerprint": ""},
+                },
+                projection=BATCH_PROJECTION,
+            )
+
+            if (
+                oldDoc is not None
+                and (
+                    newItem := self.collection.find_one(
+                        {"_id": ObjectId(newMoneyLog.id)}
+                    )
+                )
+                is not None
+            ):
+                self.applyRollups([oldDoc], sign=-1)
+                self.applyRollups([newDoc])
+                self.recordTags([oldDoc], sign=-1)
+                self.recordTags([newDoc])
+                return MoneyLog(**newItem)
+        except PyMongoError as e:
+            err_process(e)
+
+        return None
+
+
+class AsyncMongoConnection:
+    """
+    MongoConnection的异步版本， 使用pymongo的AsyncMongoClient\n
+    提供insert find 批量写入和聚合， 用 async with 打开和关闭连接\n
+    写入时同样维护汇总表和标签字典， 汇总表和字典的查询和修改只在同步连接里提供
+    """
+
+    def __init__(self):
+        self.config = load_config()
+        self.client: Optional[AsyncMongoClient] = None
+
+    async def __aenter__(self) -> "AsyncMongoConnection":
+        self.client = AsyncMongoClient(
+            self.config["host"], **client_options(self.config)
+        )
+        if not await is_mongo_running_async(self.client, self.config):
+            await self.client.close()
+            raise PyMongoError(f"MongoDB Server Is Not Running: {self.config['host']}")
+
+        self.db = self.client[self.config["db_name"]]
+        self.collection = self.db[self.config["collection_name"]]
+        self.rollups = self.db[f"{self.collection.name}_rollups"]
+        self.tagDictionary = self.db[f"{self.collection.name}_tags"]
+        return self
+
+    async def __aexit__(self, *args: Any):
+        if self.client is not None:
+            await self.client.close()
+
+    async def hasRollups(self) -> bool:
+        if not hasattr(self, "_hasRollups"):
+            try:
+                meta = await self.rollups.find_one({"_id": "meta"})
+                self._hasRollups = meta is not None
+            except PyMongoError as e:
+                err_process(e)
+        return self._hasRollups
+
+    async def hasTagDictionary(self) -> bool:
+        if not hasattr(self, "_hasTagDictionary"):
+            try:
+                meta = await self.tagDictionary.find_one(TAG_DICTIONARY_META)
+                self._hasTagDictionary = meta is not None
+            except PyMongoError as e:
+                err_process(e)
+        return self._hasTagDictionary
+
+    async def recordDerived(self, docs: List[Dict[str, Any]]):
+        """
+        把新写入的账单累加到汇总表和标签字典， 两个集合的写入同时进行
+        """
+        if len(docs) == 0:
+            return
+
+        writes = []
+        if await self.hasRollups():
+            writes.append(
+                self.rollups.bulk_write(
+                    MongoConnection.rollupOperations(docs), ordered=False
+                )
+            )
+        if await self.hasTagDictionary():
+            writes.append(
+                self.tagDictionary.bulk_write(
+                    MongoConnection.tagOperations(docs), ordered=False
+                )
+            )
+        try:
+            await asyncio.gather(*writes)
+        except PyMongoError as e:
+            err_process(e)
+
+    async def insert(
+        self, moneyLog: Union["MoneyLog", None]
+    ) -> Union["MoneyLog", None]:
+        if moneyLog is None:
+            return None
+        try:
+            doc = moneyLog.model_dump(
+                mode="json", by_alias=True, exclude=set(["id", "source_id"])
+            )
+            doc["updated_at"] = now_timestamp()
+            result = await self.collection.insert_one(doc)
+            await self.recordDerived([doc])
+            if (result.acknowledged) and (
+                newItem := await self.collection.find_one({"_id": result.inserted_id})
+            ) is not None:
+                return MoneyLog(**newItem)
+        except PyMongoError as e:
+            err_process(e)
+
+        return None
+
+    async def insertChunk(
+        self, chunk: List["MoneyLog"], ordered: bool
+    ) -> Tuple[int, int, Any]:
+        return await self.insertDocs([moneylog_doc(it) for it in chunk], ordered)
+
+    async def insertDocs(
+        self, docs: List[Dict[str, Any]], ordered: bool
+    ) -> Tuple[int, int, Any]:
+        try:
+            if not getattr(self, "_fingerprintIndexed", False):
+                await self.collection.create_indexes([FINGERPRINT_INDEX])
+                self._fingerprintIndexed = True
+            result = await self.collection.bulk_write(
+                MongoConnection.upsertOperations(docs), ordered=ordered
+            )
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+        except PyMongoError as e:
+            err_process(e)
+            return (0, 0, None)
+
+        inserted, skipped, written, reason = MongoConnection.upsertOutcome(
+            docs, details
+        )
+        await self.recordDerived(written)
+        return (inserted, skipped, reason)
+
+    async def insertMany(
+        self,
+        moneyLogs: Iterable["MoneyLog"],
+        chunk_size: int = 1000,
+        ordered: bool = False,
+        progress: Optional[Callable[[BulkInsertReport], None]] = None,
+        inflight: int = 4,
+    ) -> BulkInsertReport:
+        """
+        分批插入大量账单， 最多同时有inflight批正在写入\n
+        下一批账单在后台线程里解析， 解析和正在进行的写入互相重叠
+        """
+        report = BulkInsertReport()
+        begin = time.perf_counter()
+
+        async def write(number: int, chunk: List["MoneyLog"]):
+            inserted, skipped, reason = await self.insertChunk(chunk, ordered)
+            report.inserted += inserted
+            report.skipped += skipped
+            if reason is not None:
+                report.errors.append(
+                    f"第 {number} 批有 {len(chunk) - inserted - skipped} 条账单写入失败： {reason}"
+                )
+            report.elapsed = time.perf_counter() - begin
+            if progress is not None:
+                progress(report)
+
+        chunks = chunked(moneyLogs, chunk_size)
+        pending: set = set()
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            report.chunks += 1
+            report.total += len(chunk)
+            pending.add(asyncio.create_task(write(report.chunks, chunk)))
+            if len(pending) >= inflight:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for it in done:
+                    it.result()
+        await asyncio.gather(*pending)
+
+        report.elapsed = time.perf_counter() - begin
+        return report
+
+    async def iterDocs(
+        self,
+        query: Dict[str, Any] = {},
+        sortMode: Dict[str, int] = {},
+        projection: Optional[Dict[str, int]] = None,
+        batch_size: int = 1000,
+        skip: int = 0,
+        limit: int = 0,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        try:
+            cursor = self.collection.find(
+                query, projection, skip=skip, limit=limit
+            ).batch_size(batch_size)
+            if sortMode != {}:
+                cursor.sort(sortMode).allow_disk_use(True)
+            async for it in cursor:
+                yield it
+        except PyMongoError as e:
+            err_process(e)
+
+    async def rawBatches(
+        self, query: Dict[str, Any] = {}, batch_size: int = 10000
+    ) -> List[bytes]:
+        """
+        读取符合条件的账单的原始BSON批次， 不解码
+        """
+        try:
+            cursor = self.collection.find_raw_batches(
+                query, BATCH_PROJECTION, batch_size=batch_size
+            )
+            return [it async for it in cursor]
+        except PyMongoError as e:
+            err_process(e)
+
+        return []
+
+    async def loadBatch(
+        self, query: Dict[str, Any] = {}, batch_size: int = 10000
+    ) -> MoneyLogBatch:
+        return MoneyLogBatch.from_raw_batches(await self.rawBatches(query, batch_size))
+
+    async def loadBatches(
+        self, queries: List[Dict[str, Any]], batch_size: int = 10000
+    ) -> MoneyLogBatch:
+        """
+        同时发出多个互不相交的查询， 按照queries的顺序合并为一个MoneyLogBatch\n
+        同时进行的查询不超过连接池的大小
+        """
+        limit = asyncio.Semaphore(max(1, self.config["max_pool_size"]))
+
+        async def load(query: Dict[str, Any]) -> List[bytes]:
+            async with limit:
+                return await self.rawBatches(query, batch_size)
+
+        results = await asyncio.gather(*(load(it) for it in queries))
+        return MoneyLogBatch.from_raw_batches(raw for it in results for raw in it)
+
+    async def aggregate(
+        self, pipeline: List[Dict[str, Any]], collection: Any = None
+    ) -> List[Dict[str, Any]]:
+        """
+        在collection（默认为账单集合）上执行聚合， 返回全部结果
+        """
+        target = self.collection if collection is None else collection
+        try:
+            cursor = await target.aggregate(pipeline)
+            return await cursor.to_list()
+        except PyMongoError as e:
+            err_process(e)
+
+        return []
+
+    async def rawSummary(self, query: Dict[str, Any] = {}) -> LedgerSummary:
+        for it in await self.aggregate(MongoConnection.rawSummaryPipeline(query)):
+            return LedgerSummary.from_doc(it)
+
+        return LedgerSummary()
+
+    async def summary(self, query: Dict[str, Any] = {}) -> LedgerSummary:
+        """
+        和MongoConnection.summary相同， 汇总表和首尾不完整的两天同时查询
+        """
+        plan = MongoConnection.planRollups(query)
+        if plan is None or not await self.hasRollups():
+            return await self.rawSummary(query)
+
+        begin, end, fullBegin, fullEnd, rollupQuery = plan
+
+        async def rollupSummary() -> LedgerSummary:
+            for it in await self.aggregate(
+                MongoConnection.rollupSummaryPipeline(rollupQuery), self.rollups
+            ):
+                return LedgerSummary.from_doc(it)
+            return LedgerSummary()
+
+        parts = [rollupSummary()]
+        for edgeBegin, edgeEnd in ((begin, fullBegin - 1), (fullEnd, end)):
+            if edgeBegin <= edgeEnd:
+                edge = {**query, "time_line": {"$gte": edgeBegin, "$lte": edgeEnd}}
+                parts.append(self.rawSummary(edge))
+
+        result = LedgerSummary()
+        for it in await asyncio.gather(*parts):
+            result = result.merge(it)
+        return result
+
+    async def count(self, query: Dict[str, Any] = {}) -> int:
+        try:
+            return await self.collection.count_documents(query)
+        except PyMongoError as e:
+            err_process(e)
+
+        return 0
@@ -0,0 +1,431 @@
+# --*-- Encoding: UTF-8 --*--
+# * description: 嵌入式的SQLite存储后端， 配置文件的backend为sqlite时才导入这个模块
+
+from typing import List, Dict, Any, Union, Optional, Tuple, Iterable
+from datetime import tzinfo
+import re
+import time
+import sqlite3
+from functools import lru_cache
+
+from money_core import (
+    now_timestamp,
+    BulkEdit,
+    MoneyLog,
+    moneylog_fingerprint,
+    LedgerSummary,
+    PROFILER,
+    HistogramBucket,
+    fold_buckets,
+)
+from ledger_storage import LedgerStorage
+
+
+HISTOGRAM_SLOT = 15 * 60 * 1000  # 各地时区的UTC偏移都是15分钟的整数倍
+# SQLite后端的表结构 标签保存在单独的表里， 一个账单的每个标签一行
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS money_log (
+    id INTEGER PRIMARY KEY,
+    money REAL NOT NULL,
+    time_line INTEGER NOT NULL,
+    updated_at INTEGER,
+    fingerprint TEXT,
+    source_id TEXT
+);
+CREATE TABLE IF NOT EXISTS money_tag (
+    log_id INTEGER NOT NULL REFERENCES money_log(id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (log_id, tag)
+) WITHOUT ROWID;
+"""
+# SQLite后端的索引 名称 -> (索引的列, 创建语句)
+SQLITE_INDEXES: Dict[str, Tuple[str, str]] = {
+    "time_line": (
+        "time_line",
+        "CREATE INDEX IF NOT EXISTS time_line ON money_log(time_line)",
+    ),
+    "money_time_line": (
+        "money, time_line",
+        "CREATE INDEX IF NOT EXISTS money_time_line ON money_log(money, time_line)",
+    ),
+    "tag_log_id": (
+        "tag, log_id",
+        "CREATE INDEX IF NOT EXISTS tag_log_id ON money_tag(tag, log_id)",
+    ),
+    "fingerprint": (
+        "fingerprint",
+        "CREATE UNIQUE INDEX IF NOT EXISTS fingerprint ON money_log(fingerprint) "
+        "WHERE fingerprint IS NOT NULL",
+    ),
+}
+SQL_OPERATORS = {
+    "$eq": "=",
+    "$ne": "!=",
+    "$gt": ">",
+    "$gte": ">=",
+    "$lt": "<",
+    "$lte": "<=",
+}
+
+
+@lru_cache(maxsize=None)
+def get_sqlite(path: str) -> sqlite3.Connection:
+    """
+    打开并缓存进程内唯一的SQLite连接， 第一次打开时创建表和索引
+    """
+    with PROFILER.phase("连接"):
+        db = sqlite3.connect(path)
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        db.execute("PRAGMA foreign_keys = ON")
+        db.executescript(SQLITE_SCHEMA)
+        # 旧版本创建的账本没有指纹和来源编号两列
+        columns = {it[1] for it in db.execute("PRAGMA table_info(money_log)")}
+        for column in ("fingerprint", "source_id"):
+            if column not in columns:
+                db.execute(f"ALTER TABLE money_log ADD COLUMN {column} TEXT")
+        for _, sql in SQLITE_INDEXES.values():
+            db.execute(sql)
+
+    return db
+
+
+def compile_sql(query: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    """
+    把build_query构造的MongoDB查询条件翻译为SQL的WHERE子句和参数\n
+    支持money time_line _id的比较运算 tags的$in 以及$and $or
+    """
+    clauses: List[str] = []
+    params: List[Any] = []
+    for field, condition in query.items():
+        if field in ("$and", "$or"):
+            parts = [compile_sql(it) for it in condition]
+            joiner = " AND " if field == "$and" else " OR "
+            clauses.append("(" + joiner.join(f"({sql})" for sql, _ in parts) + ")")
+            params.extend(param for _, it in parts for param in it)
+        elif field == "tags":
+            if not isinstance(condition, dict) or list(condition) != ["$in"]:
+                raise ValueError(f"SQLite不支持的标签条件： {condition}")
+            marks = ", ".join("?" * len(condition["$in"]))
+            clauses.append(
+                f"id IN (SELECT log_id FROM money_tag WHERE tag IN ({marks}))"
+            )
+            params.extend(condition["$in"])
+        elif field in ("money", "time_line", "_id", "updated_at"):
+            column = "id" if field == "_id" else field
+            conditions = (
+                condition if isinstance(condition, dict) else {"$eq": condition}
+            )
+            for name, value in conditions.items():
+                if name not in SQL_OPERATORS:
+                    raise ValueError(f"SQLite不支持的查询条件： {name}")
+                clauses.append(f"{column} {SQL_OPERATORS[name]} ?")
+                params.append(value)
+        else:
+            raise ValueError(f"SQLite不支持的查询字段： {field}")
+
+    return (" AND ".join(clauses) if clauses else "1", params)
+
+
+class SqliteConnection(LedgerStorage):
+    """
+    嵌入式的SQLite存储后端， 不需要运行数据库服务， 适合单人使用的小账本\n
+    money和time_line有索引， 标签保存在带索引的money_tag表里
+    """
+
+    def __init__(self, path: str):
+        self.db = get_sqlite(path)
+
+    def toId(self, value: str) -> Any:
+        return int(value)
+
+    def insertDocs(
+        self, docs: List[Dict[str, Any]], ordered: bool
+    ) -> Tuple[int, int, Any]:
+        """
+        一批账单在一个事务里写入， 出错时整批回滚\n
+        指纹冲突的账单由唯一索引跳过， 不算作错误
+        """
+        inserted, updatedAt = 0, now_timestamp()
+        try:
+            with self.db:
+                for it in docs:
+                    cursor = self.db.execute(
+                        "INSERT INTO money_log "
+                        "(money, time_line, updated_at, fingerprint, source_id) "
+                        "VALUES (?, ?, ?, ?, ?) ON CONFLICT DO NOTHING",
+                        (
+                            it["money"],
+                            it["time_line"],
+                            updatedAt,
+                            it.get("fingerprint"),
+                            it.get("source_id"),
+                        ),
+                    )
+                    if cursor.rowcount == 0:
+                        continue
+                    inserted += 1
+                    self.db.executemany(
+                        "INSERT INTO money_tag (log_id, tag) VALUES (?, ?)",
+                        ((cursor.lastrowid, tag) for tag in it["tags"]),
+                    )
+            return (inserted, len(docs) - inserted, None)
+        except sqlite3.IntegrityError as e:
+            return (0, 0, e)
+
+    def findOne(self, id: Any) -> Union["MoneyLog", None]:
+        for it in self.iterDocs({"_id": id}, limit=1):
+            return MoneyLog(**it)
+
+        return None
+
+    def insert(self, moneyLog: Union["MoneyLog", None]) -> Union["MoneyLog", None]:
+        """
+        插入一个新的账单
+        """
+        if moneyLog is None:
+            return None
+
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO money_log (money, time_line, updated_at) VALUES (?, ?, ?)",
+                (moneyLog.money, moneyLog.time_line, now_timestamp()),
+            )
+            self.db.executemany(
+                "INSERT INTO money_tag (log_id, tag) VALUES (?, ?)",
+                ((cursor.lastrowid, tag) for tag in moneyLog.tags),
+            )
+
+        return self.findOne(cursor.lastrowid)
+
+    def iterDocs(
+        self,
+        query: Dict[str, Any] = {},
+        sortMode: Dict[str, int] = {},
+        projection: Optional[Dict[str, int]] = None,
+        batch_size: int = 1000,
+        skip: int = 0,
+        limit: int = 0,
+    ) -> Iterable[Dict[str, Any]]:
+        """
+        逐行读取符合条件的账单， 文档总是包含_id money tags time_line字段
+        """
+        where, params = compile_sql(query)
+        order = ", ".join(
+            f"{'id' if field == '_id' else field} {'ASC' if direction == 1 else 'DESC'}"
+            for field, direction in sortMode.items()
+        )
+        with PROFILER.phase("查询"):
+            cursor = self.db.execute(
+                "SELECT id, money, time_line, "
+                "(SELECT group_concat(tag, char(31)) FROM money_tag WHERE log_id = id) "
+                f"FROM money_log WHERE {where} "
+                f"{'ORDER BY ' + order if order else ''} LIMIT ? OFFSET ?",
+                params + [limit if limit > 0 else -1, skip],
+            )
+        cursor.arraysize = batch_size
+        for id, money, time_line, tags in PROFILER.timed(cursor, "查询"):
+            yield {
+                "_id": id,
+                "money": money,
+                "time_line": time_line,
+                "tags": tags.split("\x1f") if tags else [],
+            }
+
+    def summary(self, query: Dict[str, Any] = {}) -> LedgerSummary:
+        where, params = compile_sql(query)
+        total, count, first, last = self.db.execute(
+            "SELECT SUM(money), COUNT(*), MIN(time_line), MAX(time_line) "
+            f"FROM money_log WHERE {where}",
+            params,
+        ).fetchone()
+        if count == 0:
+            return LedgerSummary()
+
+        return LedgerSummary(total=total, count=count, first=first, last=last)
+
+    def histogram(
+        self, query: Dict[str, Any], bucket: HistogramBucket, zone: Tuple[str, tzinfo]
+    ) -> Dict[Any, Tuple[float, int]]:
+        """
+        先在SQL里按15分钟的时间片汇总， 再把时间片合并到时区里的分组， 夏令时也不会分错
+        """
+        where, params = compile_sql(query)
+        slots = self.db.execute(
+            f"SELECT time_line / {HISTOGRAM_SLOT} * {HISTOGRAM_SLOT} AS slot, "
+            f"SUM(money), COUNT(*) FROM money_log WHERE {where} GROUP BY slot",
+            params,
+        )
+        return fold_buckets(slots, bucket, zone[1])
+
+    def ensureIndexes(self) -> List[Tuple[str, str, bool]]:
+        for _, sql in SQLITE_INDEXES.values():
+            self.db.execute(sql)
+        existing = {
+            it[0]
+            for it in self.db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'"
+            )
+        }
+        return [
+            (name, keys, name in existing) for name, (keys, _) in SQLITE_INDEXES.items()
+        ]
+
+    def indexSizes(self) -> Dict[str, int]:
+        """
+        SQLite编译时没有启用dbstat时返回空字典
+        """
+        try:
+            return dict(
+                self.db.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")
+            )
+        except sqlite3.OperationalError:
+            return {}
+
+    def explain(
+        self, query: Dict[str, Any] = {}, sortMode: Dict[str, int] = {}
+    ) -> List[List[Any]]:
+        """
+        SQLite的查询计划不统计扫描的行数， 只列出计划的每一步和返回的账单数量
+        """
+        where, params = compile_sql(query)
+        order = ", ".join(
+            f"{'id' if field == '_id' else field} {'ASC' if direction == 1 else 'DESC'}"
+            for field, direction in sortMode.items()
+        )
+        sql = f"FROM money_log WHERE {where} {'ORDER BY ' + order if order else ''}"
+        steps = [
+            it[3]
+            for it in self.db.execute(f"EXPLAIN QUERY PLAN SELECT id {sql}", params)
+        ]
+        indexes = [
+            match.group(1)
+            for it in steps
+            if (match := re.search(r"USING (?:COVERING )?INDEX (\w+)", it)) is not None
+        ]
+        begin = time.perf_counter()
+        count = self.db.execute(f"SELECT COUNT(*) {sql}", params).fetchone()[0]
+        return [
+            ["查询计划", " <- ".join(steps)],
+            ["使用的索引", "  ".join(indexes) or "无 全表扫描"],
+            ["返回的账单", count],
+            ["执行耗时(ms)", f"{(time.perf_counter() - begin) * 1000:.1f}"],
+        ]
+
+    def tagUsage(self) -> Iterable[Tuple[str, int, int]]:
+        """
+        标签保存在带索引的money_tag表里， 直接分组统计就是标签字典
+        """
+        return self.db.execute(
+            "SELECT tag, COUNT(*), MAX(time_line) FROM money_tag "
+            "JOIN money_log ON money_log.id = money_tag.log_id GROUP BY tag"
+        )
+
+    def delete(self, id: str) -> bool:
+        with self.db:
+            cursor = self.db.execute("DELETE FROM money_log WHERE id = ?", (int(id),))
+
+        return cursor.rowcount != 0
+
+    def updateOne(self, newMoneyLog: "MoneyLog") -> Union["MoneyLog", None]:
+        id = int(str(newMoneyLog.id))
+        with self.db:
+            cursor = self.db.execute(
+                "UPDATE money_log SET money = ?, time_line = ?, updated_at = ?, "
+                "fingerprint = NULL WHERE id = ?",
+                (newMoneyLog.money, newMoneyLog.time_line, now_timestamp(), id),
+            )
+            if cursor.rowcount == 0:
+                return None
+            self.db.execute("DELETE FROM money_tag WHERE log_id = ?", (id,))
+            self.db.executemany(
+                "INSERT INTO money_tag (log_id, tag) VALUES (?, ?)",
+                ((id, tag) for tag in newMoneyLog.tags),
+            )
+
+        return self.findOne(id)
+
+    def count(self, query: Dict[str, Any] = {}) -> int:
+        where, params = compile_sql(query)
+        return self.db.execute(
+            f"SELECT COUNT(*) FROM money_log WHERE {where}", params
+        ).fetchone()[0]
+
+    def updateMany(self, query: Dict[str, Any], edit: BulkEdit) -> int:
+        """
+        先把符合条件的id保存到临时表， 修改金额和时间之后查询条件可能不再匹配\n
+        全部修改在一个事务里完成
+        """
+        where, params = compile_sql(query)
+        matched = "SELECT id FROM temp.bulk_ids"
+        with self.db:
+            self.db.execute("DROP TABLE IF EXISTS temp.bulk_ids")
+            self.db.execute(
+                f"CREATE TEMP TABLE bulk_ids AS SELECT id FROM money_log WHERE {where}",
+                params,
+            )
+            total = self.db.execute("SELECT COUNT(*) FROM temp.bulk_ids").fetchone()[0]
+
+            money = "money" if edit.setMoney is None else "?"
+            if edit.scaleMoney is not None:
+                money = "money * ?"
+            self.db.execute(
+                f"UPDATE money_log SET money = {money}, time_line = time_line + ?, "
+                f"updated_at = ?, fingerprint = NULL WHERE id IN ({matched})",
+                [it for it in (edit.setMoney, edit.scaleMoney) if it is not None]
+                + [edit.shiftTime, now_timestamp()],
+            )
+            if edit.setTags is not None:
+                self.db.execute(f"DELETE FROM money_tag WHERE log_id IN ({matched})")
+            for tag in (edit.setTags or set()) | edit.addTags:
+                self.db.execute(
+                    f"INSERT OR IGNORE INTO money_tag (log_id, tag) SELECT id, ? FROM ({matched})",
+                    (tag,),
+                )
+            if edit.removeTags:
+                marks = ", ".join("?" * len(edit.removeTags))
+                self.db.execute(
+                    f"DELETE FROM money_tag WHERE log_id IN ({matched}) AND tag IN ({marks})",
+                    list(edit.removeTags),
+                )
+            self.db.execute("DROP TABLE temp.bulk_ids")
+
+        return total
+
+    def deleteMany(self, query: Dict[str, Any]) -> int:
+        where, params = compile_sql(query)
+        with self.db:
+            cursor = self.db.execute(f"DELETE FROM money_log WHERE {where}", params)
+
+        return cursor.rowcount
+
+    def dedup(self) -> Tuple[int, int]:
+        """
+        用一条窗口函数查询找出重复的账单并删除， 标签随外键级联删除
+        """
+        tags = (
+            "(SELECT group_concat(tag, char(30)) FROM "
+            "(SELECT tag FROM money_tag WHERE log_id = money_log.id ORDER BY tag))"
+        )
+        with self.db:
+            removed = self.db.execute(
+                "DELETE FROM money_log WHERE id IN (SELECT id FROM ("
+                "SELECT id, ROW_NUMBER() OVER (PARTITION BY money, time_line, "
+                f"IFNULL(source_id, ''), {tags} ORDER BY id) AS n FROM money_log"
+                ") WHERE n > 1)"
+            ).rowcount
+            rows = self.db.execute(
+                f"SELECT id, money, time_line, source_id, IFNULL({tags}, '') "
+                "FROM money_log WHERE fingerprint IS NULL"
+            ).fetchall()
+            filled = 0
+            for id, money, timeLine, sourceId, tagStr in rows:
+                fingerprint = moneylog_fingerprint(
+                    money, filter(None, tagStr.split("\x1e")), timeLine, sourceId
+                )
+                filled += self.db.execute(
+                    "UPDATE OR IGNORE money_log SET fingerprint = ? WHERE id = ?",
+                    (fingerprint, id),
+                ).rowcount
+
+        return (removed, filled)
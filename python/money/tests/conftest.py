@@ -0,0 +1,135 @@
+"""
+测试共用的fixture， SQLite后端在临时目录里运行， MongoDB后端使用mongomock\n
+mongomock和新版pymongo不完全兼容， mongo fixture只修补测试用到的几个接口
+"""
+
+from typing import Any, Dict, Iterator, List
+from datetime import datetime
+from pathlib import Path
+import json
+import random
+
+import pytest
+
+from money_core import MONGO_CONFIG_PATH, DEFAULT_MONGO_CONFIG, load_config
+from sqlite_backend import SqliteConnection, get_sqlite
+
+LEDGER_TAGS = ["餐饮", "餐补", "交通", "房租", "工资", "咖啡"]
+LEDGER_BEGIN = int(datetime(2024, 5, 1).timestamp() * 1000)
+
+
+def write_config(**config: Any):
+    """
+    在当前目录写入配置文件， 并清除load_config的缓存
+    """
+    Path(MONGO_CONFIG_PATH).write_text(
+        json.dumps({**DEFAULT_MONGO_CONFIG, **config}), encoding="UTF-8"
+    )
+    load_config.cache_clear()
+
+
+@pytest.fixture
+def ledger_docs() -> List[Dict[str, Any]]:
+    """
+    60天里的300条账单， 时间精确到秒且互不相同， 收入和支出都有
+    """
+    rng = random.Random(7)
+    docs = []
+    for i in range(300):
+        docs.append(
+            {
+                "money": rng.choice([-120.5, -35, -12.5, -3.2, 8, 12.5, 50, 3000]),
+                "tags": sorted(rng.sample(LEDGER_TAGS, rng.randint(1, 3))),
+                "time_line": LEDGER_BEGIN + i * 17_280_000 + rng.randint(0, 600) * 1000,
+            }
+        )
+    return docs
+
+
+@pytest.fixture
+def sqlite(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Iterator[SqliteConnection]:
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "money.db")
+    write_config(backend="sqlite", sqlite_path=path)
+    yield SqliteConnection(path)
+    get_sqlite(path).close()
+    get_sqlite.cache_clear()
+
+
+@pytest.fixture
+def mongo(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Any:
+    mongomock = pytest.importorskip("mongomock")
+    import pymongo
+    import mongo_backend
+    from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+    def bulk_write(self: Any, operations: List[Any], ordered: bool = True, **_: Any):
+        """
+        逐条执行， mongomock自带的bulk_write不接受pymongo 4.11以后的sort参数
+        """
+        result: Dict[str, Any] = {
+            "nInserted": 0,
+            "nUpserted": 0,
+            "nMatched": 0,
+            "nModified": 0,
+            "upserted": [],
+            "writeErrors": [],
+        }
+        for i, op in enumerate(operations):
+            try:
+                one = self.update_one(op._filter, op._doc, upsert=op._upsert)
+            except DuplicateKeyError as e:
+                result["writeErrors"].append(
+                    {"index": i, "code": 11000, "errmsg": str(e)}
+                )
+                if ordered:
+                    break
+                continue
+            if one.upserted_id is not None:
+                result["nUpserted"] += 1
+                result["upserted"].append({"index": i, "_id": one.upserted_id})
+            else:
+                result["nMatched"] += one.matched_count
+                result["nModified"] += one.modified_count
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return pymongo.results.BulkWriteResult(result, True)
+
+    def create_indexes(self: Any, models: List[Any], **_: Any) -> List[str]:
+        """
+        mongomock的create_indexes会丢掉partialFilterExpression
+        """
+        names = []
+        for it in models:
+            document = dict(it.document)
+            keys = list(document.pop("key").items())
+            if document["name"] not in self.index_information():
+                self.create_index(keys, **document)
+            names.append(document["name"])
+        return names
+
+    def unset_stage(collection: Any, database: Any, fields: Any) -> Any:
+        """
+        mongomock没有实现聚合管道的$unset， 它等价于排除字段的$project
+        """
+        fields = [fields] if isinstance(fields, str) else fields
+        return mongomock.aggregate._handle_project_stage(
+            collection, database, {it: 0 for it in fields}
+        )
+
+    monkeypatch.setitem(mongomock.aggregate._PIPELINE_HANDLERS, "$unset", unset_stage)
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", bulk_write)
+    monkeypatch.setattr(
+        mongomock.collection.Collection, "create_indexes", create_indexes
+    )
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(mongo_backend, "MongoClient", lambda *args, **kwargs: client)
+    monkeypatch.chdir(tmp_path)
+    write_config(backend="mongodb", snapshot_path=str(tmp_path / "snapshot"))
+    mongo_backend.get_mongo_client.cache_clear()
+    mongo_backend.get_collection.cache_clear()
+    yield mongo_backend.MongoConnection()
+    mongo_backend.get_mongo_client.cache_clear()
+    mongo_backend.get_collection.cache_clear()
@@ -0,0 +1,174 @@
+from typing import Any, Dict, List
+import asyncio
+
+import pytest
+
+import money
+from money_core import MoneyLog, BulkInsertReport
+
+mongo_backend = pytest.importorskip("mongo_backend")
+
+
+class AsyncCursor:
+    """
+    把mongomock的游标包装成异步游标
+    """
+
+    def __init__(self, cursor: Any):
+        self.cursor = cursor
+
+    def batch_size(self, size: int) -> "AsyncCursor":
+        return self
+
+    def sort(self, *args: Any) -> "AsyncCursor":
+        self.cursor.sort(*args)
+        return self
+
+    def allow_disk_use(self, allow: bool) -> "AsyncCursor":
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        try:
+            return next(self.cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self) -> List[Dict[str, Any]]:
+        return list(self.cursor)
+
+
+class AsyncCollection:
+    """
+    AsyncMongoConnection用到的集合接口， 转发给mongo fixture修补过的mongomock集合
+    """
+
+    def __init__(self, collection: Any):
+        self.collection = collection
+        self.name = collection.name
+
+    async def insert_one(self, doc: Dict[str, Any]) -> Any:
+        return self.collection.insert_one(doc)
+
+    async def find_one(self, *args: Any) -> Any:
+        return self.collection.find_one(*args)
+
+    async def bulk_write(self, operations: List[Any], ordered: bool = True) -> Any:
+        return self.collection.bulk_write(operations, ordered=ordered)
+
+    async def create_indexes(self, models: List[Any]) -> List[str]:
+        return self.collection.create_indexes(models)
+
+    def find(self, *args: Any, **kwargs: Any) -> AsyncCursor:
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+    async def aggregate(self, pipeline: List[Dict[str, Any]]) -> AsyncCursor:
+        return AsyncCursor(self.collection.aggregate(pipeline))
+
+
+class AsyncDatabase:
+    def __init__(self, db: Any):
+        self.db = db
+
+    def __getitem__(self, name: str) -> AsyncCollection:
+        return AsyncCollection(self.db[name])
+
+
+class AsyncClient:
+    def __init__(self, client: Any):
+        self.client = client
+
+    def __getitem__(self, name: str) -> AsyncDatabase:
+        return AsyncDatabase(self.client[name])
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def async_mongo(mongo: Any, monkeypatch: pytest.MonkeyPatch) -> Any:
+    """
+    异步连接和mongo fixture共用同一个mongomock客户端， 写入的结果可以用同步连接检查
+    """
+
+    async def is_running(client: Any, config: Dict[str, Any]) -> bool:
+        return True
+
+    client = AsyncClient(mongo.collection.database.client)
+    monkeypatch.setattr(
+        mongo_backend, "AsyncMongoClient", lambda *args, **kwargs: client
+    )
+    monkeypatch.setattr(mongo_backend, "is_mongo_running_async", is_running)
+    return mongo
+
+
+def run(coroutine: Any) -> Any:
+    async def main() -> Any:
+        async with mongo_backend.AsyncMongoConnection() as storage:
+            return await coroutine(storage)
+
+    return asyncio.run(main())
+
+
+def rows(docs: Any) -> List[Any]:
+    return sorted(
+        (it["money"], it["time_line"], tuple(sorted(it["tags"]))) for it in docs
+    )
+
+
+def test_insert_many_writes_every_chunk(
+    async_mongo: Any, ledger_docs: List[Dict[str, Any]]
+):
+    reports: List[BulkInsertReport] = []
+    report = run(
+        lambda storage: storage.insertMany(
+            iter([MoneyLog(**it) for it in ledger_docs]),
+            chunk_size=40,
+            progress=lambda it: reports.append(it),
+            inflight=3,
+        )
+    )
+    assert (report.total, report.inserted, report.skipped) == (300, 300, 0)
+    assert report.chunks == len(reports) == 8
+    assert report.errors == []
+    assert rows(async_mongo.iterDocs({})) == rows(ledger_docs)
+
+
+def test_insert_many_skips_duplicates(
+    async_mongo: Any, ledger_docs: List[Dict[str, Any]]
+):
+    async_mongo.insertMany(iter([MoneyLog(**it) for it in ledger_docs[:100]]))
+    report = run(
+        lambda storage: storage.insertMany(
+            iter([MoneyLog(**it) for it in ledger_docs]), chunk_size=64
+        )
+    )
+    assert (report.inserted, report.skipped) == (200, 100)
+    assert async_mongo.count() == 300
+
+
+def test_insert_updates_rollups_and_tag_dictionary(
+    async_mongo: Any, ledger_docs: List[Dict[str, Any]]
+):
+    async_mongo.insertMany(iter([MoneyLog(**it) for it in ledger_docs[:100]]))
+    async_mongo.rebuildRollups()
+    async_mongo.rebuildTagDictionary()
+
+    async def write(storage: Any) -> Any:
+        await storage.insertMany(iter([MoneyLog(**it) for it in ledger_docs[100:299]]))
+        return await storage.insert(MoneyLog(**ledger_docs[299]))
+
+    inserted = run(write)
+    assert inserted is not None and inserted.id is not None
+    assert inserted.time_line == ledger_docs[299]["time_line"]
+
+    # 整天的范围走汇总表， 汇总表必须包含异步写入的账单
+    query = money.build_query(money.TimeQueryMode.range, "2024-04-01 2024-07-31")
+    assert mongo_backend.MongoConnection.planRollups(query) is not None
+    summary = run(lambda storage: storage.summary(query))
+    assert summary.count == async_mongo.rawSummary(query).count == 300
+    assert summary.total == pytest.approx(async_mongo.rawSummary(query).total)
+    usage = {tag: count for tag, count, _ in async_mongo.tagUsage()}
+    assert sum(usage.values()) == sum(len(it["tags"]) for it in ledger_docs)
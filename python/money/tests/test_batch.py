@@ -0,0 +1,40 @@
+from typing import Any, Dict, List
+
+import pytest
+
+from money_core import MoneyLogBatch, SortMode
+
+
+def test_batch_round_trips_docs_with_interned_tags(ledger_docs: List[Dict[str, Any]]):
+    batch = MoneyLogBatch()
+    batch.extend_docs(ledger_docs)
+    assert len(batch) == len(ledger_docs)
+    assert list(batch.docs()) == ledger_docs
+    # 每个标签只保存一次
+    assert len(batch.tags) == len({tag for it in ledger_docs for tag in it["tags"]})
+    summary = batch.summary()
+    assert summary.count == len(ledger_docs)
+    assert summary.total == pytest.approx(sum(it["money"] for it in ledger_docs))
+
+
+def test_select_and_order(ledger_docs: List[Dict[str, Any]]):
+    batch = MoneyLogBatch()
+    batch.extend_docs(ledger_docs)
+    selected = batch.select({"money": {"$lt": 0}, "tags": {"$in": ["咖啡", "没有"]}})
+    assert list(selected.docs()) == [
+        it for it in ledger_docs if it["money"] < 0 and "咖啡" in it["tags"]
+    ]
+    ordered = [batch.money[i] for i in batch.order(SortMode.money.build())]
+    assert ordered == sorted(batch.money, reverse=True)
+
+
+def test_matcher_rejects_unsupported_conditions(ledger_docs: List[Dict[str, Any]]):
+    batch = MoneyLogBatch()
+    batch.extend_docs(ledger_docs)
+    for query in (
+        {"money": {"$mod": [2, 0]}},
+        {"tags": {"$all": ["餐饮"]}},
+        {"source_id": "TX1"},
+    ):
+        with pytest.raises(ValueError):
+            batch.matcher(query)
@@ -0,0 +1,65 @@
+from collections import Counter
+from typing import Any, Dict, List
+
+import pytest
+import typer
+
+import money
+from money_core import MoneyLog, BulkEdit
+from sqlite_backend import SqliteConnection
+
+
+def test_parse_duration():
+    assert money.parse_duration("-1d") == -86_400_000
+    assert money.parse_duration("+2h30m") == 9_000_000
+    assert money.parse_duration("1d 1s") == 86_401_000
+    for raw in ("", "3x", "1d2", "h"):
+        with pytest.raises(typer.BadParameter):
+            money.parse_duration(raw)
+
+
+def test_apply_order_of_tag_edits():
+    doc = {"money": -10.0, "tags": ["a", "b"], "time_line": 5000}
+    edit = BulkEdit(
+        setTags={"x", "b"}, addTags={"y"}, removeTags={"b"}, shiftTime=-1000
+    )
+    assert edit.apply(doc) == {"money": -10.0, "tags": ["x", "y"], "time_line": 4000}
+    assert doc["tags"] == ["a", "b"]
+
+
+def test_apply_money():
+    doc = {"money": -10.0, "tags": [], "time_line": 0}
+    assert BulkEdit(setMoney=3).apply(doc)["money"] == 3
+    assert BulkEdit(scaleMoney=1.5).apply(doc)["money"] == -15.0
+    with pytest.raises(typer.BadParameter):
+        BulkEdit(setMoney=3, scaleMoney=2)
+
+
+def test_empty():
+    assert BulkEdit().empty()
+    assert not BulkEdit(removeTags={"a"}).empty()
+
+
+def test_sqlite_update_many_matches_apply(
+    sqlite: SqliteConnection, ledger_docs: List[Dict[str, Any]]
+):
+    sqlite.insertMany(iter([MoneyLog(**it) for it in ledger_docs]))
+    query = {"time_line": {"$gte": 0, "$lte": 2**62}, "tags": {"$in": ["餐饮"]}}
+    edit = BulkEdit(
+        addTags={"吃饭"}, removeTags={"餐饮"}, scaleMoney=2, shiftTime=60_000
+    )
+    before = list(sqlite.iterDocs(query))
+    total = sqlite.count()
+
+    assert sqlite.updateMany(query, edit) == len(before)
+    expected = Counter(
+        (it["money"], it["time_line"], tuple(it["tags"]))
+        for it in map(edit.apply, before)
+    )
+    after = Counter(
+        (it["money"], it["time_line"], tuple(sorted(it["tags"])))
+        for it in sqlite.iterDocs({"tags": {"$in": ["吃饭"]}})
+    )
+    assert after == expected
+    assert sqlite.count({"tags": {"$in": ["餐饮"]}}) == 0
+    assert sqlite.count() == total
@@ -0,0 +1,68 @@
+from datetime import datetime
+from pathlib import Path
+import gzip
+import json
+
+import pytest
+
+import money
+from money_core import Sequel
+
+DOCS = [
+    {"money": -12.5, "tags": ["餐饮"], "time_line": 1714536000000},
+    {"money": 30.0, "tags": ["报销", "交通"], "time_line": 1714622400000},
+]
+
+
+def local_time(timeLine: int) -> str:
+    return f"{datetime.fromtimestamp(timeLine / 1000)}"
+
+
+def expected_rows():
+    return [
+        {
+            "money": it["money"],
+            "tags": it["tags"],
+            "time_line": local_time(it["time_line"]),
+        }
+        for it in DOCS
+    ]
+
+
+def test_export_json_and_ndjson(tmp_path: Path):
+    path = tmp_path / "out.json"
+    assert money.MoneyLogExporter(Sequel.json, str(path)).export(iter(DOCS)) == 2
+    assert json.loads(path.read_text(encoding="UTF-8")) == expected_rows()
+
+    path = tmp_path / "out.ndjson"
+    money.MoneyLogExporter(Sequel.ndjson, str(path)).export(iter(DOCS))
+    lines = path.read_text(encoding="UTF-8").splitlines()
+    assert [json.loads(it) for it in lines] == expected_rows()
+
+
+def test_export_empty_json_is_valid(tmp_path: Path):
+    path = tmp_path / "out.json"
+    assert money.MoneyLogExporter(Sequel.json, str(path)).export(iter([])) == 0
+    assert json.loads(path.read_text(encoding="UTF-8")) == []
+
+
+def test_export_csv_with_gzip(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.chdir(tmp_path)
+    exporter = money.MoneyLogExporter(Sequel.csv, compress=True)
+    assert exporter.path == "./moneyLogs.csv.gz"
+    exporter.export(iter(DOCS))
+    with gzip.open(exporter.path, "rt", encoding="UTF-8") as fp:
+        assert fp.read().splitlines() == [
+            f"-12.5,餐饮,{local_time(DOCS[0]['time_line'])}",
+            f"30.0,报销;交通,{local_time(DOCS[1]['time_line'])}",
+        ]
+    # 路径以.gz结尾时自动压缩
+    assert money.MoneyLogExporter(Sequel.csv, "a.csv.gz").compress
+
+
+def test_export_to_stdout_keeps_stdout_open(capfdbinary: pytest.CaptureFixture):
+    money.MoneyLogExporter(Sequel.ndjson, "-").export(iter(DOCS))
+    print("之后还能打印")
+    lines = capfdbinary.readouterr().out.decode("UTF-8").splitlines()
+    assert [json.loads(it) for it in lines[:2]] == expected_rows()
+    assert lines[2] == "之后还能打印"
@@ -0,0 +1,62 @@
+from typing import Any, Dict, List
+
+from money_core import MoneyLog, BulkEdit, moneylog_fingerprint
+from sqlite_backend import SqliteConnection
+
+
+def test_fingerprint_ignores_tag_order():
+    a = moneylog_fingerprint(-12.5, ["b", "a"], 1000)
+    assert a == moneylog_fingerprint(-12.50001, ["a", "b"], 1000)
+    assert a != moneylog_fingerprint(-12.5, ["a", "b"], 1001)
+    assert a != moneylog_fingerprint(-12.5, ["a", "b"], 1000, "TX1")
+
+
+def test_reimport_skips_duplicates(
+    sqlite: SqliteConnection, ledger_docs: List[Dict[str, Any]]
+):
+    moneyLogs = [MoneyLog(**it) for it in ledger_docs]
+    first = sqlite.insertMany(iter(moneyLogs), chunk_size=64)
+    second = sqlite.insertMany(iter(moneyLogs), chunk_size=64)
+    assert (first.inserted, first.skipped) == (len(moneyLogs), 0)
+    assert (second.inserted, second.skipped, second.failed) == (0, len(moneyLogs), 0)
+    assert sqlite.count() == len(moneyLogs)
+
+
+def test_source_id_keeps_identical_bills_apart(sqlite: SqliteConnection):
+    moneyLogs = [
+        MoneyLog(money=-5, tags={"a"}, time_line=1000, source_id=it)
+        for it in ("TX1", "TX2", "TX1")
+    ]
+    report = sqlite.insertMany(iter(moneyLogs))
+    assert (report.inserted, report.skipped) == (2, 1)
+
+
+def test_edit_drops_fingerprint(sqlite: SqliteConnection):
+    moneyLog = MoneyLog(money=-5, tags={"a"}, time_line=1000)
+    sqlite.insertMany(iter([moneyLog]))
+    sqlite.updateMany({"money": -5}, BulkEdit(setMoney=-6))
+    report = sqlite.insertMany(iter([moneyLog]))
+    assert (report.inserted, report.skipped) == (1, 0)
+
+
+def test_dedup_removes_legacy_duplicates(sqlite: SqliteConnection):
+    with sqlite.db:
+        for tags in (["a", "b"], ["b", "a"], ["a", "b"], ["c"]):
+            cursor = sqlite.db.execute(
+                "INSERT INTO money_log (money, time_line) VALUES (-7.25, 1000)"
+            )
+            sqlite.db.executemany(
+                "INSERT INTO money_tag (log_id, tag) VALUES (?, ?)",
+                ((cursor.lastrowid, it) for it in tags),
+            )
+
+    assert sqlite.dedup() == (2, 2)
+    assert sqlite.count() == 2
+    assert sqlite.db.execute(
+        "SELECT COUNT(*) FROM money_log WHERE fingerprint IS NULL"
+    ).fetchone() == (0,)
+    # 补上指纹以后再导入同样的账单会被跳过
+    report = sqlite.insertMany(
+        iter([MoneyLog(money=-7.25, tags={"a", "b"}, time_line=1000)])
+    )
+    assert report.skipped == 1
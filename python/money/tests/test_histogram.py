@@ -0,0 +1,112 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+import pytest
+
+import money
+from money_core import MoneyLog, HistogramBucket, fold_buckets
+from sqlite_backend import SqliteConnection
+
+UTC8 = timezone(timedelta(hours=8))
+
+
+def ms(*args: int, tz: Any = UTC8) -> int:
+    return int(datetime(*args, tzinfo=tz).timestamp() * 1000)
+
+
+def test_fold_buckets_merges_slots():
+    slots = [
+        (ms(2024, 5, 6, 23, 45), -10.0, 1),
+        (ms(2024, 5, 7, 0, 0), -2.5, 2),
+        (ms(2024, 5, 12, 23, 59), 100.0, 1),
+        (ms(2024, 5, 13, 0, 0), 1.0, 1),
+    ]
+    assert fold_buckets(slots, HistogramBucket.day, UTC8) == {
+        date(2024, 5, 6): (-10.0, 1),
+        date(2024, 5, 7): (-2.5, 2),
+        date(2024, 5, 12): (100.0, 1),
+        date(2024, 5, 13): (1.0, 1),
+    }
+    # 周从周一开始， 2024-05-06和2024-05-13都是周一
+    assert fold_buckets(slots, HistogramBucket.week, UTC8) == {
+        date(2024, 5, 6): (87.5, 4),
+        date(2024, 5, 13): (1.0, 1),
+    }
+    assert fold_buckets(slots, HistogramBucket.hour, UTC8) == {
+        23: (90.0, 2),
+        0: (-1.5, 3),
+    }
+    assert fold_buckets(slots, HistogramBucket.weekday, UTC8) == {
+        1: (-9.0, 2),
+        2: (-2.5, 2),
+        7: (100.0, 1),
+    }
+    assert fold_buckets([], HistogramBucket.month, UTC8) == {}
+
+
+def test_fold_buckets_uses_timezone():
+    slot = [(ms(2024, 5, 31, 20, 0, tz=timezone.utc), 1.0, 1)]
+    assert fold_buckets(slot, HistogramBucket.month, timezone.utc) == {
+        date(2024, 5, 1): (1.0, 1)
+    }
+    assert fold_buckets(slot, HistogramBucket.month, UTC8) == {
+        date(2024, 6, 1): (1.0, 1)
+    }
+
+
+def test_keys_fill_gaps():
+    assert HistogramBucket.day.keys([date(2024, 2, 27), date(2024, 3, 1)]) == [
+        date(2024, 2, 27),
+        date(2024, 2, 28),
+        date(2024, 2, 29),
+        date(2024, 3, 1),
+    ]
+    assert HistogramBucket.week.keys([date(2024, 5, 20), date(2024, 5, 6)]) == [
+        date(2024, 5, 6),
+        date(2024, 5, 13),
+        date(2024, 5, 20),
+    ]
+    assert HistogramBucket.month.keys([date(2024, 11, 1), date(2025, 2, 1)]) == [
+        date(2024, 11, 1),
+        date(2024, 12, 1),
+        date(2025, 1, 1),
+        date(2025, 2, 1),
+    ]
+    assert HistogramBucket.day.keys([]) == []
+    assert HistogramBucket.hour.keys([3]) == list(range(24))
+    assert HistogramBucket.weekday.keys([]) == list(range(1, 8))
+
+
+@pytest.mark.parametrize("bucket", list(HistogramBucket))
+@pytest.mark.parametrize("name", ["+08:00", "-03:30", "Europe/Berlin"])
+def test_sqlite_histogram_matches_raw_docs(
+    sqlite: SqliteConnection,
+    ledger_docs: List[Dict[str, Any]],
+    bucket: HistogramBucket,
+    name: str,
+):
+    sqlite.insertMany(iter([MoneyLog(**it) for it in ledger_docs]))
+    zone = money.histogram_timezone(name)
+    query = {"money": {"$lt": 0}}
+    expected: Dict[Any, List[Any]] = {}
+    for it in ledger_docs:
+        if it["money"] < 0:
+            total = expected.setdefault(bucket.key(it["time_line"], zone[1]), [0.0, 0])
+            total[0] += it["money"]
+            total[1] += 1
+
+    result = sqlite.histogram(query, bucket, zone)
+    assert set(result) == set(expected)
+    for key, (total, count) in result.items():
+        assert total == pytest.approx(expected[key][0])
+        assert count == expected[key][1]
+    assert set(result) <= set(bucket.keys(result))
+
+
+def test_histogram_timezone_offsets():
+    assert money.histogram_timezone("+08:00") == ("+08:00", UTC8)
+    assert money.histogram_timezone("-0330")[0] == "-03:30"
+    name, tz = money.histogram_timezone("Europe/Berlin")
+    assert name == "Europe/Berlin"
+    # 夏令时前后同一个分组规则得到不同的UTC偏移
+    assert tz.utcoffset(datetime(2024, 1, 1)) != tz.utcoffset(datetime(2024, 7, 1))
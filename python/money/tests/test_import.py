@@ -0,0 +1,190 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+import codecs
+import io
+import json
+
+import pytest
+import typer
+from typer.testing import CliRunner
+
+import money
+from money_core import MoneyLog, ParseMoneyLogError
+from sqlite_backend import SqliteConnection
+
+LEDGER_CSV = """-12.5,餐饮,2024-05-01 12:00:00
+-3.2,交通 咖啡,2024-05-01 18:30:00
+3000,工资,2024-05-02 09:00:00
+-35,餐饮;餐补,2024-05-03 12:10:00
+这一行不是账单
+-120.5,房租,2024-05-04 20:00:00
+"""
+
+
+def test_insert_many_writes_in_chunks(
+    sqlite: SqliteConnection, ledger_docs: List[Dict[str, Any]]
+):
+    progress: List[int] = []
+    report = sqlite.insertMany(
+        iter([MoneyLog(**it) for it in ledger_docs]),
+        chunk_size=128,
+        progress=lambda it: progress.append(it.inserted),
+    )
+    assert (report.total, report.inserted, report.chunks, report.failed) == (
+        300,
+        300,
+        3,
+        0,
+    )
+    assert progress == [128, 256, 300]
+    assert report.errors == []
+    assert sqlite.count() == 300
+
+
+def test_mass_imports_csv(sqlite: SqliteConnection, tmp_path: Path):
+    path = tmp_path / "ledger.csv"
+    path.write_text(LEDGER_CSV, encoding="UTF-8")
+    result = CliRunner().invoke(money.app, ["mass", str(path), "--chunk-size", "2"])
+    assert result.exit_code == 0, result.output
+    assert sqlite.count() == 5
+    assert sqlite.summary().total == pytest.approx(-12.5 - 3.2 + 3000 - 35 - 120.5)
+
+
+def test_iter_json_array_across_read_boundaries():
+    docs = [
+        {"money": -1.5 * i, "tags": ["餐饮"], "time_line": 10**12 + i}
+        for i in range(50)
+    ]
+    text = json.dumps(docs, ensure_ascii=False, indent=1)
+    for readSize in (1, 3, 7, 64, 1 << 16):
+        assert list(money.iter_json_array(io.StringIO(text), readSize)) == docs
+    # 旧的导出文件使用单引号
+    assert list(money.iter_json_array(io.StringIO("[{'money': 1}]"))) == [{"money": 1}]
+    assert list(money.iter_json_array(io.StringIO("  \n"))) == []
+
+
+def test_iter_json_array_reads_lazily():
+    fp = io.StringIO("[" + ", ".join(["12345"] * 10000) + "]")
+    items = money.iter_json_array(fp, read_size=16)
+    assert next(items) == 12345
+    assert fp.tell() <= 32
+
+
+@pytest.mark.parametrize("text", ['{"money": 1}', "[1, 2", "[1, }"])
+def test_iter_json_array_rejects_invalid_files(text: str):
+    with pytest.raises(ParseMoneyLogError):
+        list(money.iter_json_array(io.StringIO(text), read_size=4))
+
+
+def test_iter_moneylog_file_reads_json_and_csv_source_id(tmp_path: Path):
+    path = tmp_path / "ledger.json"
+    path.write_text(
+        json.dumps(
+            [
+                {"money": -12.5, "tags": ["餐饮"], "time_line": "2024-05-01 12:00:00"},
+                {
+                    "money": 30,
+                    "tags": ["报销"],
+                    "time_line": "2024-05-02",
+                    "source_id": "TX1",
+                },
+            ],
+            ensure_ascii=False,
+        ),
+        encoding="UTF-8",
+    )
+    moneyLogs = list(money.iterMoneyLogFile(path))
+    assert [(it.money, it.tags, it.source_id) for it in moneyLogs] == [
+        (-12.5, {"餐饮"}, None),
+        (30, {"报销"}, "TX1"),
+    ]
+
+    path = tmp_path / "ledger.csv"
+    path.write_text("-3.2,交通,2024-05-01 18:30:00,TX2\n", encoding="UTF-8")
+    assert [it.source_id for it in money.iterMoneyLogFile(path)] == ["TX2"]
+
+    path.write_text('[{"money": 1, "tags": ["a"]}]', encoding="UTF-8")
+    with pytest.raises(ParseMoneyLogError):
+        list(money.iterMoneyLogFile(path.rename(tmp_path / "bad.json")))
+
+
+def test_detect_encoding_uses_supersets(tmp_path: Path):
+    path = tmp_path / "gbk.csv"
+    path.write_bytes(("-12.5,餐饮 午饭,2024-05-01 12:00:00\n" * 20).encode("GBK"))
+    assert codecs.lookup(money.detect_encoding(path)).name == "gb18030"
+
+    # 样本只有ASCII字符， 后面的中文也要能读出来
+    path = tmp_path / "utf8.csv"
+    path.write_text(
+        "-1,lunch,2024-05-01 12:00:00\n" * 100 + "-2,餐饮,2024-05-02 12:00:00\n",
+        encoding="UTF-8",
+    )
+    assert money.detect_encoding(path, sample_size=64) == "UTF-8"
+    assert len(list(money.iterMoneyLogFile(path))) == 101
+
+
+def test_expand_import_paths_dirs_globs_and_duplicates(tmp_path: Path):
+    for name in ["a.csv", "b.json", "notes.txt", "sub/c.csv", "sub/deep/d.json"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text("", encoding="UTF-8")
+
+    found = money.expand_import_paths(
+        [
+            tmp_path / "sub",
+            tmp_path / "*.csv",
+            tmp_path / "**/*.json",
+            tmp_path / "a.csv",
+        ]
+    )
+    assert [it.relative_to(tmp_path).as_posix() for it in found] == [
+        "sub/c.csv",
+        "sub/deep/d.json",
+        "a.csv",
+        "b.json",
+    ]
+
+
+def test_expand_import_paths_rejects_explicit_files(tmp_path: Path):
+    (tmp_path / "notes.txt").write_text("", encoding="UTF-8")
+    with pytest.raises(typer.BadParameter):
+        money.expand_import_paths([tmp_path / "notes.txt"])
+    with pytest.raises(typer.BadParameter):
+        money.expand_import_paths([tmp_path / "missing.csv"])
+    assert money.expand_import_paths([tmp_path / "*.csv"]) == []
+
+
+def test_mass_parallel_reports_each_file(
+    sqlite: SqliteConnection, ledger_docs: List[Dict[str, Any]], tmp_path: Path
+):
+    paths = [tmp_path / "ledger.csv", tmp_path / "first.json", tmp_path / "again.json"]
+    paths[0].write_text(LEDGER_CSV, encoding="UTF-8")
+    docs = [
+        {
+            **it,
+            "time_line": f"{datetime.fromtimestamp(it['time_line'] / 1000):%Y-%m-%d %H:%M:%S}",
+        }
+        for it in ledger_docs
+    ]
+    paths[1].write_text(json.dumps(docs[:120]), encoding="UTF-8")
+    # 第二个json文件和第一个有40条重复， 最后一条无效
+    paths[2].write_text(json.dumps(docs[80:200] + [{"money": 1}]), encoding="UTF-8")
+
+    progress: List[int] = []
+    report, files = money.mass_parallel(
+        paths,
+        chunk_size=32,
+        ordered=False,
+        jobs=2,
+        progress=lambda it: progress.append(it.total),
+    )
+    assert [it[:5] for it in files] == [
+        [str(paths[0]), 5, 5, 0, 0],
+        [str(paths[1]), 120, 120, 0, 0],
+        [str(paths[2]), 96, 56, 40, 0],
+    ]
+    assert files[0][5] == files[1][5] == ""
+    assert "无效的JSON账单记录" in files[2][5]
+    assert (report.total, report.inserted, report.skipped) == (221, 181, 40)
+    assert progress[-1] == report.total and len(progress) == report.chunks
+    assert sqlite.count() == 181
@@ -0,0 +1,64 @@
+from typing import Any, Dict, List
+import re
+
+import pytest
+import typer
+from typer.testing import CliRunner
+
+import money
+from money_core import MoneyLog
+from ledger_storage import MoneyLogCollection
+from sqlite_backend import SqliteConnection
+
+
+def all_pages(mls: MoneyLogCollection, size: int) -> List[List[MoneyLog]]:
+    pages, mark = [], ""
+    while True:
+        page, mark = mls.keysetPage(mark, size)
+        pages.append(page)
+        if mark == "":
+            return pages
+
+
+@pytest.mark.parametrize("sortMode", [{}, {"money": -1}, {"time_line": 1}])
+def test_keyset_pages_cover_the_sorted_ledger_once(
+    sqlite: SqliteConnection,
+    ledger_docs: List[Dict[str, Any]],
+    sortMode: Dict[str, int],
+):
+    sqlite.insertMany(iter([MoneyLog(**it) for it in ledger_docs]))
+    query = {"money": {"$lt": 0}}
+    pages = all_pages(MoneyLogCollection(sqlite, query, sortMode=sortMode), 17)
+    assert all(len(it) == 17 for it in pages[:-1]) and 0 < len(pages[-1]) <= 17
+
+    # 金额相同的账单再按照_id排序， 翻页时不会重复或者遗漏
+    field, direction = next(iter(sortMode.items()), ("_id", 1))
+    expected = sorted(
+        sqlite.iterDocs(query),
+        key=lambda it: (it[field], it["_id"]),
+        reverse=direction == -1,
+    )
+    assert [int(it.id) for page in pages for it in page] == [
+        it["_id"] for it in expected
+    ]
+
+
+def test_invalid_page_mark(sqlite: SqliteConnection):
+    mls = MoneyLogCollection(sqlite, {})
+    for mark in ("不是标志", "e30=", "eyJ2IjogMX0="):
+        with pytest.raises(typer.BadParameter):
+            mls.keysetPage(mark)
+
+
+def test_query_prints_next_page_mark(
+    sqlite: SqliteConnection, ledger_docs: List[Dict[str, Any]]
+):
+    sqlite.insertMany(iter([MoneyLog(**it) for it in ledger_docs[:25]]))
+    command = ["query", "--time-mode", "year", "--time-string", "=10"]
+    first = CliRunner().invoke(money.app, command + ["--page-size", "20"])
+    assert first.exit_code == 0, first.output
+    mark = re.search(r"--after (\S+)", first.output).group(1)
+    second = CliRunner().invoke(money.app, command + ["--after", mark])
+    assert second.exit_code == 0, second.output
+    assert "--after" not in second.output
+    assert first.output.count("标签") == 20 and second.output.count("标签") == 5
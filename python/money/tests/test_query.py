@@ -0,0 +1,90 @@
+from collections import Counter
+from typing import Any, Dict, Iterable, List
+
+import pytest
+
+import money
+from money_core import MoneyType, MoneyLog, TagTrie, MoneyLogBatch
+from sqlite_backend import SqliteConnection, compile_sql
+from conftest import LEDGER_TAGS
+
+QUERY_CASES = [
+    ("", MoneyType.all, ""),
+    ("", MoneyType.income, ""),
+    ("", MoneyType.outlay, "餐饮"),
+    ("> 10", MoneyType.all, ""),
+    ("<= 12", MoneyType.outlay, ""),
+    ("> 20", MoneyType.outlay, "交通 房租"),
+    ("0 - 50", MoneyType.income, ""),
+    ("10 - 40", MoneyType.outlay, ""),
+    ("12.5", MoneyType.all, ""),
+    ("", MoneyType.all, "餐*"),
+    ("", MoneyType.all, "[交房]* 咖?"),
+    ("", MoneyType.all, "没有*"),
+]
+
+
+def build(condition: str, moneyType: MoneyType, tags: str) -> Dict[str, Any]:
+    vocabulary = TagTrie.from_usage((it, 1, 0) for it in LEDGER_TAGS)
+    return money.build_query(
+        money.TimeQueryMode.range,
+        "2024-05-03 2024-06-20",
+        money.parse_condition(condition) if condition else None,
+        moneyType,
+        tags,
+        lambda: vocabulary,
+    )
+
+
+def rows(docs: Iterable[Dict[str, Any]]) -> Counter:
+    return Counter(
+        (it["money"], it["time_line"], tuple(sorted(it["tags"]))) for it in docs
+    )
+
+
+@pytest.mark.parametrize("condition,moneyType,tags", QUERY_CASES)
+def test_sqlite_and_snapshot_match_mongo_filters(
+    sqlite: SqliteConnection,
+    ledger_docs: List[Dict[str, Any]],
+    condition: str,
+    moneyType: MoneyType,
+    tags: str,
+):
+    mongomock = pytest.importorskip("mongomock")
+    collection = mongomock.MongoClient().db.money_log
+    collection.insert_many([dict(it) for it in ledger_docs])
+    sqlite.insertMany(iter([MoneyLog(**it) for it in ledger_docs]))
+    batch = MoneyLogBatch()
+    batch.extend_docs(ledger_docs)
+
+    query = build(condition, moneyType, tags)
+    expected = rows(collection.find(query))
+    assert len(expected) > 0 or tags == "没有*"
+    assert rows(sqlite.iterDocs(query)) == expected
+    assert rows(batch.select(query).docs()) == expected
+
+
+def test_compile_sql_rejects_unsupported_operator():
+    with pytest.raises(ValueError):
+        compile_sql({"money": {"$mod": [2, 0]}})
+
+
+def test_wildcard_without_match_selects_nothing():
+    query = build("", MoneyType.all, "没有*")
+    assert query["tags"] == {"$in": []}
+
+
+def test_outlay_condition_is_mirrored_to_negative_money():
+    assert build("> 20", MoneyType.outlay, "")["money"] == {"$lt": -20.0}
+    assert build("10 - 40", MoneyType.outlay, "")["money"] == {
+        "$lte": -10.0,
+        "$gte": -40.0,
+    }
+
+
+def test_sqlite_writes_stamp_updated_at(
+    sqlite: SqliteConnection, ledger_docs: List[Dict[str, Any]]
+):
+    sqlite.insert(MoneyLog(**ledger_docs[0]))
+    sqlite.insertMany(iter([MoneyLog(**it) for it in ledger_docs[1:10]]))
+    assert sqlite.count({"updated_at": {"$gt": 0}}) == 10
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+import random
+
+import pytest
+
+from money_core import MoneyLog, MoneyLogRenderer, display_width
+
+
+def reference_fmt(money: float, tags: List[str], time_line: int) -> str:
+    """
+    改用MoneyLogRenderer之前MoneyLog.fmt的实现， 打印的内容必须和它完全相同
+    """
+    now = datetime.now()
+    dt = datetime.fromtimestamp(time_line / 1000)
+    year = "" if now.year == dt.year else f"{dt.year}年"
+    month = "" if now.month == dt.month else f"{dt.month}月"
+    day = "" if now.day == dt.day else f"{dt.day}日"
+    amount = f"所得 {money:.2f}￥" if money >= 0 else f"支出 {+money:.2f}￥"
+    return f"{amount} {year}{month}{day} {dt.hour}点{dt.minute}分 标签： <{'  '.join(tags)}>"
+
+
+@pytest.fixture
+def rows(ledger_docs: List[Dict[str, Any]]) -> List[Any]:
+    """
+    测试账本加上今天 去年和同一天里乱序的账单
+    """
+    now = datetime.now()
+    rng = random.Random(3)
+    moments = [now, now - timedelta(days=400), now.replace(hour=0, minute=0)]
+    moments += [now - timedelta(minutes=rng.randint(0, 3000)) for _ in range(50)]
+    extra = [
+        (
+            rng.choice([-1.005, 0.0, 12.345]),
+            ["餐饮", "咖啡"],
+            int(it.timestamp() * 1000),
+        )
+        for it in moments
+    ]
+    return [(it["money"], it["tags"], it["time_line"]) for it in ledger_docs] + extra
+
+
+def test_renderer_lines_match_reference(rows: List[Any]):
+    renderer = MoneyLogRenderer()
+    for money, tags, timeLine in rows:
+        assert renderer.line(money, tags, timeLine) == reference_fmt(
+            money, tags, timeLine
+        )
+    money, tags, timeLine = rows[0]
+    moneyLog = MoneyLog(money=money, tags=set(tags[:1]), time_line=timeLine)
+    assert moneyLog.fmt() == reference_fmt(money, tags[:1], timeLine)
+
+
+def test_write_is_byte_identical_to_printing_each_line(
+    rows: List[Any], capsys: pytest.CaptureFixture, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(MoneyLogRenderer, "CHUNK_ROWS", 7)
+    assert MoneyLogRenderer().write(iter(rows), start=1) == len(rows)
+    expected = "".join(
+        f"{i}. --- {reference_fmt(*it)}\n" for i, it in enumerate(rows, 1)
+    )
+    assert capsys.readouterr().out == expected
+
+
+def test_align_pads_columns(rows: List[Any]):
+    renderer = MoneyLogRenderer(align=True)
+    lines = [renderer.line(*it) for it in rows]
+    # 对齐以后标签总是从同一列开始
+    assert len({display_width(it.split("标签")[0]) for it in lines}) == 1
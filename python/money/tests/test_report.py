@@ -0,0 +1,74 @@
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Any, Dict, List
+
+import pytest
+
+from money_core import MoneyLogBatch, ReportPeriod
+
+np = pytest.importorskip("numpy")
+from ledger_report import LedgerReport  # noqa: E402
+
+
+def report_of(docs: List[Dict[str, Any]]) -> LedgerReport:
+    batch = MoneyLogBatch()
+    batch.extend_docs(docs)
+    return LedgerReport(batch)
+
+
+def test_daily_and_monthly_periods(ledger_docs: List[Dict[str, Any]]):
+    daily: Dict[str, List[float]] = defaultdict(list)
+    for it in ledger_docs:
+        daily[date.fromtimestamp(it["time_line"] / 1000).isoformat()].append(
+            it["money"]
+        )
+
+    header, rows = report_of(ledger_docs).periods(ReportPeriod.day)
+    assert header[:3] == ["周期", "金额", "笔数"]
+    # 没有账单的日子也有一行， 金额为0
+    nonEmpty = {row[0]: row for row in rows if row[2] > 0}
+    assert set(nonEmpty) == set(daily)
+    for day, values in daily.items():
+        assert nonEmpty[day][1:3] == [f"{sum(values):.2f}", len(values)]
+
+    _, months = report_of(ledger_docs).periods(ReportPeriod.month)
+    assert [row[0] for row in months] == ["2024-05", "2024-06"]
+    assert sum(row[2] for row in months) == len(ledger_docs)
+
+
+def test_rolling_average_over_short_prefix():
+    begin = int(datetime(2024, 5, 1, 12).timestamp() * 1000)
+    docs = [
+        {
+            "money": -10.0 * (i + 1),
+            "tags": ["餐饮"],
+            "time_line": begin + i * 86_400_000,
+        }
+        for i in range(3)
+    ]
+    report = report_of(docs)
+    # 开头不足7天的按实际天数平均
+    assert report.rolling(7).tolist() == [-10.0, -15.0, -20.0]
+    assert report.rolling(2).tolist() == [-10.0, -15.0, -25.0]
+
+
+def test_tag_totals_and_percentiles(ledger_docs: List[Dict[str, Any]]):
+    report = report_of(ledger_docs)
+    totals: Dict[str, float] = defaultdict(float)
+    for it in ledger_docs:
+        for tag in it["tags"]:
+            totals[tag] += it["money"]
+    _, rows = report.tagTotals()
+    assert {row[0]: row[1] for row in rows} == {
+        tag: f"{value:.2f}" for tag, value in totals.items()
+    }
+    assert [row[0] for row in rows] == sorted(totals, key=lambda it: -abs(totals[it]))
+
+    outlay = [-it["money"] for it in ledger_docs if it["money"] < 0]
+    _, rows = report.percentiles([50, 90])
+    assert rows == [
+        ["p50", f"{np.percentile(outlay, 50):.2f}"],
+        ["p90", f"{np.percentile(outlay, 90):.2f}"],
+    ]
+    income = [it for it in ledger_docs if it["money"] > 0]
+    assert report_of(income).percentiles([50])[1] == [["p50", "-"]]
@@ -0,0 +1,132 @@
+from datetime import datetime
+from typing import Any, Dict, List
+import random
+
+import pytest
+
+import money
+from money_core import MoneyLog, BulkEdit
+from conftest import LEDGER_BEGIN, LEDGER_TAGS
+
+mongo_backend = pytest.importorskip("mongo_backend")
+MongoConnection = mongo_backend.MongoConnection
+
+
+def whole_days(begin: str, end: str) -> Dict[str, Any]:
+    return money.build_query(money.TimeQueryMode.range, f"{begin} {end}")
+
+
+def test_plan_covers_whole_day_ranges():
+    query = whole_days("2024-05-03", "2024-05-05")
+    begin, end, fullBegin, fullEnd, rollupQuery = MongoConnection.planRollups(query)
+    assert fullBegin == begin == int(datetime(2024, 5, 3).timestamp() * 1000)
+    assert fullEnd == int(datetime(2024, 5, 6).timestamp() * 1000) > end
+    assert rollupQuery["tag"] == mongo_backend.ROLLUP_ALL_TAGS
+
+    oneDay = MongoConnection.planRollups(whole_days("2024-05-03", "2024-05-03"))
+    assert oneDay is not None and oneDay[2] < oneDay[3]
+
+
+def test_plan_keeps_partial_days_raw():
+    begin = int(datetime(2024, 5, 3, 12).timestamp() * 1000)
+    end = int(datetime(2024, 5, 6, 8).timestamp() * 1000)
+    plan = MongoConnection.planRollups({"time_line": {"$gte": begin, "$lte": end}})
+    assert plan[2] == int(datetime(2024, 5, 4).timestamp() * 1000)
+    assert plan[3] == int(datetime(2024, 5, 6).timestamp() * 1000)
+    inside = {"time_line": {"$gte": begin, "$lte": begin + 3_600_000}}
+    assert MongoConnection.planRollups(inside) is None
+
+
+def test_last_millisecond_of_range_is_counted(mongo: Any):
+    lastSecond = int(datetime(2024, 5, 5, 23, 59, 59, 500000).timestamp() * 1000)
+    mongo.insertMany(
+        iter(
+            [
+                MoneyLog(money=-3, tags={"咖啡"}, time_line=lastSecond),
+                MoneyLog(money=-5, tags={"咖啡"}, time_line=lastSecond - 86_400_000),
+            ]
+        )
+    )
+    mongo.rebuildRollups()
+    query = whole_days("2024-05-03", "2024-05-05")
+    assert query["time_line"]["$lte"] == lastSecond + 499
+    assert mongo.summary(query).count == mongo.rawSummary(query).count == 2
+
+    # 结束时间不是最后一毫秒的时候， 最后一天不算完整的一天， 从原始账单统计
+    cut = {"time_line": {"$gte": query["time_line"]["$gte"], "$lte": lastSecond - 499}}
+    plan = MongoConnection.planRollups(cut)
+    assert plan[3] == int(datetime(2024, 5, 5).timestamp() * 1000)
+    assert mongo.summary(cut).count == mongo.rawSummary(cut).count == 1
+
+
+def test_plan_rejects_unsupported_filters():
+    query = whole_days("2024-05-03", "2024-05-05")
+    assert MongoConnection.planRollups({**query, "money": {"$gt": 10}}) is None
+    assert MongoConnection.planRollups({**query, "tags": {"$in": ["a", "b"]}}) is None
+
+
+def random_queries(count: int) -> List[Dict[str, Any]]:
+    rng = random.Random(11)
+    queries = []
+    for _ in range(count):
+        begin = LEDGER_BEGIN + rng.randint(-86_400, 60 * 86_400) * 1000
+        end = begin + rng.randint(0, 30 * 86_400) * 1000
+        query: Dict[str, Any] = {"time_line": {"$gte": begin, "$lte": end}}
+        if rng.random() < 0.3:
+            query["money"] = {"$gt": 0}
+        elif rng.random() < 0.5:
+            query["money"] = {"$lt": 0}
+        if rng.random() < 0.5:
+            query["tags"] = {"$in": [rng.choice(LEDGER_TAGS)]}
+        queries.append(query)
+    queries.append(whole_days("2024-05-01", "2024-05-31"))
+    queries.append({**whole_days("2024-05-10", "2024-05-10"), "money": {"$lt": 0}})
+    return queries
+
+
+def assert_summaries_match(storage: Any, queries: List[Dict[str, Any]]):
+    for query in queries:
+        rolled, raw = storage.summary(query), storage.rawSummary(query)
+        assert rolled.total == pytest.approx(raw.total), query
+        assert (rolled.count, rolled.first, rolled.last) == (
+            raw.count,
+            raw.first,
+            raw.last,
+        ), query
+
+
+def test_rollup_summary_matches_raw(mongo: Any, ledger_docs: List[Dict[str, Any]]):
+    mongo.insertMany(iter([MoneyLog(**it) for it in ledger_docs]))
+    assert mongo.rebuildRollups() > 0
+    assert mongo.hasRollups()
+    assert_summaries_match(mongo, random_queries(40))
+
+    # 写入 删除和修改以后汇总表仍然和原始账单一致
+    docs = list(mongo.collection.find({}).sort("time_line", 1))
+    for it in docs[:20]:
+        mongo.delete(str(it["_id"]))
+    for it in docs[20:30]:
+        moneyLog = MoneyLog(**it)
+        moneyLog.money = -moneyLog.money
+        moneyLog.tags = {"咖啡"}
+        mongo.updateOne(moneyLog)
+    mongo.updateMany(
+        {"tags": {"$in": ["房租"]}}, BulkEdit(addTags={"交通"}, scaleMoney=2)
+    )
+    mongo.insertMany(
+        iter([MoneyLog(money=-9, tags={"餐饮"}, time_line=LEDGER_BEGIN + 5)])
+    )
+    assert_summaries_match(mongo, random_queries(40))
+
+
+def test_summaries_facet_matches_summary(mongo: Any, ledger_docs: List[Dict[str, Any]]):
+    mongo.insertMany(iter([MoneyLog(**it) for it in ledger_docs]))
+    queries = random_queries(6)
+    for facet, query in zip(mongo.summaries(queries), queries):
+        raw = mongo.rawSummary(query)
+        assert facet.total == pytest.approx(raw.total)
+        assert (facet.count, facet.first, facet.last) == (
+            raw.count,
+            raw.first,
+            raw.last,
+        )
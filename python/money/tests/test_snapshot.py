@@ -0,0 +1,102 @@
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+import json
+
+import pytest
+
+from money_core import MoneyLog
+import ledger_snapshot
+from ledger_snapshot import LedgerSnapshot, SYNC_SAFETY_MARGIN
+from conftest import LEDGER_BEGIN
+
+mongo_backend = pytest.importorskip("mongo_backend")
+
+
+def rows(docs: Iterable[Dict[str, Any]]) -> Counter:
+    return Counter(
+        (it["money"], it["time_line"], tuple(sorted(it["tags"]))) for it in docs
+    )
+
+
+def assert_snapshot_matches(snapshot: LedgerSnapshot, storage: Any):
+    batch = snapshot.load()
+    assert snapshot.meta()["rows"] == len(batch)
+    assert rows(batch.docs()) == rows(storage.iterDocs({}))
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> List[int]:
+    """
+    写入账单和同步快照共用的时钟， 测试里手动拨快
+    """
+    now = [LEDGER_BEGIN]
+    monkeypatch.setattr(mongo_backend, "now_timestamp", lambda: now[0])
+    monkeypatch.setattr(ledger_snapshot, "now_timestamp", lambda: now[0])
+    return now
+
+
+def test_incremental_sync_with_tombstones(
+    mongo: Any, ledger_docs: List[Dict[str, Any]], tmp_path: Path, clock: List[int]
+):
+    snapshot = LedgerSnapshot(tmp_path / "snapshot")
+    mongo.insertMany(iter([MoneyLog(**it) for it in ledger_docs[:200]]))
+    clock[0] += 10 * SYNC_SAFETY_MARGIN
+    assert snapshot.sync(mongo) == (200, 0, 0)
+    assert_snapshot_matches(snapshot, mongo)
+
+    clock[0] += 10 * SYNC_SAFETY_MARGIN
+    docs = list(mongo.collection.find({}).sort("time_line", 1).limit(10))
+    for it in docs[:3]:
+        mongo.delete(str(it["_id"]))
+    for it in docs[3:7]:
+        moneyLog = MoneyLog(**it)
+        moneyLog.money, moneyLog.tags = -4.0, {"修改"}
+        mongo.updateOne(moneyLog)
+    mongo.insertMany(iter([MoneyLog(**it) for it in ledger_docs[200:]]))
+    # 快照里从来没有的账单被删除， 不算作删除
+    mongo.delete(str(mongo.insert(MoneyLog(**ledger_docs[0])).id))
+
+    assert snapshot.sync(mongo) == (100, 4, 3)
+    assert_snapshot_matches(snapshot, mongo)
+    assert rows(snapshot.load().select({"tags": {"$in": ["修改"]}}).docs()) == Counter(
+        {(-4.0, it["time_line"], ("修改",)): 1 for it in docs[3:7]}
+    )
+
+    # 水位之前留有余量， 再次同步会重新下载上次同步之前刚写入的账单， 但内容不变
+    clock[0] += 10 * SYNC_SAFETY_MARGIN
+    assert snapshot.sync(mongo) == (0, 104, 0)
+    assert_snapshot_matches(snapshot, mongo)
+    assert snapshot.sync(mongo) == (0, 0, 0)
+    assert snapshot.sync(mongo, full=True) == (mongo.count(), 0, 0)
+    assert_snapshot_matches(snapshot, mongo)
+
+
+def test_snapshot_with_id_watermark_is_synced_again(
+    mongo: Any, ledger_docs: List[Dict[str, Any]], tmp_path: Path
+):
+    snapshot = LedgerSnapshot(tmp_path / "snapshot")
+    mongo.insertMany(iter([MoneyLog(**it) for it in ledger_docs[:50]]))
+    snapshot.sync(mongo)
+    meta = snapshot.meta()
+    meta["last_id"] = "0" * 24
+    (tmp_path / "snapshot" / "meta.json").write_text(json.dumps(meta))
+    assert snapshot.sync(mongo) == (50, 0, 0)
+    assert "last_id" not in snapshot.meta()
+    assert_snapshot_matches(snapshot, mongo)
+
+
+def test_local_query_uses_snapshot_filters(
+    mongo: Any, ledger_docs: List[Dict[str, Any]], tmp_path: Path
+):
+    snapshot = LedgerSnapshot(tmp_path / "snapshot")
+    mongo.insertMany(iter([MoneyLog(**it) for it in ledger_docs]))
+    snapshot.sync(mongo)
+    query = {
+        "time_line": {"$gte": LEDGER_BEGIN, "$lte": LEDGER_BEGIN + 20 * 86_400_000},
+        "money": {"$lt": 0},
+        "tags": {"$in": ["餐饮", "咖啡"]},
+    }
+    local = snapshot.load().select(query)
+    assert rows(local.docs()) == rows(mongo.iterDocs(query))
+    assert local.summary().count == mongo.rawSummary(query).count
@@ -0,0 +1,42 @@
+from pathlib import Path
+from typing import List, Set
+import subprocess
+import sys
+
+import pytest
+
+from conftest import write_config
+
+MONEY_SCRIPT = Path(__file__).parent.parent / "money.py"
+
+
+def imported_modules(args: List[str]) -> Set[str]:
+    """
+    在新进程里运行money.py， 用 -X importtime 列出导入的顶层模块
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", str(MONEY_SCRIPT), *args],
+        capture_output=True,
+        text=True,
+        encoding="UTF-8",
+    )
+    assert process.returncode == 0, process.stderr
+    return {
+        line.rsplit("|", 1)[1].strip().split(".")[0]
+        for line in process.stderr.splitlines()
+        if line.startswith("import time:") and "|" in line
+    }
+
+
+def test_help_skips_slow_dependencies():
+    modules = imported_modules(["--help"])
+    assert {"money_core", "ledger_storage"} <= modules
+    assert not modules & {"pydantic", "pymongo", "sqlite3", "numpy", "chardet"}
+
+
+def test_sqlite_summary_skips_pydantic(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.chdir(tmp_path)
+    write_config(backend="sqlite", sqlite_path=str(tmp_path / "money.db"))
+    modules = imported_modules(["query", "--sequel", "total"])
+    assert "sqlite_backend" in modules
+    assert not modules & {"pydantic", "money_models", "pymongo", "mongo_backend"}
@@ -0,0 +1,35 @@
+from money_core import MoneyLog, TagTrie
+from sqlite_backend import SqliteConnection
+
+USAGE = [("餐饮", 9, 300), ("餐补", 2, 200), ("餐厅", 5, 100), ("交通", 7, 400)]
+
+
+def test_complete_orders_by_usage():
+    tagTrie = TagTrie.from_usage(USAGE)
+    assert tagTrie.complete("餐") == ["餐饮", "餐厅", "餐补"]
+    assert tagTrie.complete("餐", limit=2) == ["餐饮", "餐厅"]
+    assert tagTrie.complete("") == ["餐饮", "交通", "餐厅", "餐补"]
+    assert tagTrie.complete("房") == []
+
+
+def test_expand_wildcards():
+    tagTrie = TagTrie.from_usage(USAGE)
+    assert sorted(tagTrie.expand("餐*")) == ["餐厅", "餐补", "餐饮"]
+    assert tagTrie.expand("?通") == ["交通"]
+    assert sorted(tagTrie.expand("[交餐][通饮]")) == ["交通", "餐饮"]
+    assert tagTrie.expand("房*") == []
+    # 没有通配符的标签原样返回， 不要求在字典里
+    assert tagTrie.expand("房租") == ["房租"]
+
+
+def test_sqlite_tag_usage(sqlite: SqliteConnection):
+    sqlite.insertMany(
+        iter(
+            [
+                MoneyLog(money=-1, tags={"餐饮", "交通"}, time_line=1000),
+                MoneyLog(money=-2, tags={"餐饮"}, time_line=3000),
+            ]
+        )
+    )
+    tagTrie = sqlite.tagTrie()
+    assert tagTrie.usage == {"餐饮": (2, 3000), "交通": (1, 1000)}